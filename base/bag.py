@@ -0,0 +1,118 @@
+import asyncio
+import time
+from miniros.base.client import AsyncROSClient
+from miniros.util.bag import BagReader, BagWriter, CHUNK_SIZE
+from miniros.util.datatypes import Bytes
+from miniros.util.sock import QueuePolicy
+
+FLUSH_INTERVAL = 1.0 # seconds, buffered messages of quiet topics are written at least this often
+PLAY_START_DELAY = 1.0 # seconds between creating topics and first message, so subscribers can find them
+
+def parse_topic(topic: str) -> tuple[str, str]:
+    """
+    :param topic: "node/field"
+    """
+
+    node, _, field = topic.partition("/")
+
+    if not node or not field:
+        raise ValueError(f"topic must be node/field, not '{topic}'")
+
+    return node, field
+
+async def record(path: str, topics: list[tuple[str, str]], ip: str = "localhost", port: int = 3000, name: str = "record", duration: float | None = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Records raw payloads of topics into bag until cancelled or connection is closed.
+
+    Handlers only buffer messages, chunks are written by bag`s writer thread. Recorder asks server for BLOCK queue policy,
+    so publishers wait instead of recorder`s messages being dropped when it falls behind
+
+    :param topics: (node, field) list
+    :param duration: seconds to record, until cancelled if None
+    :return: recorded messages count
+    """
+
+    writer = BagWriter(path, chunk_size)
+
+    client = AsyncROSClient(name, ip, port, queue_policy=QueuePolicy.BLOCK)
+    task = asyncio.create_task(client.run())
+
+    def handler(node: str, field: str):
+        async def on_message(data: bytes) -> None:
+            writer.add(node, field, data)
+
+        return on_message
+
+    try:
+        await client.wait(sub_when_activated=False)
+        await client.client.subscribe_many([(node, field, handler(node, field)) for node, field in topics])
+
+        deadline = None if duration is None else time.monotonic() + duration
+
+        while not task.done() and (deadline is None or time.monotonic() < deadline):
+            await asyncio.sleep(FLUSH_INTERVAL if deadline is None else max(0.0, min(FLUSH_INTERVAL, deadline - time.monotonic())))
+            writer.flush()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        writer.close()
+
+    return writer.messages
+
+async def play(path: str, ip: str = "localhost", port: int = 3000, rate: float = 1.0, topics: list[tuple[str, str]] | None = None, prefix: str = "", start_delay: float = PLAY_START_DELAY) -> int:
+    """
+    Republishes bag`s messages, every recorded node is played by its own client with the same name
+
+    :param rate: speed relative to recording, 1.0 keeps original timing, 0 publishes as fast as possible
+    :param topics: (node, field) list, all recorded topics if None
+    :param prefix: added to node names, e.g. when recorded nodes are running too
+    :return: published messages count
+    """
+
+    bag = BagReader(path)
+
+    selected = [topic for topic in bag.topics.values() if topics is None or topic in topics]
+    clients = {node: AsyncROSClient(prefix + node, ip, port) for node in sorted({node for node, _ in selected})}
+    tasks = [asyncio.create_task(client.run()) for client in clients.values()]
+
+    count = 0
+    messages = bag.messages(selected)
+
+    try:
+        for client in clients.values():
+            await client.wait(sub_when_activated=False)
+
+        posts = {(node, field): await clients[node].topic(field, Bytes) for node, field in selected}
+
+        await asyncio.sleep(start_delay)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first = None
+
+        for stamp, node, field, payload in messages:
+            if rate > 0:
+                if first is None:
+                    first = stamp
+
+                delay = start + (stamp - first) / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            await posts[(node, field)].post(payload)
+            count += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # payloads are views over bag`s memory map, it can`t be closed while they exist,
+        # closed iterator releases the ones merged messages keep
+        messages.close()
+        payload = None
+
+        bag.close()
+
+    return count
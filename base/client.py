@@ -1,8 +1,12 @@
 from miniros.util.sock import TCPSockClient as SockClient
 from miniros.util.sock import AsyncDistrubutedClient as AsyncSockClient
+from miniros.util.sock import Compression, QueuePolicy, QoS, CALL_TIMEOUT, GET_TIMEOUT, SERVICE_CONCURRENCY
 import asyncio
 import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
 from miniros.util.datatypes import Datatype
+from miniros.util.shm import ShmRing, SharedArray
+from miniros.util.trace import TraceAggregator
 from miniros.util.decorators import decorators
 from typing import Callable
 import time
@@ -21,21 +25,70 @@ class Topic:
         self.post_func(self.field, self.encoder.encode(data))
 
 class AsyncTopic:
-    def __init__(self, field: str, encoder: Datatype, post_func: Callable[[str, bytearray], Any]):
+    def __init__(self, field: str, encoder: Datatype, post_func: Callable[[str, bytearray], Any], compression: Compression | None = None, executor: Executor | None = None):
+        """
+        :param executor: runs encoder if its encoding is slow (see Datatype.OFFLOAD), so event loop isn`t blocked
+        """
+
         self.post_func = post_func
         self.field = field
         self.encoder = encoder
+        self.compression = compression
+        self.executor = executor
+
+    async def post(self, data: Any) -> None:
+        if self.encoder.OFFLOAD and self.executor is not None:
+            encoded = await asyncio.get_running_loop().run_in_executor(self.executor, self.encoder.encode, data)
+        else:
+            encoded = self.encoder.encode(data)
+
+        await self.post_func(self.field, encoded, self.compression)
+
+class ShmTopic(Topic):
+    """
+    Topic which sends numpy arrays (and OpenCV images) to same-host subscribers through shared memory ring.
+    Only slot descriptors go through the server, subscribers decode them with SharedArray
+
+    :param slots: number of ring slots, subscriber`s view is overwritten after this many newer messages
+    :param slot_size: max array size in bytes. Size of the first posted array is used if None
+    """
+
+    def __init__(self, field: str, post_func: Callable[[str, bytearray], Any], slots: int = 4, slot_size: int | None = None):
+        super().__init__(field, SharedArray, post_func)
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ring = None
+
+    def write(self, data: Any) -> bytes:
+        if self.ring is None:
+            self.ring = ShmRing(self.slots, self.slot_size or data.nbytes)
 
+        return self.ring.write(data)
+
+    def post(self, data: Any) -> None:
+        self.post_func(self.field, self.write(data))
+
+    def close(self) -> None:
+        if self.ring is not None:
+            self.ring.close()
+
+class AsyncShmTopic(ShmTopic):
     async def post(self, data: Any) -> None:
-        await self.post_func(self.field, self.encoder.encode(data))
+        # descriptors are tiny, compressing them is a waste
+        await self.post_func(self.field, self.write(data), Compression.RAW)
 
 class ROSClient:
     def __init__(self, name: str, ip: str = "localhost", port: int = 3000):
+        """
+        :param ip: server host or address string, e.g. "unix:/tmp/miniros.sock" or "tcp://host:port"
+        """
+
         self.name = name
         self.ip = ip
         self.port = port
 
-        self.client = SockClient(ip, port, name)
+        self.client = self._create_client()
         self.run_thread = None
         
         self.fields = []
@@ -51,6 +104,9 @@ class ROSClient:
                     field = data[0]
                     self.client.anon_handlers[field] = self.__getattribute__(c)
 
+    def _create_client(self) -> SockClient:
+        return SockClient(self.ip, self.port, self.name)
+
     @decorators.threaded()
     def _run(self):
         self.client.mainloop()
@@ -65,32 +121,60 @@ class ROSClient:
 
         return self.run_thread
 
-    def topic(self, field: str, datatype: Datatype):
+    def topic(self, field: str, datatype: Datatype, latched: bool = False):
+        """
+        Creates topic
+
+        :param latched: last posted value is sent to new subscribers right away
+        """
+
+        if latched:
+            self.client.declare(field, latched=True)
+
         self.client.post(field, b"")
         return Topic(field, datatype, self.client.post)
     
+    def shm_topic(self, field: str, slots: int = 4, slot_size: int | None = None) -> ShmTopic:
+        """
+        Creates topic for numpy arrays which are passed to same-host subscribers through shared memory
+
+        :param slots: number of ring slots, subscriber`s view is overwritten after this many newer messages
+        :param slot_size: max array size in bytes. Size of the first posted array is used if None
+        """
+
+        self.client.post(field, b"")
+        return ShmTopic(field, self.client.post, slots, slot_size)
+
     def anon(self, node: str, field: str, data: bytearray):
         self.client.anon(node, field, data)
 
 class AsyncROSClient(ROSClient):
-    def __init__(self, name, ip = "localhost", port = 3000):
+    def __init__(self, name, ip = "localhost", port = 3000, compression: Compression = Compression.ADAPTIVE, queue_policy: QueuePolicy | None = None, direct: bool = False, direct_address: str | None = None, tracer: TraceAggregator | None = None, codec_threads: int | None = None, service_concurrency: int = SERVICE_CONCURRENCY):
+        """
+        :param direct: exchange topic data directly with other direct nodes, server only tracks the graph
+        :param direct_address: address of direct listener, chosen automatically if None
+        :param tracer: collects latency histograms of received traced topics
+        :param codec_threads: size of thread pool for slow datatypes (e.g. OpenCVImage), ThreadPoolExecutor`s default if None
+        :param service_concurrency: calls of each srv_ service handled at once, others wait
+        """
+
+        self.compression = compression
+        self.queue_policy = queue_policy
+        self.direct = direct
+        self.direct_address = direct_address
+
+        self.executor = ThreadPoolExecutor(codec_threads, thread_name_prefix=f"{name}-codec")
+
         super().__init__(name, ip, port)
 
-        self.client = AsyncSockClient(ip, port, name)
+        self.client.tracer = tracer
 
-        self.fields = []
-        self.client.anon_handlers = {}
-        
         for c in self.__class__.__dict__:
-            if c.startswith("on_"):
-                data = c.split("_")[1:]
+            if c.startswith("srv_"):
+                self.client.service(c[4:], self.__getattribute__(c), service_concurrency)
 
-                if len(data) == 2:
-                    node, field = data
-                    self.fields.append((node, field, self.__getattribute__(c)))
-                else:
-                    field = data[0]
-                    self.client.anon_handlers[field] = self.__getattribute__(c)
+    def _create_client(self) -> AsyncSockClient:
+        return AsyncSockClient(self.ip, self.port, self.name, self.compression, self.queue_policy, self.direct, self.direct_address)
 
     async def wait(self, sub_when_activated: bool = True):
         """
@@ -99,7 +183,7 @@ class AsyncROSClient(ROSClient):
         Can be used when running client mainloop and main code with asyncio.gather
         """
 
-        while not self.client._is_running or self.client.w is None or self.client.r is None:
+        while not self.client._is_running or not self.client._is_authorized:
             await asyncio.sleep(0.1)
 
         if sub_when_activated:
@@ -107,19 +191,122 @@ class AsyncROSClient(ROSClient):
 
     async def sub(self):
         """
-        Subscribe to provided topic handlers
+        Subscribe to provided topic handlers, handlers with QoS (see decorators.qos) are subscribed one by one
         """
 
-        for (node, field, handler) in self.fields:
-            await self.client.subscribe(node, field, handler)
+        await self.client.subscribe_many((node, field, handler) for node, field, handler in self.fields if getattr(handler, "qos", None) is None)
+
+        for node, field, handler in self.fields:
+            if getattr(handler, "qos", None) is not None:
+                await self.client.subscribe(node, field, handler, handler.qos)
+
+    async def subscribe(self, node: str, field: str, handler: Callable, qos: QoS | None = None):
+        """
+        :param qos: server sends only part of messages, e.g. QoS(max_rate=10) for UI which needs 10 Hz
+        """
+
+        await self.client.subscribe(node, field, handler, qos)
 
     async def run(self):
-        await self.client.mainloop()
+        try:
+            await self.client.mainloop()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def decode(self, datatype: Datatype, data: bytes) -> Any:
+        """
+        Decodes received data, in client`s thread pool if datatype is slow to decode (see Datatype.OFFLOAD)
+        """
+
+        if datatype.OFFLOAD:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, datatype.decode, data)
+
+        return datatype.decode(data)
+
+    async def topic(self, field: str, datatype: Datatype, compression: Compression | None = None, latched: bool = False, trace: bool = False):
+        """
+        Creates topic
+
+        :param compression: compression policy for topic frames. Connection`s policy is used if None,
+            frames of already compressed datatypes (e.g. JPEG images) aren`t compressed
+        :param latched: last posted value is sent to new subscribers right away (e.g. maps, configuration)
+        :param trace: posts carry sequence number and timestamps, handlers with trace parameter get them as Trace
+        """
+
+        if compression is None and datatype.COMPRESSED:
+            compression = Compression.RAW
+
+        if trace:
+            self.client.trace(field)
 
-    async def topic(self, field: str, datatype: Datatype):
-        await self.client.post(field, b"")
-        return AsyncTopic(field, datatype, self.client.post)
+        if not await self.client.declare(field, compression, latched):
+            await self.client.post(field, b"")
+
+        return AsyncTopic(field, datatype, self.client.post, compression, self.executor)
     
+    async def shm_topic(self, field: str, slots: int = 4, slot_size: int | None = None) -> AsyncShmTopic:
+        """
+        Creates topic for numpy arrays which are passed to same-host subscribers through shared memory
+
+        :param slots: number of ring slots, subscriber`s view is overwritten after this many newer messages
+        :param slot_size: max array size in bytes. Size of the first posted array is used if None
+        """
+
+        if not await self.client.declare(field, Compression.RAW):
+            await self.client.post(field, b"")
+
+        return AsyncShmTopic(field, self.client.post, slots, slot_size)
+
+    async def subscribe_pattern(self, node: str, field: str, handler: Callable):
+        """
+        Subscribes to existing and future topics which match patterns, e.g. ("*", "pos") or ("camera*", "image")
+
+        :param handler: async (data, node, field)
+        """
+
+        await self.client.subscribe_pattern(node, field, handler)
+
+    async def unsubscribe_pattern(self, node: str, field: str):
+        await self.client.unsubscribe_pattern(node, field)
+
+    def service(self, name: str, handler: Callable, concurrency: int = SERVICE_CONCURRENCY):
+        """
+        Registers service, same as srv_<name> method
+
+        :param handler: async (data, caller node) -> reply bytes
+        :param concurrency: calls handled at once, others wait
+        """
+
+        self.client.service(name, handler, concurrency)
+
+    async def call(self, node: str, service: str, data: bytes = b"", timeout: float | None = CALL_TIMEOUT) -> bytes:
+        """
+        Calls node`s service and returns its reply
+
+        :param timeout: seconds, raises TimeoutError after it. No limit if None
+        """
+
+        return await self.client.call(node, service, data, timeout)
+
+    async def get(self, node: str, field: str, timeout: float | None = GET_TIMEOUT) -> bytes | None:
+        """
+        Reads last posted value of topic without subscribing
+
+        :return: value, b"" if nothing was posted yet, None if topic doesn`t exist
+        """
+
+        return await self.client.get(node, field, timeout)
+
+    async def get_many(self, topics: list[tuple[str, str]], timeout: float | None = GET_TIMEOUT) -> dict[tuple[str, str], bytes | None]:
+        """
+        Reads last posted values of several topics with one request
+
+        :param topics: (node, field) list
+        :return: (node, field) -> value, b"" if nothing was posted yet, None if topic doesn`t exist
+        """
+
+        return await self.client.get_many(topics, timeout)
+
     async def anon(self, node: str, field: str, data: bytes, /, force_to_tcp: bool = False):
         await self.client.anon(node, field, data, force_to_tcp)
 
@@ -1,13 +1,53 @@
 import asyncio
+import multiprocessing
 from ..util.sock import AsyncDistributedServer
 # from ..util.sock import UDPSockServer as SockServer # UNSTABLE
 
 import logging
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(levelname)s] > %(message)s")
 
-async def run(host, port):
-    s = AsyncDistributedServer(host, port)
-    return await s.run()
+WORKER_START_TIMEOUT = 10 # seconds
+
+def _run_worker(host, port, unix_path, index, ready):
+    s = AsyncDistributedServer(host, port, unix_path=unix_path, worker_index=index)
+
+    # front server sends workers to clients, so they must be listening first
+    asyncio.run(s.run(listening=ready.set))
+
+def worker_addresses(host, port, unix_path, workers):
+    """
+    :return: (TCP port, unix socket path) of each worker, worker i listens on port + 1 + i and unix_path.i
+    """
+
+    return [(None if host is None else port + 1 + i, None if unix_path is None else f"{unix_path}.{i}") for i in range(workers)]
+
+async def run(host, port, unix_path=None, workers=0):
+    """
+    :param workers: number of broker worker processes, topics are partitioned between them (see AsyncDistributedServer workers)
+    """
+
+    addresses = worker_addresses(host, port, unix_path, workers)
+    processes = []
+
+    for index, (worker_port, worker_path) in enumerate(addresses):
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=_run_worker, args=(host, worker_port, worker_path, index, ready), daemon=True)
+        process.start()
+
+        processes.append((process, ready))
+
+    loop = asyncio.get_running_loop()
+    for process, ready in processes:
+        if not await loop.run_in_executor(None, ready.wait, WORKER_START_TIMEOUT) or not process.is_alive():
+            raise RuntimeError(f"broker worker {process.name} didn`t start")
+
+    s = AsyncDistributedServer(host, port, unix_path=unix_path, workers=addresses or None)
+
+    try:
+        return await s.run()
+    finally:
+        for process, _ in processes:
+            process.terminate()
 
 if __name__ == "__main__":
-    asyncio.run(run("localhost", 3000))
\ No newline at end of file
+    asyncio.run(run("localhost", 3000))
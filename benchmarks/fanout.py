@@ -0,0 +1,97 @@
+"""
+Broker fan-out benchmark
+
+Measures broker CPU time spent per POST while the subscriber count grows.
+Subscribers are in-memory writers, so only framing and compression cost is measured (no kernel/network time).
+
+Compares per-subscriber compression (how tcp_broadcast worked before) with compress-once fan-out.
+
+Usage:
+    python benchmarks/fanout.py --size 65536 --subscribers 1 2 5 10 20 50
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from miniros.util.sock import AsyncDistributedServer, Connection, Datatypes, Outbox, Compression
+
+
+class NullWriter:
+    """
+    Transport replacement which only counts written bytes
+    """
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data: bytes) -> None:
+        self.written += len(data)
+
+    def is_closing(self) -> bool:
+        return False
+
+
+def make_server(subscribers: int) -> tuple[AsyncDistributedServer, list[str]]:
+    server = AsyncDistributedServer("127.0.0.1", 0)
+
+    names = [f"s{i}" for i in range(subscribers)]
+    for name in names:
+        writer = NullWriter()
+        # zlib compression, as all clients had before frame flags
+        server.servers[name] = Connection(name=name, fields={}, socket=writer, compression=Compression.FAST, outbox=Outbox(writer))
+
+    return server, names
+
+
+def make_message(size: int) -> bytes:
+    # half random, half zeros - looks like a typical sensor payload for zlib
+    payload = os.urandom(size // 2) + bytes(size - size // 2)
+    return b"".join((bytes([Datatypes.SEND_GET.value, 3, 3]), b"pub", b"img", payload))
+
+
+async def per_subscriber(server: AsyncDistributedServer, names: list[str], message: bytes) -> None:
+    await asyncio.gather(*(server.tcp_send(server.servers[name], message) for name in names))
+
+
+async def compress_once(server: AsyncDistributedServer, names: list[str], message: bytes) -> None:
+    await server.tcp_broadcast(names, message)
+
+
+async def measure(method, subscribers: int, message: bytes, messages: int) -> float:
+    server, names = make_server(subscribers)
+
+    start = time.process_time()
+    for _ in range(messages):
+        await method(server, names, message)
+
+    elapsed = time.process_time() - start
+
+    for name in names:
+        server.servers[name].outbox.close()
+
+    return elapsed / messages
+
+
+async def main(size: int, subscribers: list[int], messages: int) -> None:
+    message = make_message(size)
+
+    print(f"payload: {size} bytes, {messages} messages per point")
+    print(f"{'subs':>6} {'per-sub us/msg':>16} {'once us/msg':>14} {'speedup':>9}")
+
+    for count in subscribers:
+        old = await measure(per_subscriber, count, message, messages)
+        new = await measure(compress_once, count, message, messages)
+
+        print(f"{count:>6} {old * 1e6:>16.1f} {new * 1e6:>14.1f} {old / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64 * 1024, help="payload size in bytes")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1, 2, 5, 10, 20, 50])
+    parser.add_argument("--messages", type=int, default=200, help="messages per measurement")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.size, args.subscribers, args.messages))
@@ -0,0 +1,327 @@
+"""
+Broker end-to-end pub/sub benchmark
+
+Runs N publishers and M subscribers (AsyncROSClient) against a broker and measures
+delivered messages per second, MB/s and latency percentiles for every payload size and path:
+
+    post      - POST to a topic, broker fans it out to all subscribers
+    anon-tcp  - ANON through broker, every publisher sends each message to every subscriber
+    anon-udp  - ANON over direct UDP between nodes (large payloads are fragmented)
+
+Payloads are a Vector and float32 NumpyArrays of given sizes in bytes. Send time is put in front of
+every payload, so latency is measured from publisher`s post call to subscriber`s handler.
+
+Broker runs in the same event loop as clients by default, with --subprocess it runs in its own process
+(closer to a real deployment, loop scheduling isn`t shared with clients).
+With --direct clients use direct mode, so POST data goes from publishers to subscribers without broker.
+Results can be written as JSON to compare runs.
+
+Usage:
+    python benchmarks/pubsub.py --publishers 2 --subscribers 4 --sizes vector 1024 65536 1048576 4194304
+    python benchmarks/pubsub.py --subprocess --paths post anon-tcp --messages 500 --json results.json
+    python benchmarks/pubsub.py --subprocess --direct --paths post --subscribers 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from miniros.base.client import AsyncROSClient
+from miniros.util.datatypes import Bytes, NumpyArray, Vector
+from miniros.util.sock import AsyncDistributedServer, Compression
+
+_STAMP = struct.Struct(">d") # perf_counter at send, clients share one process so clocks match
+
+PATHS = ("post", "anon-tcp", "anon-udp")
+
+BROKER = (
+    "import asyncio, sys\n"
+    "from miniros.util.sock import AsyncDistributedServer\n"
+    "asyncio.run(AsyncDistributedServer(sys.argv[1], int(sys.argv[2]), unix_path=sys.argv[3] or None).run())\n"
+)
+
+
+def make_payload(size: str) -> bytes:
+    if size == "vector":
+        return Vector.encode(Vector(1.0, 2.0, 3.0))
+
+    # random floats, so zlib can`t shrink them and ADAPTIVE sends frames raw
+    return bytes(NumpyArray.encode(np.random.random(int(size) // 4).astype(np.float32)))
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_broker(use_subprocess: bool, unix_path: str | None) -> tuple[int, object]:
+    """
+    :return: broker TCP port and server task or process
+    """
+
+    if not use_subprocess:
+        server = AsyncDistributedServer("127.0.0.1", 0, unix_path=unix_path)
+        task = asyncio.create_task(server.run())
+
+        while server.sock is None or (unix_path and server.unix_sock is None):
+            await asyncio.sleep(0.01)
+
+        return server.sock.sockets[0].getsockname()[1], task
+
+    port = free_port()
+    process = subprocess.Popen([sys.executable, "-c", BROKER, "127.0.0.1", str(port), unix_path or ""])
+
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            if unix_path is None or os.path.exists(unix_path):
+                break
+        except OSError:
+            pass
+
+        if time.monotonic() > deadline or process.poll() is not None:
+            process.kill()
+            raise RuntimeError("broker didn`t start")
+
+        await asyncio.sleep(0.05)
+
+    return port, process
+
+
+def stop_broker(broker: object) -> None:
+    if isinstance(broker, asyncio.Task):
+        broker.cancel()
+    else:
+        broker.terminate()
+        broker.wait()
+
+
+async def start_client(name: str, address: str, port: int, compression: Compression, direct: bool) -> tuple[AsyncROSClient, asyncio.Task]:
+    client = AsyncROSClient(name, address, port, compression, direct=direct)
+    task = asyncio.create_task(client.run())
+
+    await client.wait(sub_when_activated=False)
+
+    return client, task
+
+
+async def stop_clients(clients: list[tuple[AsyncROSClient, asyncio.Task]]) -> None:
+    # mainloop closes its transports when cancelled
+    for _, task in clients:
+        task.cancel()
+
+    await asyncio.gather(*(task for _, task in clients), return_exceptions=True)
+
+
+async def measure(address: str, port: int, path: str, size: str, payload: bytes, args: argparse.Namespace, run: int) -> dict:
+    result = {
+        "path": path,
+        "payload": size,
+        "payload_bytes": len(payload),
+        "publishers": args.publishers,
+        "subscribers": args.subscribers,
+    }
+
+    compression = Compression[args.compression.upper()]
+
+    # names are unique per run, so server doesn`t confuse them with connections it hasn`t dropped yet
+    subs = [await start_client(f"s{i}r{run}", address, port, compression, args.direct) for i in range(args.subscribers)]
+    pubs = [await start_client(f"p{i}r{run}", address, port, compression, args.direct) for i in range(args.publishers)]
+
+    expected = args.publishers * args.messages * args.subscribers
+    latencies = []
+    last_delivery = 0.0
+    done = asyncio.Event()
+
+    async def on_message(data: bytes, node: str | None = None) -> None:
+        nonlocal last_delivery
+
+        stamp = _STAMP.unpack_from(data)[0]
+        if stamp == 0.0: # warm-up
+            return
+
+        last_delivery = time.perf_counter()
+        latencies.append(last_delivery - stamp)
+
+        if len(latencies) == expected:
+            done.set()
+
+    senders = []
+    sub_names = [client.name for client, _ in subs]
+
+    if path == "post":
+        for client, _ in pubs:
+            topic = await client.topic("bench", Bytes)
+            senders.append((lambda data, topic=topic: topic.post(data), [None]))
+
+        for client, _ in subs:
+            await client.client.subscribe_many([(pub.name, "bench", on_message) for pub, _ in pubs])
+
+    else:
+        for client, _ in subs:
+            client.client.anon_handlers["bench"] = on_message
+
+        force_to_tcp = path == "anon-tcp"
+        for client, _ in pubs:
+            senders.append((lambda data, node, client=client: client.anon(node, "bench", data, force_to_tcp=force_to_tcp), sub_names))
+
+    # resolves topic ids and UDP peers before measuring
+    warm_up = _STAMP.pack(0.0) + payload
+    for send, targets in senders:
+        for target in targets:
+            await (send(warm_up) if target is None else send(warm_up, target))
+
+    if path == "anon-udp":
+        for (client, _), (send, targets) in zip(pubs, senders):
+            for target in targets:
+                for _ in range(100):
+                    peer = client.client.udp_servers.get(target)
+                    if peer is not None and peer.has_connection:
+                        break
+
+                    await send(warm_up, target)
+                    await asyncio.sleep(0.05)
+
+    await asyncio.sleep(0.2)
+
+    async def publish(send, targets: list[str | None]) -> None:
+        start = time.perf_counter()
+
+        for i in range(args.messages):
+            if args.rate:
+                await asyncio.sleep(max(0.0, start + i / args.rate - time.perf_counter()))
+
+            data = _STAMP.pack(time.perf_counter()) + payload
+            for target in targets:
+                await (send(data) if target is None else send(data, target))
+
+            if not args.rate:
+                # lets broker and subscribers run when they share the loop
+                await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(publish(send, targets) for send, targets in senders))
+
+    # waits until everything is delivered or nothing arrives for timeout (UDP drops datagrams)
+    while not done.is_set():
+        count = len(latencies)
+
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            if len(latencies) == count:
+                break
+
+    await stop_clients(pubs + subs)
+
+    delivered = len(latencies)
+    elapsed = (last_delivery - start) if delivered else 0.0
+
+    result.update({
+        "sent": args.publishers * args.messages,
+        "expected": expected,
+        "delivered": delivered,
+        "lost": expected - delivered,
+        "seconds": elapsed,
+        "msgs_per_s": delivered / elapsed if elapsed else 0.0,
+        "mb_per_s": delivered * len(payload) / elapsed / 1e6 if elapsed else 0.0,
+    })
+
+    if delivered:
+        result["latency_ms"] = {
+            "p50": percentile(latencies, 0.5) * 1e3,
+            "p99": percentile(latencies, 0.99) * 1e3,
+            "p999": percentile(latencies, 0.999) * 1e3,
+            "max": max(latencies) * 1e3,
+        }
+
+    return result
+
+
+def print_result(result: dict) -> None:
+    name = f"{result['path']:>9} {result['payload']:>9}"
+
+    if not result["delivered"]:
+        print(f"{name}  nothing delivered")
+        return
+
+    latency = result["latency_ms"]
+    print(
+        f"{name} {result['msgs_per_s']:>10.0f} {result['mb_per_s']:>9.1f} "
+        f"{latency['p50']:>8.2f} {latency['p99']:>8.2f} {latency['p999']:>8.2f} {result['lost']:>7}"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    unix_path = os.path.join(tempfile.mkdtemp(), "miniros.sock") if args.transport == "unix" else None
+
+    port, broker = await start_broker(args.subprocess, unix_path)
+    address = f"unix:{unix_path}" if unix_path else "127.0.0.1"
+
+    results = []
+
+    print(f"{args.publishers} publishers, {args.subscribers} subscribers, {args.messages} messages per publisher, broker {'subprocess' if args.subprocess else 'in-process'} over {args.transport}{', direct' if args.direct else ''}")
+    print(f"{'path':>9} {'payload':>9} {'msgs/s':>10} {'MB/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'lost':>7}")
+
+    try:
+        run = 0
+        for size in args.sizes:
+            payload = make_payload(size)
+
+            for path in args.paths:
+                run += 1
+
+                result = await measure(address, port, path, size, payload, args, run)
+                results.append(result)
+                print_result(result)
+
+                # let server drop closed connections
+                await asyncio.sleep(0.1)
+    finally:
+        stop_broker(broker)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "config": {key: value for key, value in vars(args).items() if key != "json"},
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--publishers", type=int, default=1)
+    parser.add_argument("--subscribers", type=int, default=4)
+    parser.add_argument("--sizes", nargs="+", default=["vector", "1024", "65536", "1048576", "4194304"], help="\"vector\" or NumpyArray size in bytes")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--messages", type=int, default=200, help="messages per publisher per measurement")
+    parser.add_argument("--rate", type=float, default=0, help="messages per second per publisher, 0 sends as fast as possible")
+    parser.add_argument("--compression", choices=[c.name.lower() for c in Compression], default="adaptive")
+    parser.add_argument("--transport", choices=("tcp", "unix"), default="tcp", help="how clients connect to broker")
+    parser.add_argument("--subprocess", action="store_true", help="run broker in its own process")
+    parser.add_argument("--direct", action="store_true", help="clients send topic data directly to each other")
+    parser.add_argument("--timeout", type=float, default=5, help="stop waiting when nothing is delivered for this many seconds")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
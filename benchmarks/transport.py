@@ -0,0 +1,104 @@
+"""
+Broker transport round-trip benchmark
+
+Measures ANON ping-pong round-trip time between two nodes through the broker,
+over loopback TCP and over unix socket. Both clients and the broker run in one process.
+
+Usage:
+    python benchmarks/transport.py --sizes 16 1024 65536 --messages 2000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from miniros.util.sock import AsyncDistributedServer, AsyncDistrubutedClient, Compression
+
+
+async def connect(address: str, port: int, name: str) -> tuple[AsyncDistrubutedClient, asyncio.Task]:
+    # RAW frames, so only transport cost is measured
+    client = AsyncDistrubutedClient(address, port, name, Compression.RAW)
+    task = asyncio.create_task(client.mainloop())
+
+    while not client._is_authorized:
+        await asyncio.sleep(0.01)
+
+    return client, task
+
+
+async def measure(address: str, port: int, size: int, messages: int) -> list[float]:
+    ping, ping_task = await connect(address, port, "pin")
+    pong, pong_task = await connect(address, port, "pon")
+
+    received = asyncio.Queue()
+
+    async def on_ping(data, node):
+        await pong.anon(node, "pong", data, force_to_tcp=True)
+
+    async def on_pong(data, node):
+        received.put_nowait(time.perf_counter())
+
+    pong.anon_handlers["ping"] = on_ping
+    ping.anon_handlers["pong"] = on_pong
+
+    payload = os.urandom(size)
+    rtts = []
+
+    for i in range(messages + messages // 10):
+        start = time.perf_counter()
+        await ping.anon("pon", "ping", payload, force_to_tcp=True)
+        end = await received.get()
+
+        # first messages warm up connections
+        if i >= messages // 10:
+            rtts.append(end - start)
+
+    for client, task in ((ping, ping_task), (pong, pong_task)):
+        task.cancel()
+        client.w.close()
+        client.transport.close()
+
+    return rtts
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def main(sizes: list[int], messages: int) -> None:
+    unix_path = os.path.join(tempfile.mkdtemp(), "miniros.sock")
+
+    server = AsyncDistributedServer("127.0.0.1", 0, unix_path=unix_path)
+    task = asyncio.create_task(server.run())
+
+    while server.sock is None or server.unix_sock is None:
+        await asyncio.sleep(0.01)
+
+    port = server.sock.sockets[0].getsockname()[1]
+
+    print(f"{messages} round trips per point")
+    print(f"{'size':>8} {'transport':>10} {'mean us':>9} {'p50 us':>9} {'p99 us':>9}")
+
+    for size in sizes:
+        for transport, address in (("tcp", "127.0.0.1"), ("unix", f"unix:{unix_path}")):
+            rtts = await measure(address, port, size, messages)
+
+            print(f"{size:>8} {transport:>10} {statistics.mean(rtts) * 1e6:>9.1f} {percentile(rtts, 0.5) * 1e6:>9.1f} {percentile(rtts, 0.99) * 1e6:>9.1f}")
+
+            # let server drop closed connections before reusing names
+            await asyncio.sleep(0.1)
+
+    task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 1024, 65536], help="payload sizes in bytes")
+    parser.add_argument("--messages", type=int, default=2000, help="round trips per measurement")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.messages))
@@ -0,0 +1,221 @@
+"""
+Broker worker scaling benchmark
+
+Measures delivered messages per second while topics are partitioned between more broker worker processes
+(see AsyncDistributedServer workers). 0 workers is a single broker process.
+
+Every client process runs one publisher node with --topics topics and one subscriber node,
+which subscribes to topics of all publishers, so every posted message is delivered to every client process.
+Clients are separate processes, so they don`t limit the broker when there are enough cores.
+
+Usage:
+    python benchmarks/workers.py --workers 0 1 2 4 --clients 4 --topics 8 --size 1024
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from miniros.base.client import AsyncROSClient
+from miniros.util.datatypes import Bytes
+
+BROKER = (
+    "import asyncio, logging, sys\n"
+    "from miniros.base.server import run\n"
+    "logging.getLogger().setLevel(logging.WARNING)\n"
+    "asyncio.run(run(sys.argv[1], int(sys.argv[2]), sys.argv[3] or None, int(sys.argv[4])))\n"
+)
+
+
+def free_port(count: int) -> int:
+    """
+    :return: first of count free consecutive ports (front server and its workers)
+    """
+
+    while True:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        try:
+            for i in range(1, count):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", port + i))
+            return port
+        except OSError:
+            pass
+
+
+def start_broker(port: int, unix_path: str | None, workers: int) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, "-c", BROKER, "127.0.0.1", str(port), unix_path or "", str(workers)])
+
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            if unix_path is None or os.path.exists(unix_path):
+                return process
+        except OSError:
+            pass
+
+        if time.monotonic() > deadline or process.poll() is not None:
+            process.kill()
+            raise RuntimeError("broker didn`t start")
+
+        time.sleep(0.05)
+
+
+async def client_main(index: int, args: argparse.Namespace, address: str, port: int, run: int, barrier, results) -> None:
+    payload = os.urandom(args.size)
+
+    expected = args.clients * args.topics * args.messages
+    delivered = 0
+    last_delivery = 0.0
+    done = asyncio.Event()
+
+    async def on_message(data: bytes) -> None:
+        nonlocal delivered, last_delivery
+
+        if len(data) == 0: # warm-up
+            return
+
+        delivered += 1
+        last_delivery = time.time()
+
+        if delivered == expected:
+            done.set()
+
+    # names are unique per run, so broker doesn`t confuse them with connections it hasn`t dropped yet
+    pub = AsyncROSClient(f"p{index}r{run}", address, port)
+    sub = AsyncROSClient(f"s{index}r{run}", address, port)
+
+    tasks = [asyncio.create_task(pub.run()), asyncio.create_task(sub.run())]
+    await pub.wait(sub_when_activated=False)
+    await sub.wait(sub_when_activated=False)
+
+    topics = [await pub.topic(f"t{i}", Bytes) for i in range(args.topics)]
+
+    loop = asyncio.get_running_loop()
+
+    # every publisher has created its topics before anybody subscribes
+    await loop.run_in_executor(None, barrier.wait)
+
+    await sub.client.subscribe_many([(f"p{other}r{run}", f"t{i}", on_message) for other in range(args.clients) for i in range(args.topics)])
+
+    for topic in topics:
+        await topic.post(b"")
+
+    await asyncio.sleep(0.5)
+    await loop.run_in_executor(None, barrier.wait)
+
+    start = time.time()
+
+    for _ in range(args.messages):
+        for topic in topics:
+            await topic.post(payload)
+
+    # waits until everything is delivered or nothing arrives for timeout
+    while not done.is_set():
+        count = delivered
+
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            if delivered == count:
+                break
+
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    results.put((start, last_delivery, delivered, expected))
+
+
+def client_process(*args) -> None:
+    logging.getLogger().setLevel(logging.ERROR)
+    asyncio.run(client_main(*args))
+
+
+def measure(workers: int, args: argparse.Namespace, run: int) -> dict:
+    port = free_port(workers + 1)
+    unix_path = os.path.join(tempfile.mkdtemp(), "miniros.sock") if args.transport == "unix" else None
+    address = f"unix:{unix_path}" if unix_path else "127.0.0.1"
+
+    broker = start_broker(port, unix_path, workers)
+
+    barrier = multiprocessing.Barrier(args.clients)
+    results = multiprocessing.Queue()
+
+    processes = [
+        multiprocessing.Process(target=client_process, args=(index, args, address, port, run, barrier, results))
+        for index in range(args.clients)
+    ]
+
+    try:
+        for process in processes:
+            process.start()
+
+        reports = [results.get() for _ in processes]
+
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+
+        broker.terminate()
+        broker.wait()
+
+    start = min(report[0] for report in reports)
+    end = max(report[1] for report in reports)
+    delivered = sum(report[2] for report in reports)
+    expected = sum(report[3] for report in reports)
+
+    elapsed = end - start if delivered else 0.0
+
+    return {
+        "workers": workers,
+        "delivered": delivered,
+        "lost": expected - delivered,
+        "seconds": elapsed,
+        "msgs_per_s": delivered / elapsed if elapsed else 0.0,
+        "mb_per_s": delivered * args.size / elapsed / 1e6 if elapsed else 0.0,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{args.clients} client processes, {args.topics} topics per publisher, {args.messages} messages per topic, {args.size} bytes over {args.transport}, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'msgs/s':>10} {'MB/s':>9} {'speedup':>8} {'lost':>7}")
+
+    base = None
+    for run, workers in enumerate(args.workers):
+        result = measure(workers, args, run)
+
+        if base is None:
+            base = result["msgs_per_s"]
+
+        speedup = result["msgs_per_s"] / base if base else 0.0
+        print(f"{workers:>8} {result['msgs_per_s']:>10.0f} {result['mb_per_s']:>9.1f} {speedup:>7.2f}x {result['lost']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="broker worker counts to measure, 0 for single process broker")
+    parser.add_argument("--clients", type=int, default=4, help="client processes, each has one publisher and one subscriber")
+    parser.add_argument("--topics", type=int, default=8, help="topics per publisher")
+    parser.add_argument("--messages", type=int, default=500, help="messages per topic")
+    parser.add_argument("--size", type=int, default=1024, help="payload size in bytes")
+    parser.add_argument("--transport", choices=("tcp", "unix"), default="tcp", help="how clients connect to broker")
+    parser.add_argument("--timeout", type=float, default=5, help="stop waiting when nothing is delivered for this many seconds")
+    args = parser.parse_args()
+
+    main(args)
@@ -19,6 +19,8 @@ create_parser = subparsers.add_parser("create")
 delete_parser = subparsers.add_parser("delete")
 install_parser = subparsers.add_parser("install")
 server_parser = subparsers.add_parser("server")
+record_parser = subparsers.add_parser("record")
+play_parser = subparsers.add_parser("play")
 
 run_parser.add_argument("package", type=str)
 run_parser.add_argument("args", type=list, nargs="*")
@@ -35,8 +37,26 @@ delete_parser.add_argument("name", type=str)
 
 server_parser.add_argument("--host", type=str, default="127.0.0.1")
 server_parser.add_argument("--port", type=int, default=3000)
+server_parser.add_argument("--unix", type=str, default=None, dest="unix_path", help="also listen on unix socket path (clients connect to unix:<path>)")
+server_parser.add_argument("--no-tcp", default=False, action="store_true", dest="no_tcp", help="listen only on unix socket")
+server_parser.add_argument("--workers", type=int, default=0, help="broker worker processes, topics are partitioned between them. Worker i listens on port+1+i and <unix>.i")
 server_parser.add_argument("--superserver", type=str, default="", help="absolute path to superserver config")
 
+record_parser.add_argument("topics", type=str, nargs="+", help="topics to record as node/field")
+record_parser.add_argument("-o", "--output", type=str, default="record.bag", help="bag file")
+record_parser.add_argument("--ip", type=str, default="127.0.0.1", help="server address, same as AsyncROSClient ip")
+record_parser.add_argument("--port", type=int, default=3000)
+record_parser.add_argument("--name", type=str, default="record", help="recorder`s node name")
+record_parser.add_argument("--duration", type=float, default=None, help="seconds to record, until Ctrl+C if not set")
+
+play_parser.add_argument("bag", type=str)
+play_parser.add_argument("--topics", type=str, nargs="+", default=None, help="topics to play as node/field, all recorded if not set")
+play_parser.add_argument("--ip", type=str, default="127.0.0.1", help="server address, same as AsyncROSClient ip")
+play_parser.add_argument("--port", type=int, default=3000)
+play_parser.add_argument("--rate", type=float, default=1.0, help="speed relative to recording, 0 publishes as fast as possible")
+play_parser.add_argument("--prefix", type=str, default="", help="added to played node names")
+play_parser.add_argument("--info", default=False, action="store_true", help="only print recorded topics")
+
 parsed = parser.parse_args()
 
 PYTHON_EXEC = parsed.pyexec
@@ -299,14 +319,27 @@ setup(
         quit(0)
 
     case "server":
-        from miniros.base.server import run
+        from miniros.base.server import run, worker_addresses
         import asyncio
 
-        host, port = parsed.host, parsed.port
+        host, port, unix_path, workers = parsed.host, parsed.port, parsed.unix_path, parsed.workers
+
+        trace(host, port, unix_path, workers)
+
+        if parsed.no_tcp:
+            if unix_path is None:
+                parser.error("--no-tcp requires --unix")
+
+            host = None
 
-        trace(host, port)
+        if host is not None:
+            print(f"Running at {host}:{port}")
 
-        print(f"Running at {host}:{port}")
+        if unix_path is not None:
+            print(f"Running at unix:{unix_path}")
+
+        for i, (worker_port, worker_path) in enumerate(worker_addresses(host, port, unix_path, workers)):
+            print(f"Worker {i} at", ", ".join(address for address in (worker_port and f"{host}:{worker_port}", worker_path and f"unix:{worker_path}") if address))
         
 
         if len(parsed.superserver.strip()) > 0:
@@ -348,7 +381,62 @@ setup(
 
 # """)
         
-        asyncio.run(run(host, port))
+        asyncio.run(run(host, port, unix_path, workers))
+
+        quit(0)
+
+    case "record":
+        from miniros.base.bag import record, parse_topic
+        import asyncio
+
+        try:
+            topics = [parse_topic(topic) for topic in parsed.topics]
+        except ValueError as e:
+            parser.error(str(e))
+
+        trace(parsed.output, topics)
+
+        print(f"Recording {len(topics)} topics to {parsed.output}")
+
+        try:
+            count = asyncio.run(record(parsed.output, topics, parsed.ip, parsed.port, parsed.name, parsed.duration))
+            print(f"Recorded {count} messages")
+        except KeyboardInterrupt:
+            # bag is closed by record when it`s cancelled
+            print("Recording stopped")
+
+        quit(0)
+
+    case "play":
+        from miniros.base.bag import play, parse_topic
+        from miniros.util.bag import BagReader
+        import asyncio
+
+        if not os.path.exists(parsed.bag):
+            parser.error(f"bag '{parsed.bag}' is not exists")
+
+        try:
+            topics = None if parsed.topics is None else [parse_topic(topic) for topic in parsed.topics]
+        except ValueError as e:
+            parser.error(str(e))
+
+        trace(parsed.bag, topics, parsed.rate)
+
+        if parsed.info:
+            with BagReader(parsed.bag) as bag:
+                if not bag.indexed:
+                    print("Bag wasn`t closed, index is rebuilt from records")
+
+                for topic, info in bag.info().items():
+                    print(f"{topic}: {info['messages']} messages, {info['end'] - info['start']:.3f} s")
+
+            quit(0)
+
+        try:
+            count = asyncio.run(play(parsed.bag, parsed.ip, parsed.port, parsed.rate, topics, parsed.prefix))
+            print(f"Played {count} messages")
+        except KeyboardInterrupt:
+            print("Playing stopped")
 
         quit(0)
 
@@ -22,7 +22,8 @@ class RGTClient(ROSClient):
 
             q = 0
             for field in val[node]["fields"].keys():
-                f = Node((c * 30 + 10, (c // 4) * 30 - 12 + q * 6), field)
+                rate = val[node]["fields"][field]["rates"]["published"]
+                f = Node((c * 30 + 10, (c // 4) * 30 - 12 + q * 6), f"{field} {rate:.0f}/s")
                 arr = Arrow(n, f, "e")
 
                 objects.append(arr)
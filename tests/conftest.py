@@ -0,0 +1,10 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# checkout is imported as miniros package, like installed one (see util/build.py)
+package = types.ModuleType("miniros")
+package.__path__ = [ROOT]
+sys.modules["miniros"] = package
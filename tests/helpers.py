@@ -0,0 +1,155 @@
+import asyncio
+import contextlib
+import os
+import socket
+import time
+
+from miniros.base.client import AsyncROSClient
+from miniros.base.server import run
+from miniros.util.sock import unpack_frame
+
+BROKER_START_TIMEOUT = 15.0 # seconds
+
+
+def free_port(count: int = 1) -> int:
+    """
+    :return: first of count free consecutive ports (front server and its workers)
+    """
+
+    while True:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        try:
+            for i in range(1, count):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", port + i))
+            return port
+        except OSError:
+            pass
+
+
+@contextlib.asynccontextmanager
+async def broker(workers: int = 0, unix_path: str | None = None, tcp: bool = True):
+    """
+    Runs broker in this event loop (workers in their processes)
+
+    :param unix_path: broker listens on unix socket too
+    :param tcp: broker listens on TCP, False is server --no-tcp
+    :return: broker port
+    """
+
+    port = free_port(workers + 1)
+    task = asyncio.create_task(run("127.0.0.1" if tcp else None, port, unix_path, workers))
+
+    deadline = time.monotonic() + BROKER_START_TIMEOUT
+    while True:
+        try:
+            if tcp:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+            else:
+                _, writer = await asyncio.open_unix_connection(unix_path)
+            writer.close()
+
+            # unix socket is created after TCP one
+            if unix_path is None or os.path.exists(unix_path):
+                break
+        except OSError:
+            pass
+
+        if task.done() or time.monotonic() > deadline:
+            task.cancel()
+            raise RuntimeError("broker didn`t start")
+
+        await asyncio.sleep(0.05)
+
+    try:
+        yield port
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@contextlib.asynccontextmanager
+async def clients(port: int, *names: str, unix_path: str | None = None, **kwargs):
+    """
+    Runs connected clients, kwargs are passed to AsyncROSClient
+
+    :param unix_path: clients connect to broker`s unix socket
+    :return: clients in order of names
+    """
+
+    address = "127.0.0.1" if unix_path is None else f"unix:{unix_path}"
+    nodes = [AsyncROSClient(name, address, port, **kwargs) for name in names]
+    tasks = [asyncio.create_task(node.run()) for node in nodes]
+
+    try:
+        for node in nodes:
+            await asyncio.wait_for(node.wait(sub_when_activated=False), BROKER_START_TIMEOUT)
+
+        yield nodes
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def until(condition, timeout: float = 5.0) -> None:
+    """
+    Waits until condition() is true, fails after timeout
+    """
+
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, "condition wasn`t met in time"
+        await asyncio.sleep(0.01)
+
+
+class FakeTransport(asyncio.Transport):
+    """
+    In-memory transport, keeps written frames and lets tests pause its writing
+    """
+
+    def __init__(self, protocol: asyncio.Protocol | None = None):
+        super().__init__()
+
+        self.protocol = protocol
+        self.written = bytearray()
+        self.closing = False
+        self.reading = True
+
+    def write(self, data) -> None:
+        self.written += data
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def close(self) -> None:
+        self.closing = True
+
+    def pause_reading(self) -> None:
+        self.reading = False
+
+    def resume_reading(self) -> None:
+        self.reading = True
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    def messages(self, flagged: bool = False) -> list[bytes]:
+        """
+        :return: written messages, frames are unpacked as in unpack_frame
+        """
+
+        messages = []
+        offset = 0
+
+        while offset < len(self.written):
+            length = int.from_bytes(self.written[offset:offset+4], "big")
+            messages.append(unpack_frame(bytes(self.written[offset+4:offset+4+length]), flagged))
+            offset += 4 + length
+
+        return messages
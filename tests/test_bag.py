@@ -0,0 +1,155 @@
+import asyncio
+import os
+
+import pytest
+
+from miniros.base.bag import play, record
+from miniros.util.bag import BagReader, BagWriter, _BAG_HEADER
+from miniros.util.datatypes import Bytes
+from tests.helpers import broker, clients, until
+
+
+def write_bag(path, chunk_size=64):
+    messages = []
+
+    with BagWriter(path, chunk_size) as writer:
+        for i in range(20):
+            node, field = ("a", "x") if i % 2 else ("b", "y")
+            payload = os.urandom(i)
+
+            writer.add(node, field, payload, stamp=1000.0 + i)
+            messages.append((1000.0 + i, node, field, payload))
+
+    return messages
+
+
+def read_all(reader, topics=None):
+    return [(stamp, node, field, bytes(payload)) for stamp, node, field, payload in reader.messages(topics)]
+
+
+def test_bag_round_trip(tmp_path):
+    path = str(tmp_path / "test.bag")
+    messages = write_bag(path)
+
+    with BagReader(path) as reader:
+        assert reader.indexed
+        assert sorted(reader.topics.values()) == [("a", "x"), ("b", "y")]
+        assert read_all(reader) == messages
+        assert read_all(reader, [("a", "x")]) == [message for message in messages if message[1] == "a"]
+
+        info = reader.info()
+        assert info["a/x"]["messages"] == 10
+        assert info["b/y"]["start"] == 1000.0
+        assert info["b/y"]["end"] == 1018.0
+
+
+def test_bag_scan_without_index(tmp_path):
+    path = str(tmp_path / "test.bag")
+    messages = write_bag(path)
+
+    with open(path, "rb") as file:
+        data = bytearray(file.read())
+
+    # header of bag which wasn`t closed doesn`t point to index
+    magic, version, index_offset = _BAG_HEADER.unpack_from(data)
+    data[:_BAG_HEADER.size] = _BAG_HEADER.pack(magic, version, 0)
+
+    # cut last record, like killed recorder
+    with open(path, "wb") as file:
+        file.write(data[:index_offset - 3])
+
+    with BagReader(path) as reader:
+        assert not reader.indexed
+
+        recovered = read_all(reader)
+
+    # chunks written before the cut are recovered
+    assert len(recovered) > 0
+    assert set(recovered) <= set(messages)
+    assert recovered == sorted(recovered)
+
+
+def test_bag_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bag"
+    path.write_bytes(b"not a bag at all")
+
+    with pytest.raises(ValueError):
+        BagReader(str(path))
+
+
+def test_record_and_play(tmp_path):
+    path = str(tmp_path / "test.bag")
+
+    async def main():
+        async with broker() as port:
+            async with clients(port, "pub", "sub") as (pub, sub):
+                topic = await pub.topic("data", Bytes)
+
+                recorder = asyncio.create_task(record(path, [("pub", "data")], port=port, name="recorder"))
+                await asyncio.sleep(0.5)
+
+                for i in range(10):
+                    await topic.post(bytes([i]) * 100)
+
+                await asyncio.sleep(0.5)
+                recorder.cancel()
+                await asyncio.gather(recorder, return_exceptions=True)
+
+                with BagReader(path) as reader:
+                    recorded = [bytes(payload) for _, _, _, payload in reader.messages() if payload]
+
+                assert recorded == [bytes([i]) * 100 for i in range(10)]
+
+                played = []
+
+                async def on_data(data):
+                    if data:
+                        played.append(bytes(data))
+
+                async def subscribe():
+                    # played node exists after start
+                    await asyncio.sleep(0.5)
+                    await sub.client.subscribe("repub", "data", on_data)
+
+                count, _ = await asyncio.gather(play(path, port=port, rate=0, prefix="re", start_delay=1.0), subscribe())
+
+                assert count == 10
+                await until(lambda: played == recorded)
+
+    asyncio.run(main())
+
+
+def test_play_cancel(tmp_path):
+    path = str(tmp_path / "test.bag")
+
+    with BagWriter(path) as writer:
+        for i in range(100):
+            writer.add("slow", "data", b"x" * 1000, stamp=1000.0 + i)
+
+    async def main():
+        async with broker() as port:
+            task = asyncio.create_task(play(path, port=port, start_delay=0.1))
+            await asyncio.sleep(1.0)
+
+            task.cancel()
+
+            # bag is closed without hiding cancellation
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(main())
+
+
+def test_bag_topic_limit(tmp_path):
+    path = str(tmp_path / "test.bag")
+
+    with BagWriter(path) as writer:
+        for i in range(0xffff):
+            writer.add("node", str(i), b"")
+
+        with pytest.raises(ValueError):
+            writer.add("node", "one more", b"")
+
+    with BagReader(path) as reader:
+        assert reader.indexed
+        assert len(reader.topics) == 0xffff
@@ -0,0 +1,302 @@
+import asyncio
+import os
+import socket
+import tempfile
+import time
+
+import pytest
+
+from miniros.base.client import AsyncROSClient
+from miniros.util.datatypes import Bytes, Vector
+from miniros.util.decorators import decorators
+from miniros.util.sock import AsyncDistributedServer, Datatypes, QoS, ServiceError, ServiceStatus, _ServerProtocol, pack_frame
+from tests.helpers import FakeTransport, broker, clients, until
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_publish_subscribe(workers):
+    async def main():
+        got = []
+
+        async def on_pos(data):
+            if data:
+                got.append(Vector.decode(data))
+
+        async with broker(workers) as port:
+            async with clients(port, "turtle", "viewer") as (turtle, viewer):
+                pos = await turtle.topic("pos", Vector)
+                await viewer.client.subscribe("turtle", "pos", on_pos)
+                await asyncio.sleep(0.2)
+
+                for i in range(10):
+                    await pos.post(Vector(float(i), 0.0, 1.0))
+
+                await until(lambda: len(got) == 10)
+                assert got == [Vector(float(i), 0.0, 1.0) for i in range(10)]
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_service_call(workers):
+    async def main():
+        async def reverse(data, node):
+            return bytes(data[::-1]) + node.encode()
+
+        async def fail(data, node):
+            raise ValueError("bad request")
+
+        async def slow(data, node):
+            await asyncio.sleep(1.0)
+            return b""
+
+        async with broker(workers) as port:
+            async with clients(port, "server", "caller") as (server, caller):
+                server.service("reverse", reverse)
+                server.service("fail", fail)
+                server.service("slow", slow)
+
+                # calls in flight at once get their own replies
+                replies = await asyncio.gather(*(caller.call("server", "reverse", str(i).encode()) for i in range(20)))
+                assert [bytes(reply) for reply in replies] == [str(i).encode()[::-1] + b"caller" for i in range(20)]
+
+                with pytest.raises(ServiceError) as error:
+                    await caller.call("server", "fail")
+                assert error.value.status == ServiceStatus.ERROR
+                assert "bad request" in error.value.message
+
+                with pytest.raises(ServiceError) as error:
+                    await caller.call("server", "unknown")
+                assert error.value.status == ServiceStatus.NOT_FOUND
+
+                with pytest.raises(ServiceError) as error:
+                    await caller.call("nobody", "reverse")
+                assert error.value.status == ServiceStatus.UNREACHABLE
+
+                with pytest.raises(asyncio.TimeoutError):
+                    await caller.call("server", "slow", timeout=0.1)
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_get_and_get_many(workers):
+    async def main():
+        async with broker(workers) as port:
+            async with clients(port, "turtle", "dashboard") as (turtle, dashboard):
+                pos = await turtle.topic("pos", Vector)
+                name = await turtle.topic("name", Bytes)
+                await turtle.topic("empty", Bytes)
+
+                await pos.post(Vector(1.0, 2.0, 3.0))
+                await name.post(b"leonardo")
+                await asyncio.sleep(0.2)
+
+                assert Vector.decode(await dashboard.get("turtle", "pos")) == Vector(1.0, 2.0, 3.0)
+                assert await dashboard.get("turtle", "unknown") is None
+
+                topics = [("turtle", "pos"), ("turtle", "name"), ("turtle", "empty"), ("nobody", "pos")] + [("turtle", f"missing{i}") for i in range(100)]
+                values = await dashboard.get_many(topics)
+
+                assert set(values) == set(topics)
+                assert Vector.decode(values[("turtle", "pos")]) == Vector(1.0, 2.0, 3.0)
+                assert bytes(values[("turtle", "name")]) == b"leonardo"
+                assert bytes(values[("turtle", "empty")]) == b""
+                assert values[("nobody", "pos")] is None
+                assert all(values[("turtle", f"missing{i}")] is None for i in range(100))
+
+                # values don`t go to handlers of subscribed topics
+                handled = []
+
+                async def on_name(data):
+                    handled.append(bytes(data))
+
+                await dashboard.client.subscribe("turtle", "name", on_name)
+                await dashboard.get_many([("turtle", "name")])
+                await asyncio.sleep(0.2)
+
+                assert handled == []
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_late_subscriber_gets_latched_value(workers):
+    async def main():
+        got = []
+
+        def handler(field):
+            async def on_data(data):
+                if data:
+                    got.append((field, data))
+
+            return on_data
+
+        async with broker(workers) as port:
+            async with clients(port, "robot", "viewer") as (robot, viewer):
+                grid = await robot.topic("map", Bytes, latched=True)
+                pos = await robot.topic("pos", Bytes)
+
+                await grid.post(b"grid")
+                await pos.post(b"old pos")
+                await asyncio.sleep(0.2)
+
+                await viewer.subscribe("robot", "map", handler("map"))
+                await viewer.subscribe("robot", "pos", handler("pos"))
+                await until(lambda: got == [("map", b"grid")])
+
+                # not latched value is sent only when it is posted again
+                await asyncio.sleep(0.3)
+                assert got == [("map", b"grid")]
+
+                await pos.post(b"new pos")
+                await until(lambda: got == [("map", b"grid"), ("pos", b"new pos")])
+
+    asyncio.run(main())
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="unix sockets only")
+@pytest.mark.parametrize("workers", [0, 2])
+def test_unix_only_server(workers):
+    path = os.path.join(tempfile.mkdtemp(), "miniros.sock")
+
+    async def main():
+        got = []
+
+        async def on_pos(data):
+            if data:
+                got.append(Vector.decode(data))
+
+        # server --unix <path> --no-tcp
+        async with broker(workers, unix_path=path, tcp=False) as port:
+            for i in range(workers + 1):
+                with pytest.raises(OSError):
+                    await asyncio.open_connection("127.0.0.1", port + i)
+
+            async with clients(port, "turtle", "viewer", unix_path=path) as (turtle, viewer):
+                pos = await turtle.topic("pos", Vector)
+                await viewer.client.subscribe("turtle", "pos", on_pos)
+                await asyncio.sleep(0.2)
+
+                for i in range(10):
+                    await pos.post(Vector(float(i), 0.0, 1.0))
+
+                await until(lambda: len(got) == 10)
+                assert got == [Vector(float(i), 0.0, 1.0) for i in range(10)]
+
+    asyncio.run(main())
+
+
+def connect(server: AsyncDistributedServer, name: bytes) -> tuple[_ServerProtocol, FakeTransport]:
+    """
+    Connects old client without capabilities to server over fake transport
+    """
+
+    protocol = _ServerProtocol(server)
+    transport = FakeTransport(protocol)
+
+    protocol.connection_made(transport)
+    protocol.data_received(pack_frame(bytes([Datatypes.SEND_AUTH.value, len(name)]) + name))
+
+    return protocol, transport
+
+
+def test_frames_of_lost_sender_are_published():
+    async def main():
+        server = AsyncDistributedServer("127.0.0.1", 0, queue_size=4, stats_interval=None)
+
+        publisher, _ = connect(server, b"pub")
+        subscriber, transport = connect(server, b"sub")
+
+        subscriber.data_received(pack_frame(bytes([Datatypes.SUBSCRIBE.value, 3, 4]) + b"pubdata"))
+
+        # subscriber`s queue fills up, so the rest of publisher`s frames wait in its buffer
+        subscriber.pause_writing()
+        publisher.data_received(b"".join(pack_frame(bytes([Datatypes.POST.value, 4]) + b"data" + bytes([i])) for i in range(20)))
+        assert publisher.paused
+
+        publisher.connection_lost(None)
+        assert "pub" in server.servers
+
+        subscriber.resume_writing()
+        await until(lambda: "pub" not in server.servers)
+
+        header = bytes([Datatypes.SEND_GET.value, 3, 4]) + b"pubdata"
+        assert [message[len(header):] for message in transport.messages() if message.startswith(header)] == [bytes([i]) for i in range(20)]
+
+    asyncio.run(main())
+
+
+class EveryTenth(AsyncROSClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.got = []
+
+    @decorators.qos(every=10)
+    async def on_sensor_value(self, data):
+        if data:
+            self.got.append(bytes(data))
+
+
+@pytest.mark.parametrize("workers, direct", [(0, False), (2, False), (0, True)])
+def test_subscription_qos(workers, direct):
+    async def main():
+        rated, latest, everything = [], [], []
+
+        def collect(got):
+            async def handler(data):
+                if data:
+                    got.append(bytes(data))
+
+            return handler
+
+        async with broker(workers) as port:
+            async with clients(port, "sensor", "ui", "logger", "plotter", direct=direct) as (sensor, ui, logger, plotter):
+                value = await sensor.topic("value", Bytes)
+
+                every = EveryTenth("every", "127.0.0.1", port, direct=direct)
+                task = asyncio.create_task(every.run())
+
+                try:
+                    await every.wait()
+
+                    await ui.subscribe("sensor", "value", collect(rated), QoS(max_rate=20))
+                    await plotter.subscribe("sensor", "value", collect(latest), QoS(latest=0.1))
+                    await logger.subscribe("sensor", "value", collect(everything))
+                    await asyncio.sleep(0.3)
+
+                    start = time.monotonic()
+                    posted = 0
+
+                    while time.monotonic() - start < 0.5:
+                        posted += 1
+                        await value.post(str(posted).encode())
+                        await asyncio.sleep(0.001)
+
+                    await until(lambda: len(everything) == posted)
+                    await asyncio.sleep(0.3)
+
+                    assert every.got == [str(i).encode() for i in range(1, posted + 1, 10)]
+
+                    # 0.5 s at 20 Hz, first message is sent right away
+                    assert 9 <= len(rated) <= 12
+                    assert rated[0] == b"1"
+
+                    # latest message of the last period isn`t dropped
+                    assert 5 <= len(latest) <= 8
+                    assert latest[-1] == str(posted).encode()
+
+                    # subscribing again without QoS gets everything
+                    rated.clear()
+                    await ui.subscribe("sensor", "value", collect(rated))
+                    await asyncio.sleep(0.3)
+
+                    for i in range(20):
+                        await value.post(b"x")
+
+                    await until(lambda: len(rated) == 20)
+                finally:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from miniros.base.client import AsyncROSClient
+from tests.helpers import broker
+
+
+def test_rosstat_fails_when_connection_closes():
+    async def main():
+        async with broker() as port:
+            client = AsyncROSClient("stat", "127.0.0.1", port)
+            task = asyncio.create_task(client.run())
+            await client.wait(sub_when_activated=False)
+
+            stats = await client.client.rosstat()
+            assert "stat" in stats
+
+            waiter = asyncio.create_task(client.client.rosstat())
+            await asyncio.sleep(0) # request is sent, reply isn`t handled yet
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+            with pytest.raises(ConnectionError):
+                await asyncio.wait_for(waiter, 5)
+
+    asyncio.run(main())
+
+
+def test_handlers_get_bytes_which_arrays_decode_aligned_views_of():
+    np = pytest.importorskip("numpy")
+
+    from miniros.util.datatypes import ARRAY_ALIGNMENT, NumpyArray
+    from miniros.util.decorators import decorators
+    from tests.helpers import clients, until
+
+    array = np.arange(1 << 20, dtype=np.float32).reshape(1024, 1024)
+
+    async def main():
+        raw, decoded = [], []
+
+        async def on_raw(data):
+            if data:
+                raw.append(data)
+
+        @decorators.aparsedata(NumpyArray, 0)
+        async def on_decoded(data):
+            if data.size:
+                decoded.append(data)
+
+        async with broker() as port:
+            async with clients(port, "pub", "raw", "arr") as (pub, raw_sub, arr_sub):
+                topic = await pub.topic("array", NumpyArray)
+                await raw_sub.client.subscribe("pub", "array", on_raw)
+                await arr_sub.client.subscribe("pub", "array", on_decoded)
+                await asyncio.sleep(0.2)
+
+                await topic.post(array)
+                await until(lambda: len(raw) == 1 and len(decoded) == 1)
+
+                # values read without subscribing are bytes too
+                value = await raw_sub.get("pub", "array")
+                assert type(value) is bytes
+
+        # plain handlers get bytes which hold only payload
+        assert type(raw[0]) is bytes
+        assert type(raw_sub.client.received["pub"]["array"]) is bytes
+        assert np.array_equal(NumpyArray.decode(raw[0]), array)
+
+        # decoded array is aligned view over received payload, not a copy
+        base = decoded[0]
+        while isinstance(base, np.ndarray):
+            base = base.base
+
+        assert type(base) is bytes and len(base) == len(raw[0])
+        assert decoded[0].ctypes.data % ARRAY_ALIGNMENT == 0
+        assert np.array_equal(decoded[0], array)
+
+    asyncio.run(main())
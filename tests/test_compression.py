@@ -0,0 +1,109 @@
+import asyncio
+import os
+import struct
+
+import pytest
+
+from miniros.util.datatypes import Bytes
+from miniros.util.sock import (
+    AsyncDistributedServer, Capabilities, Compression, Datatypes, _ServerProtocol,
+    choose_compression, pack_frame, unpack_frame,
+)
+from tests.helpers import FakeTransport, broker, clients, until
+
+COMPRESSIBLE = b"miniros " * 2048
+RANDOM = os.urandom(16 * 1024)
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+@pytest.mark.parametrize("payload", [b"", COMPRESSIBLE, RANDOM], ids=["empty", "compressible", "random"])
+def test_frame_round_trip(compression, payload):
+    frame = pack_frame(payload, compression)
+
+    assert struct.unpack_from(">I", frame)[0] == len(frame) - 4
+    assert frame[4] == choose_compression(payload, compression).value
+    assert unpack_frame(frame[4:], flagged=True) == payload
+
+
+def test_adaptive_compression_choice():
+    assert choose_compression(COMPRESSIBLE[:100], Compression.ADAPTIVE) is Compression.RAW
+    assert choose_compression(RANDOM, Compression.ADAPTIVE) is Compression.RAW
+    assert choose_compression(COMPRESSIBLE, Compression.ADAPTIVE) is Compression.BEST
+    assert choose_compression(COMPRESSIBLE * 8, Compression.ADAPTIVE) is Compression.FAST
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+def test_publish_subscribe_with_compression(compression):
+    async def main():
+        got = []
+
+        async def on_data(data):
+            if data:
+                got.append(data)
+
+        async with broker() as port:
+            async with clients(port, "pub", "sub", compression=compression) as (pub, sub):
+                topic = await pub.topic("data", Bytes)
+                await sub.client.subscribe("pub", "data", on_data)
+                await asyncio.sleep(0.2)
+
+                for payload in (COMPRESSIBLE, RANDOM, b"small"):
+                    await topic.post(payload)
+
+                await until(lambda: len(got) == 3)
+
+        assert got == [COMPRESSIBLE, RANDOM, b"small"]
+
+    asyncio.run(main())
+
+
+def frames(written: bytes) -> list[tuple[int, bytes]]:
+    """
+    :return: (flag byte, message) of flagged frames
+    """
+
+    result = []
+    offset = 0
+
+    while offset < len(written):
+        length = struct.unpack_from(">I", written, offset)[0]
+        body = bytes(written[offset+4:offset+4+length])
+        result.append((body[0], unpack_frame(body, flagged=True)))
+        offset += 4 + length
+
+    return result
+
+
+def test_old_peer_gets_unflagged_frames():
+    async def main():
+        server = AsyncDistributedServer("127.0.0.1", 0, stats_interval=None)
+        connections = {}
+
+        for name, capabilities in ((b"pub", Capabilities.FRAME_FLAGS), (b"new", Capabilities.FRAME_FLAGS), (b"old", None)):
+            protocol = _ServerProtocol(server)
+            transport = FakeTransport(protocol)
+            protocol.connection_made(transport)
+
+            extension = b"" if capabilities is None else struct.pack(">I", capabilities) + bytes([Compression.BEST.value, 0xff])
+            protocol.data_received(pack_frame(bytes([Datatypes.SEND_AUTH.value, len(name)]) + name + extension))
+
+            transport.written.clear()
+            connections[name] = (protocol, transport)
+
+        for name in (b"new", b"old"):
+            protocol, _ = connections[name]
+            protocol.data_received(pack_frame(bytes([Datatypes.SUBSCRIBE.value, 3, 4]) + b"pubdata", None if name == b"old" else Compression.RAW))
+
+        # publisher sends raw frame, server compresses it as each subscriber negotiated
+        connections[b"pub"][0].data_received(pack_frame(bytes([Datatypes.POST.value, 4]) + b"data" + COMPRESSIBLE, Compression.RAW))
+
+        header = bytes([Datatypes.SEND_GET.value, 3, 4]) + b"pubdata"
+
+        # old client`s frames have no flag byte, every one is zlib
+        old = connections[b"old"][1].messages(flagged=False)
+        assert header + COMPRESSIBLE in old
+
+        new = frames(connections[b"new"][1].written)
+        assert (Compression.BEST.value, header + COMPRESSIBLE) in new
+
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+import struct
+
+import numpy as np
+import pytest
+
+from miniros.util.datatypes import ARRAY_ALIGNMENT, Dict, DictView, Float32, Float64, Int16, Message, Movement, NumpyArray, UInt8, UInt64, Vector
+
+
+class Pose(Message):
+    position: Vector
+    yaw: Float32 = 0.5
+
+
+class Sample(Message):
+    pose: Pose
+    stamp: Float64
+    seq: UInt64
+    small: Int16 = -3
+    flag: UInt8 = 1
+
+
+def test_message_round_trip():
+    sample = Sample(Pose(Vector(1.0, 2.0, 3.0), 0.25), stamp=1.5, seq=2 ** 40)
+    decoded = Sample.decode(Sample.encode(sample))
+
+    assert decoded == sample
+    assert decoded.small == -3
+    assert decoded.pose.yaw == 0.25
+
+
+def test_message_layout():
+    # big-endian, no padding, nested messages inline
+    assert Vector.SIZE == 12
+    assert Pose.SIZE == 16
+    assert Sample.SIZE == 16 + 8 + 8 + 2 + 1
+
+    assert Vector.encode(Vector(1.0, 2.0, 3.0)) == struct.pack(">fff", 1.0, 2.0, 3.0)
+
+
+def test_message_pack_into():
+    buffer = bytearray(4 + Pose.SIZE)
+    pose = Pose(Vector(4.0, 5.0, 6.0))
+
+    Pose.pack_into(buffer, 4, pose)
+
+    assert Pose.unpack_from(buffer, 4) == pose
+    assert Pose.unpack_from(buffer, 4).yaw == 0.5
+
+
+def test_messages_are_hashable():
+    first = Movement(Vector(1.0, 2.0, 3.0), Vector(0.0, 0.0, 1.0))
+    second = Movement(Vector(1.0, 2.0, 3.0), Vector(0.0, 0.0, 1.0))
+
+    assert hash(Vector(1.0, 2.0, 3.0)) == hash(Vector(1.0, 2.0, 3.0))
+    assert hash(first) == hash(second)
+    assert len({first, second, Movement()}) == 2
+    assert {Vector(1.0, 2.0, 3.0): "vector"}.get(Vector(1.0, 2.0, 3.0)) == "vector"
+
+    # messages of other types with the same values aren`t equal
+    assert Pose(Vector(), 0.0) != Movement()
+
+
+def test_message_rejects_other_field_types():
+    with pytest.raises(TypeError):
+        class Broken(Message):
+            value: int
+
+
+def test_movement_reads_legacy_dict():
+    movement = Movement(Vector(1.0, 0.0, 2.0), Vector(0.0, 3.0, 0.0))
+
+    assert Movement.decode(Movement.encode(movement)) == movement
+    # older nodes sent Movement as Dict with Vector under type code 0
+    assert Movement.decode(Dict.encode({"pos": movement.pos, "ang": movement.ang}, {Vector: (Vector, 0)}, version=1)) == movement
+
+
+DICT = {"name": "turtle", "count": 3, "speed": 1.5, "raw": b"\x00\x01", "pos": Vector(1.0, 2.0, 3.0), "": ""}
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_dict_round_trip(version):
+    decoded = Dict.decode(Dict.encode(DICT, version=version))
+
+    assert decoded.keys() == DICT.keys()
+    assert decoded["speed"] == pytest.approx(1.5)
+    assert decoded["pos"] == DICT["pos"]
+    assert bytes(decoded["raw"]) == b"\x00\x01"
+    assert {key: decoded[key] for key in ("name", "count", "")} == {"name": "turtle", "count": 3, "": ""}
+
+
+def test_dict_view_decodes_lazily():
+    decoded = []
+
+    class Tracked:
+        @staticmethod
+        def decode(data):
+            decoded.append(bytes(data))
+            return bytes(data)
+
+    data = Dict.encode({"a": b"1", "b": b"2", "c": b"3"})
+    view = Dict.view(data, {3: Tracked})
+
+    assert isinstance(view, DictView)
+    assert len(view) == 3 and "b" in view and "d" not in view
+
+    assert view["b"] == b"2"
+    assert view["b"] == b"2"
+    assert decoded == [b"2"]
+
+
+def test_dict_view_over_memoryview():
+    data = memoryview(bytes(Dict.encode({"name": "turtle", "pos": Vector(1.0, 2.0, 3.0)})))
+
+    assert Dict.decode(data) == {"name": "turtle", "pos": Vector(1.0, 2.0, 3.0)}
+
+
+def test_dict_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        Dict.encode({"list": [1, 2]})
+
+
+@pytest.mark.parametrize("array", [
+    np.arange(24, dtype=np.float32).reshape(2, 3, 4),
+    np.arange(12, dtype=">i4").reshape(3, 4),
+    np.zeros((0, 5), dtype=np.uint8),
+    np.array(7, dtype=np.int64),
+    np.array([1 + 2j, 3 - 4j], dtype=np.complex128),
+    np.arange(6).reshape(2, 3) % 2 == 0,
+], ids=["3d", "big-endian", "empty", "scalar", "complex", "bool"])
+def test_numpy_array_round_trip(array):
+    decoded = NumpyArray.decode(bytes(NumpyArray.encode(array)))
+
+    assert decoded.dtype == array.dtype
+    assert decoded.shape == array.shape
+    assert np.array_equal(decoded, array)
+
+
+def test_numpy_array_layouts():
+    array = np.arange(20, dtype=np.float64).reshape(4, 5)
+
+    for layout in (np.asfortranarray(array), array[:, ::2], array.T):
+        assert np.array_equal(NumpyArray.decode(bytes(NumpyArray.encode(layout))), layout)
+
+
+def test_numpy_array_decode_is_aligned_view():
+    array = np.arange(1000, dtype=np.float64)
+
+    # array after 2 bytes of datatype`s own header, decoded from view of received payload (bytes)
+    data = bytes(bytearray(2) + NumpyArray.encode(array, start=2))
+    decoded = NumpyArray.decode(memoryview(data)[2:])
+
+    # array is a view over message, not a copy
+    assert not decoded.flags.owndata
+    assert not decoded.flags.writeable
+    assert decoded.ctypes.data % ARRAY_ALIGNMENT == 0
+    assert np.array_equal(decoded, array)
+
+
+def test_numpy_array_version_1():
+    array = np.arange(10, dtype=np.int16)
+
+    decoded = NumpyArray.decode(NumpyArray.encode(array, version=1))
+
+    assert decoded.dtype == np.int16
+    assert np.array_equal(decoded, array)
+
+
+def test_numpy_array_rejects_objects_and_structures():
+    with pytest.raises(TypeError):
+        NumpyArray.encode(np.array([object()]))
+
+    with pytest.raises(TypeError):
+        NumpyArray.encode(np.zeros(3, dtype=[("x", "<f4"), ("id", "<u2")]))
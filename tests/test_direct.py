@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+
+from miniros.util import sock
+from miniros.util.datatypes import Bytes
+from tests.helpers import broker, clients, until
+
+
+def test_direct_unix_socket_is_removed():
+    path = os.path.join(tempfile.mkdtemp(), "miniros.sock")
+
+    async def main():
+        got = []
+
+        async def on_data(data):
+            if data:
+                got.append(bytes(data))
+
+        async with broker(unix_path=path) as port:
+            async with clients(port, "pub", "sub", unix_path=path, direct=True) as (pub, sub):
+                socket_path = pub.client.direct_addr[len("unix:"):]
+                assert os.path.exists(socket_path)
+
+                topic = await pub.topic("data", Bytes)
+                await sub.client.subscribe("pub", "data", on_data)
+                await asyncio.sleep(0.3)
+
+                await topic.post(b"direct")
+                await until(lambda: got == [b"direct"])
+
+            # socket and its temporary directory
+            assert not os.path.exists(socket_path)
+            assert not os.path.exists(os.path.dirname(socket_path))
+
+    asyncio.run(main())
+
+
+def test_direct_delivery_keeps_server_value_fresh(monkeypatch):
+    monkeypatch.setattr(sock, "UNBROKERED_REFRESH", 0.1)
+
+    async def main():
+        got = []
+
+        async def on_data(data):
+            if data:
+                got.append(data)
+
+        async with broker() as port:
+            async with clients(port, "pub", "sub", "reader", direct=True) as (pub, sub, reader):
+                topic = await pub.topic("data", Bytes)
+                await sub.client.subscribe("pub", "data", on_data)
+                await until(lambda: len(pub.client.peer_subscribers.get("data", ())) == 1 and "data" in pub.client._unbrokered)
+
+                for i in range(3):
+                    await topic.post(b"value %d" % i)
+
+                await until(lambda: len(got) == 3)
+
+                # server gets the latest value after UNBROKERED_REFRESH, not every post
+                await until(lambda: pub.client._refresh == {})
+                assert await reader.get("pub", "data") == b"value 2"
+
+        assert got == [b"value 0", b"value 1", b"value 2"]
+
+    asyncio.run(main())
+
+
+def test_data_goes_through_server_when_direct_link_fails():
+    async def main():
+        got = []
+
+        async def on_data(data):
+            if data:
+                got.append(data)
+
+        async with broker() as port:
+            async with clients(port, "pub", "sub", direct=True) as (pub, sub):
+                # announced address doesn`t accept connections
+                pub.client.direct_server.close()
+                await pub.client.direct_server.wait_closed()
+
+                topic = await pub.topic("data", Bytes)
+                await sub.client.subscribe("pub", "data", on_data)
+                await until(lambda: ("pub", pub.client.direct_addr) in sub.client._failed_links)
+
+                await topic.post(b"brokered")
+                await until(lambda: got == [b"brokered"])
+
+                assert "pub" not in sub.client.links
+                assert "data" not in pub.client._unbrokered
+
+    asyncio.run(main())
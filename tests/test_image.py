@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+cv = pytest.importorskip("cv2")
+
+from miniros.base.client import AsyncROSClient, AsyncTopic
+from miniros.util.datatypes import ARRAY_ALIGNMENT, Datatype, ImageCodec, OpenCVImage
+
+
+@pytest.mark.parametrize("shape", [(48, 64, 3), (48, 64)], ids=["color", "grayscale"])
+def test_raw_codec_round_trip(shape):
+    image = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    Raw = OpenCVImage.codec(ImageCodec.RAW)
+
+    decoded = Raw.decode(bytes(Raw.encode(image)))
+
+    assert not Raw.COMPRESSED
+    assert decoded.dtype == image.dtype and np.array_equal(decoded, image)
+
+    # pixels after raw image header are aligned
+    assert decoded.ctypes.data % ARRAY_ALIGNMENT == 0
+
+
+@pytest.mark.parametrize("codec", [ImageCodec.PNG, ImageCodec.LOSSLESS])
+def test_lossless_codecs_round_trip(codec):
+    image = np.random.default_rng(0).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    Lossless = OpenCVImage.codec(codec)
+
+    assert Lossless.COMPRESSED
+    assert np.array_equal(Lossless.decode(bytes(Lossless.encode(image))), image)
+
+
+class Recorded(Datatype):
+    """
+    Records threads which encode and decode
+    """
+
+    OFFLOAD = True
+    threads: list[str] = []
+
+    @classmethod
+    def encode(cls, data):
+        cls.threads.append(threading.current_thread().name)
+        return data
+
+    @classmethod
+    def decode(cls, data):
+        cls.threads.append(threading.current_thread().name)
+        return data
+
+
+def test_slow_datatypes_run_in_executor():
+    async def main():
+        posted = []
+
+        async def post(field, data, compression):
+            posted.append((field, data))
+
+        Recorded.threads = []
+
+        with ThreadPoolExecutor(1, thread_name_prefix="codec") as executor:
+            await AsyncTopic("image", Recorded, post, executor=executor).post(b"frame")
+
+        client = AsyncROSClient("viewer")
+        try:
+            assert await client.decode(Recorded, b"frame") == b"frame"
+        finally:
+            client.executor.shutdown()
+
+        assert posted == [("image", b"frame")]
+        assert Recorded.threads[0].startswith("codec")
+        assert Recorded.threads[1].startswith("viewer-codec")
+
+    asyncio.run(main())
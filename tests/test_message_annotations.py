@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import pytest
+
+from miniros.util.datatypes import Float32, Message, UInt8, Vector
+
+
+class Reading(Message):
+    position: Vector
+    value: Float32 = 1.5
+    flags: UInt8
+
+
+def test_string_annotations_are_evaluated():
+    assert [field_name for field_name, _, _ in Reading._fields] == ["position", "value", "flags"]
+    assert Reading.SIZE == Vector.SIZE + 4 + 1
+
+    reading = Reading(Vector(1.0, 2.0, 3.0), flags=7)
+    decoded = Reading.decode(Reading.encode(reading))
+
+    assert decoded.value == 1.5
+    assert decoded.flags == 7
+    assert decoded.position.z == 3.0
+
+
+def test_unresolved_string_annotation():
+    with pytest.raises(TypeError):
+        class Broken(Message):
+            value: Unknown # noqa: F821
@@ -0,0 +1,90 @@
+import asyncio
+
+from miniros.util.sock import Outbox, QueuePolicy
+from tests.helpers import FakeTransport
+
+
+def paused_outbox(policy: QueuePolicy) -> tuple[Outbox, FakeTransport]:
+    transport = FakeTransport()
+    outbox = Outbox(transport, 2, policy)
+    outbox.pause()
+
+    return outbox, transport
+
+
+def test_block_waits_for_room():
+    async def main():
+        outbox, transport = paused_outbox(QueuePolicy.BLOCK)
+
+        assert outbox.put(b"a")
+        assert not outbox.put(b"b")
+
+        # control frames are always queued and don`t block
+        assert outbox.put(b"C", droppable=False)
+        assert outbox.depth == 3 and outbox.dropped == 0
+
+        waiter = asyncio.create_task(outbox.wait_room())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        outbox.resume()
+        await asyncio.wait_for(waiter, 1)
+
+        assert transport.written == b"abC"
+        assert outbox.depth == 0 and outbox.sent == 3
+
+    asyncio.run(main())
+
+
+def test_drop_oldest_keeps_limit_and_order():
+    async def main():
+        outbox, transport = paused_outbox(QueuePolicy.DROP_OLDEST)
+
+        outbox.put(b"A", droppable=False)
+        for frame in (b"a", b"b", b"c"):
+            assert outbox.put(frame)
+        outbox.put(b"B", droppable=False)
+        assert outbox.put(b"d")
+
+        # droppable frames never exceed the limit, even behind control frames
+        assert len(outbox.frames) == 2
+        assert outbox.dropped == 2
+
+        outbox.resume()
+        assert transport.written == b"AcBd"
+
+    asyncio.run(main())
+
+
+def test_drop_oldest_with_only_control_frames_queued():
+    async def main():
+        outbox, transport = paused_outbox(QueuePolicy.DROP_OLDEST)
+
+        for frame in (b"A", b"B", b"C"):
+            outbox.put(frame, droppable=False)
+
+        assert outbox.put(b"a")
+        assert outbox.put(b"b")
+        assert outbox.put(b"c")
+        assert outbox.dropped == 1
+
+        outbox.resume()
+        assert transport.written == b"ABCbc"
+
+    asyncio.run(main())
+
+
+def test_keep_latest_drops_all_queued_data():
+    async def main():
+        outbox, transport = paused_outbox(QueuePolicy.KEEP_LATEST)
+
+        outbox.put(b"a")
+        outbox.put(b"A", droppable=False)
+        outbox.put(b"b")
+        assert outbox.put(b"c")
+        assert outbox.dropped == 2
+
+        outbox.resume()
+        assert transport.written == b"Ac"
+
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+from collections import Counter
+
+import pytest
+
+from miniros.util.partition import HashRing
+
+TOPICS = [(f"node{i}", f"field{j}") for i in range(100) for j in range(10)]
+
+
+def test_owner_is_stable():
+    # clients and workers in other processes must agree, so owners don`t depend on python`s salted hash
+    first = HashRing(4)
+    second = HashRing(4)
+
+    assert [first.owner(*topic) for topic in TOPICS] == [second.owner(*topic) for topic in TOPICS]
+    assert first.owner("turtle", "pos") == first.owner("turtle", "pos")
+
+
+def test_owners_are_spread():
+    ring = HashRing(4)
+    counts = Counter(ring.owner(*topic) for topic in TOPICS)
+
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > len(TOPICS) / 4 / 2
+
+
+def test_adding_worker_moves_few_topics():
+    before = HashRing(4)
+    after = HashRing(5)
+
+    moved = [topic for topic in TOPICS if before.owner(*topic) != after.owner(*topic)]
+
+    # topics only move to the new worker
+    assert all(after.owner(*topic) == 4 for topic in moved)
+    assert len(moved) < len(TOPICS) / 5 * 2
+
+
+def test_single_worker():
+    ring = HashRing(1)
+
+    assert {ring.owner(*topic) for topic in TOPICS} == {0}
+
+    with pytest.raises(ValueError):
+        HashRing(0)
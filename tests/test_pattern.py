@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from miniros.util.datatypes import Bytes
+from miniros.util.pattern import PatternIndex, TopicPattern
+from tests.helpers import broker, clients, until
+
+
+def test_topic_pattern_matches_node_and_field_separately():
+    pattern = TopicPattern("camera*", "image")
+
+    assert pattern.matches("camera1", "image")
+    assert pattern.matches("camera", "image")
+    assert not pattern.matches("camera1", "image2")
+    assert not pattern.matches("lidar", "image")
+
+    assert TopicPattern("robot?", "[xy]").matches("robot1", "x")
+    assert not TopicPattern("robot?", "[xy]").matches("robot12", "x")
+
+
+def test_topic_pattern_prefix():
+    assert TopicPattern("camera*", "image").prefix == "camera"
+    assert TopicPattern("*", "pos").prefix == ""
+    assert TopicPattern("turtle", "pos").prefix == "turtle\x00pos"
+
+
+def test_pattern_index_match():
+    index = PatternIndex()
+
+    index.add("*", "pos", "all")
+    index.add("camera*", "image", "viewer")
+    index.add("turtle", "pos", "exact")
+
+    assert index.match("turtle", "pos") == {"all", "exact"}
+    assert index.match("robot", "pos") == {"all"}
+    assert index.match("camera2", "image") == {"viewer"}
+    assert index.match("lidar", "scan") == set()
+
+
+def test_pattern_index_shared_pattern():
+    index = PatternIndex()
+
+    first = index.add("*", "pos", "a")
+    second = index.add("*", "pos", "b")
+
+    assert first is second
+    assert index.match("x", "pos") == {"a", "b"}
+
+    index.remove("*", "pos", "a")
+    assert index.match("x", "pos") == {"b"}
+
+
+def test_pattern_index_remove_subscriber():
+    index = PatternIndex()
+
+    index.add("*", "pos", "a")
+    index.add("camera*", "image", "a")
+    index.add("camera*", "image", "b")
+
+    assert len(index) == 2
+    assert {(pattern.node, pattern.field) for pattern in index.owned("a")} == {("*", "pos"), ("camera*", "image")}
+
+    index.remove_subscriber("a")
+
+    assert len(index) == 1
+    assert index.owned("a") == []
+    assert index.match("x", "pos") == set()
+    assert index.match("camera1", "image") == {"b"}
+
+    # unknown patterns are ignored
+    index.remove("lidar*", "scan", "b")
+    index.remove_subscriber("c")
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_pattern_subscription(workers):
+    async def main():
+        got = []
+
+        # handler parameters don`t have to be named node and field
+        async def on_message(d, n, f):
+            if d:
+                got.append((n, f, bytes(d)))
+
+        async with broker(workers) as port:
+            async with clients(port, "camera1", "camera2", "monitor") as (camera1, camera2, monitor):
+                image1 = await camera1.topic("image", Bytes)
+
+                await monitor.subscribe_pattern("camera*", "image", on_message)
+                await asyncio.sleep(0.2)
+
+                # created after pattern subscription
+                image2 = await camera2.topic("image", Bytes)
+                other = await camera2.topic("other", Bytes)
+                await asyncio.sleep(0.2)
+
+                await image1.post(b"1")
+                await image2.post(b"2")
+                await other.post(b"x")
+
+                await until(lambda: len(got) == 2)
+                assert sorted(got) == [("camera1", "image", b"1"), ("camera2", "image", b"2")]
+
+                # exact subscription stays after pattern is removed
+                exact = []
+
+                async def on_exact(data):
+                    exact.append(bytes(data))
+
+                await monitor.client.subscribe("camera1", "image", on_exact)
+                await monitor.unsubscribe_pattern("camera*", "image")
+                await asyncio.sleep(0.2)
+
+                got.clear()
+                await image1.post(b"3")
+                await image2.post(b"4")
+
+                await until(lambda: exact == [b"3"])
+                await asyncio.sleep(0.2)
+                assert got == []
+
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+import weakref
+
+import numpy as np
+import pytest
+
+from miniros.util.shm import ShmRing, SharedArray
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRing(2, 1024)
+    yield ring
+    ring.close()
+
+
+def test_shared_array_is_read_only_view_of_slot(ring):
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    view = SharedArray.decode(ring.write(array))
+
+    assert isinstance(view, SharedArray)
+    assert view.valid
+    assert not view.flags.writeable
+    assert view.dtype == array.dtype and np.array_equal(view, array)
+
+    with pytest.raises(ValueError):
+        ring.write(np.zeros(2048, np.uint8))
+
+
+def test_overwritten_slot_is_not_valid(ring):
+    views = [SharedArray.decode(ring.write(np.full(4, i, np.int64))) for i in range(3)]
+
+    # 3rd message wrapped around into slot of the 1st
+    assert not views[0].valid
+    assert np.array_equal(views[0], np.full(4, 2))
+    assert views[1].valid and views[2].valid
+
+    views.append(SharedArray.decode(ring.write(np.full(4, 3, np.int64))))
+    assert [view.valid for view in views] == [False, False, True, True]
+
+
+def test_reader_detaches_old_segment(ring):
+    reader = SharedArray.reader()
+    other = ShmRing(2, 1024)
+
+    try:
+        old = reader.decode(ring.write(np.arange(4)))
+        assert list(reader._segments) == [ring.shm.name]
+        segment = weakref.ref(reader._segments[ring.shm.name])
+
+        # restarted publisher writes to a new ring, old view keeps its memory
+        new = reader.decode(other.write(np.arange(4) * 2))
+        assert list(reader._segments) == [other.shm.name]
+        assert np.array_equal(old, np.arange(4)) and np.array_equal(new, np.arange(4) * 2)
+
+        # segment is closed with its last view
+        del old
+        assert segment() is None
+
+        reader.close()
+        assert reader._segments == {}
+        assert new.valid and np.array_equal(new, np.arange(4) * 2)
+
+        # readers don`t share attachments
+        assert ring.shm.name not in SharedArray._segments
+    finally:
+        other.close()
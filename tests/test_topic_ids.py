@@ -0,0 +1,91 @@
+import asyncio
+
+from miniros.util.datatypes import Bytes
+from miniros.util.sock import Datatypes
+from tests.helpers import broker, clients, until
+
+
+def topic_id(client, node: str, field: str) -> int:
+    """
+    :return: server`s latest id of topic, which client got with SEND_TOPIC_ID (ids of reconnected publisher`s old topics stay)
+    """
+
+    return max(topic_id for topic_id, topic in client.client.received_ids.items() if topic == (node, field))
+
+
+def test_topic_ids_after_reconnect():
+    async def main():
+        got = []
+
+        async def on_data(data, node, field):
+            if data:
+                got.append((node, data))
+
+        async with broker() as port:
+            async with clients(port, "sub") as (sub,):
+                async with clients(port, "pub") as (pub,):
+                    topic = await pub.topic("data", Bytes)
+                    await sub.subscribe_pattern("*", "data", on_data)
+                    await asyncio.sleep(0.2)
+
+                    await topic.post(b"first")
+                    await until(lambda: got == [("pub", b"first")])
+
+                    assert pub.client._use_ids
+                    first_id = topic_id(sub, "pub", "data")
+
+                await asyncio.sleep(0.2)
+
+                # both declare their topic with the id old publisher used, server keeps them apart
+                async with clients(port, "other", "pub") as (other, pub):
+                    other_topic = await other.topic("data", Bytes)
+                    pub_topic = await pub.topic("data", Bytes)
+                    await asyncio.sleep(0.2)
+
+                    await other_topic.post(b"other")
+                    await pub_topic.post(b"second")
+                    await until(lambda: len(got) == 3)
+
+                    assert other.client.topic_ids[(Datatypes.POST, "other", "data")] == 1
+                    assert pub.client.topic_ids[(Datatypes.POST, "pub", "data")] == 1
+
+                    ids = {topic_id(sub, "pub", "data"), topic_id(sub, "other", "data"), first_id}
+                    assert len(ids) == 3
+
+        assert sorted(got) == [("other", b"other"), ("pub", b"first"), ("pub", b"second")]
+
+    asyncio.run(main())
+
+
+def test_worker_topic_ids_are_disjoint():
+    fields = [f"field{i}" for i in range(8)]
+
+    async def main():
+        got = []
+
+        async def on_data(data, node, field):
+            if data:
+                got.append((field, data))
+
+        async with broker(workers=2) as port:
+            async with clients(port, "pub", "sub") as (pub, sub):
+                owners = {field: pub.client.ring.owner("pub", field) for field in fields}
+                assert set(owners.values()) == {0, 1}
+
+                topics = [await pub.topic(field, Bytes) for field in fields]
+                await sub.subscribe_pattern("pub", "field*", on_data)
+                await asyncio.sleep(0.3)
+
+                for topic in topics:
+                    await topic.post(topic.field.encode())
+
+                await until(lambda: len(got) == len(fields))
+
+                # worker i numbers its topics from (i + 1) << 24
+                ids = {field: topic_id(sub, "pub", field) for field in fields}
+                assert len(set(ids.values())) == len(fields)
+                assert all(ids[field] >> 24 == owners[field] + 1 for field in fields)
+
+        assert sorted(got) == sorted((field, field.encode()) for field in fields)
+
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from miniros.util.datatypes import Bytes
+from miniros.util.trace import HOPS, Trace, TraceAggregator, _Histogram
+from tests.helpers import broker, clients, until
+
+
+def test_trace_hops():
+    trace = Trace(1, 10.0, 10.001, 10.003, 10.006)
+    assert trace.hops() == pytest.approx({"publisher->broker": 0.001, "broker": 0.002, "broker->subscriber": 0.003})
+
+    trace.handled = 10.010
+    trace.done = 10.020
+    assert list(trace.hops()) == ["publisher->broker", "broker", "broker->subscriber", "dispatch", "handler"]
+    assert trace.hops()["dispatch"] == pytest.approx(0.004)
+    assert trace.hops()["handler"] == pytest.approx(0.010)
+
+    # direct link has no broker times
+    assert Trace(1, 10.0, 0.0, 0.0, 10.005).hops() == pytest.approx({"publisher->subscriber": 0.005})
+
+
+def test_histogram_percentiles():
+    histogram = _Histogram()
+
+    for _ in range(90):
+        histogram.add(3e-6)
+    for _ in range(10):
+        histogram.add(1e-3)
+
+    # upper bounds of power of two buckets, capped by max
+    assert histogram.percentile(0.5) == pytest.approx(4e-6)
+    assert histogram.percentile(0.9) == pytest.approx(4e-6)
+    assert histogram.percentile(0.99) == pytest.approx(1e-3)
+    assert histogram.count == 100 and histogram.max == pytest.approx(1e-3)
+
+    # clock offset between hosts
+    histogram.add(-1.0)
+    assert histogram.buckets[0] == 1
+
+
+def test_aggregator_counts_lost_messages():
+    aggregator = TraceAggregator()
+
+    for seq in (1, 2, 5, 1, 3):
+        aggregator.add("pub", "data", Trace(seq, 10.0, 10.001, 10.002, 10.003))
+
+    report = aggregator.report()["pub/data"]
+
+    # 3 and 4 were lost, then publisher restarted and 2 was lost
+    assert report["count"] == 5
+    assert report["lost"] == 3
+    assert list(report["hops"]) == [hop for hop in HOPS if hop in report["hops"]]
+    assert report["hops"]["broker"]["count"] == 5
+
+    assert "pub/data: 5 messages, 3 lost" in aggregator.format()
+
+
+def test_subscriber_gets_trace():
+    async def main():
+        traces = []
+        tracer = TraceAggregator()
+
+        async def on_data(data, trace=None):
+            if data:
+                traces.append(trace)
+
+        async with broker() as port:
+            async with clients(port, "pub", "sub", tracer=tracer) as (pub, sub):
+                topic = await pub.topic("data", Bytes, trace=True)
+                await sub.client.subscribe("pub", "data", on_data)
+                await asyncio.sleep(0.2)
+
+                for i in range(3):
+                    await topic.post(b"value")
+
+                await until(lambda: len(traces) == 3 and tracer.report().get("pub/data", {}).get("count") == 3)
+
+        assert [trace.seq for trace in traces] == [1, 2, 3]
+
+        for trace in traces:
+            assert 0 < trace.published <= trace.broker_received <= trace.broker_forwarded <= trace.received <= trace.handled <= trace.done
+
+        report = tracer.report()["pub/data"]
+        assert report["lost"] == 0
+        assert set(report["hops"]) == {"publisher->broker", "broker", "broker->subscriber", "dispatch", "handler"}
+
+    asyncio.run(main())
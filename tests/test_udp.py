@@ -0,0 +1,177 @@
+import asyncio
+
+from miniros.util import sock
+from miniros.util.sock import AsyncDistrubutedClient, DistributedDatatypes, _FRAME_LENGTH, _UDP_FRAGMENT
+from tests.helpers import broker, clients, until
+
+
+async def udp_link(sender, receiver_name: str) -> None:
+    """
+    Sends anon messages until sender reaches receiver over UDP (see AsyncDistrubutedClient.anon)
+    """
+
+    client = sender.client
+
+    for _ in range(3):
+        await sender.anon(receiver_name, "ping", b"")
+
+        server = client.udp_servers.get(receiver_name)
+        if server is not None and server.has_connection:
+            return
+
+        await asyncio.sleep(0.1)
+
+    raise AssertionError("UDP link wasn`t set up")
+
+
+def fragment(message_id: int, index: int, count: int, chunk: bytes) -> bytes:
+    return b"".join((
+        _FRAME_LENGTH.pack(_UDP_FRAGMENT.size + len(chunk)),
+        _UDP_FRAGMENT.pack(DistributedDatatypes.FRAGMENT.value, message_id, index, count),
+        chunk,
+    ))
+
+
+def test_fragmented_anon_over_udp():
+    payload = bytes(range(256)) * 1000 # several fragments
+
+    async def main():
+        got = []
+
+        async def on_image(data, node):
+            got.append((data, node))
+
+        async with broker() as port:
+            async with clients(port, "a", "b") as (a, b):
+                b.client.anon_handlers["image"] = on_image
+                await udp_link(a, "b")
+
+                message_id = a.client._udp_message_id
+                await a.anon("b", "image", payload)
+                await until(lambda: len(got) == 1)
+
+                assert a.client._udp_message_id == message_id + 1
+                assert b.client.udp_fragments == {} and b.client.udp_fragments_bytes == 0
+
+        assert got == [(payload, "a")]
+
+    asyncio.run(main())
+
+
+def test_anon_too_large_for_udp_goes_through_server(monkeypatch):
+    monkeypatch.setattr(sock, "UDP_MAX_FRAGMENTS", 2)
+    payload = bytes(3 * sock.UDP_MAX_PAYLOAD)
+
+    async def main():
+        got = []
+
+        async def on_image(data, node):
+            got.append(data)
+
+        async with broker() as port:
+            async with clients(port, "a", "b") as (a, b):
+                b.client.anon_handlers["image"] = on_image
+                await udp_link(a, "b")
+
+                message_id = a.client._udp_message_id
+                await a.anon("b", "image", payload)
+                await until(lambda: len(got) == 1)
+
+                # no fragments were sent
+                assert a.client._udp_message_id == message_id
+
+        assert got == [payload]
+
+    asyncio.run(main())
+
+
+def test_incomplete_messages_are_dropped(monkeypatch):
+    client = AsyncDistrubutedClient("127.0.0.1", 0, "rx")
+    addr = ("127.0.0.1", 5000)
+
+    assert client._reassemble(fragment(1, 1, 2, b"b"), addr) is None
+    assert client._reassemble(fragment(1, 0, 2, b"a"), addr) == b"ab"
+
+    # expired message is dropped when the next one starts
+    monkeypatch.setattr(sock, "UDP_REASSEMBLY_TIMEOUT", 0.0)
+    client._reassemble(fragment(2, 0, 2, b"a"), addr)
+    client._reassemble(fragment(3, 0, 2, b"a"), addr)
+
+    assert list(client.udp_fragments) == [(addr, 3)]
+    assert client.udp_fragments_dropped == 1
+
+    # the oldest incomplete messages are dropped above memory limit
+    monkeypatch.setattr(sock, "UDP_REASSEMBLY_TIMEOUT", 60.0)
+    monkeypatch.setattr(sock, "UDP_REASSEMBLY_MAX_BYTES", 100)
+    client._reassemble(fragment(4, 0, 2, bytes(60)), addr)
+    client._reassemble(fragment(5, 0, 2, bytes(60)), addr)
+
+    assert list(client.udp_fragments) == [(addr, 5)]
+    assert client.udp_fragments_dropped == 3
+    assert client.udp_fragments_bytes == 60
+
+    # fragment of dropped message starts it again, it never completes
+    assert client._reassemble(fragment(4, 1, 2, bytes(60)), addr) is None
+
+
+def test_udp_anon_is_handled_in_order():
+    async def main():
+        got = []
+
+        async def on_value(data, node):
+            got.append(data)
+
+        async with broker() as port:
+            async with clients(port, "a", "b") as (a, b):
+                b.client.anon_handlers["value"] = on_value
+                await udp_link(a, "b")
+
+                for i in range(50):
+                    await a.client.anon_udp("b", "value", b"%d" % i)
+
+                await until(lambda: len(got) == 50)
+
+                # datagrams of one peer share its queue and task
+                assert len(b.client.udp_queues) == 1
+
+        assert got == [b"%d" % i for i in range(50)]
+
+    asyncio.run(main())
+
+
+def anon_datagram(node: bytes, field: bytes, data: bytes) -> bytes:
+    message = bytes([DistributedDatatypes.ANON.value, len(node), len(field)]) + node + field + data
+    return _FRAME_LENGTH.pack(len(message)) + message
+
+
+def test_udp_queue_drops_oldest_calls():
+    async def main():
+        client = AsyncDistrubutedClient("127.0.0.1", 0, "rx")
+        addr = ("127.0.0.1", 5000)
+
+        got = []
+        release = asyncio.Event()
+
+        async def on_value(data, node):
+            await release.wait()
+            got.append((node, data))
+
+        client.anon_handlers["value"] = on_value
+
+        # handler task doesn`t run until datagrams are handled
+        for i in range(sock.UDP_QUEUE_SIZE + 10):
+            client._datagram_received(anon_datagram(b"tx", b"value", b"%d" % i), addr)
+
+        queue = client.udp_queues[addr]
+        assert queue.dropped == 10
+        assert len(queue.calls) == sock.UDP_QUEUE_SIZE
+
+        release.set()
+        await until(lambda: len(got) == sock.UDP_QUEUE_SIZE)
+
+        assert got == [("tx", b"%d" % i) for i in range(10, sock.UDP_QUEUE_SIZE + 10)]
+
+        queue.task.cancel()
+        await asyncio.gather(queue.task, return_exceptions=True)
+
+    asyncio.run(main())
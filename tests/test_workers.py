@@ -0,0 +1,127 @@
+import asyncio
+import contextlib
+
+from miniros.base.server import worker_addresses
+from miniros.util.datatypes import Bytes
+from miniros.util.sock import AsyncDistributedServer
+from tests.helpers import BROKER_START_TIMEOUT, clients, free_port, until
+
+FIELDS = [f"field{i}" for i in range(8)]
+
+
+@contextlib.asynccontextmanager
+async def partitioned_broker(workers: int = 2):
+    """
+    Runs front server and its workers in this event loop, so tests can look at their state
+
+    :return: front server port, front server, workers
+    """
+
+    port = free_port(workers + 1)
+    addresses = worker_addresses("127.0.0.1", port, None, workers)
+
+    servers = [AsyncDistributedServer("127.0.0.1", worker_port, stats_interval=None, worker_index=index) for index, (worker_port, _) in enumerate(addresses)]
+    front = AsyncDistributedServer("127.0.0.1", port, stats_interval=None, workers=addresses)
+
+    listening = [asyncio.Event() for _ in range(workers + 1)]
+    tasks = [asyncio.create_task(server.run(event.set)) for server, event in zip((*servers, front), listening)]
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in listening)), BROKER_START_TIMEOUT)
+        yield port, front, servers
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_topics_are_served_by_their_owners():
+    async def main():
+        got = []
+
+        async def on_data(data, node, field):
+            if data:
+                got.append((field, data))
+
+        async with partitioned_broker() as (port, front, workers):
+            async with clients(port, "pub", "sub") as (pub, sub):
+                owners = {field: pub.client.ring.owner("pub", field) for field in FIELDS}
+                assert set(owners.values()) == {0, 1}
+
+                topics = [await pub.topic(field, Bytes) for field in FIELDS]
+                for field in FIELDS:
+                    await sub.client.subscribe("pub", field, lambda data, field=field: on_data(data, "pub", field))
+
+                await asyncio.sleep(0.3)
+
+                for topic in topics:
+                    await topic.post(topic.field.encode())
+
+                await until(lambda: len(got) == len(FIELDS))
+
+                # every worker has only topics it owns, front server has none
+                for index, worker in enumerate(workers):
+                    owned = {field for field in FIELDS if owners[field] == index}
+
+                    assert set(worker.servers["pub"].fields) == owned
+                    assert worker.servers["sub"].subscriptions == {("pub", field) for field in owned}
+
+                assert len(front.servers["pub"].fields) == 0
+                assert len(front.servers["sub"].subscriptions) == 0
+
+        assert sorted(got) == sorted((field, field.encode()) for field in FIELDS)
+
+    asyncio.run(main())
+
+
+def test_anon_goes_through_front_server():
+    async def main():
+        got = []
+
+        async def on_ping(data, node):
+            got.append((node, data))
+
+        async with partitioned_broker() as (port, front, workers):
+            async with clients(port, "a", "b") as (a, b):
+                b.client.anon_handlers["ping"] = on_ping
+
+                await asyncio.sleep(0.2)
+                received = [server.servers["a"].received for server in (front, *workers)]
+
+                await a.anon("b", "ping", b"over front", force_to_tcp=True)
+                await until(lambda: len(got) == 1)
+
+                # workers don`t know where anon goes, every node is connected to front server
+                assert front.servers["a"].received > received[0]
+                assert [worker.servers["a"].received for worker in workers] == received[1:]
+
+        assert got == [("a", b"over front")]
+
+    asyncio.run(main())
+
+
+def test_subscription_waits_for_publisher_on_worker():
+    async def main():
+        got = []
+
+        async def on_data(data):
+            if data:
+                got.append(data)
+
+        async with partitioned_broker() as (port, front, workers):
+            async with clients(port, "sub") as (sub,):
+                await sub.client.subscribe("pub", "data", on_data)
+
+                # owner keeps subscription to node which hasn`t connected yet
+                owner = workers[sub.client.ring.owner("pub", "data")]
+                await until(lambda: "pub" in owner.servers)
+
+                async with clients(port, "pub") as (pub,):
+                    topic = await pub.topic("data", Bytes)
+                    await asyncio.sleep(0.2)
+
+                    await topic.post(b"late publisher")
+                    await until(lambda: got == [b"late publisher"])
+
+    asyncio.run(main())
@@ -0,0 +1,341 @@
+import heapq
+import mmap
+import queue
+import struct
+import threading
+import time
+from enum import Enum
+from typing import Iterator
+
+# bag file layout:
+#   header, then records appended while recording: TOPIC when topic is seen first time, CHUNK with messages of one topic,
+#   INDEX with all topics and chunks is written last and header points to it.
+#   Bags which weren`t closed (recorder was killed) have no index, reader finds their records by scanning the file
+_BAG_MAGIC = b"MRBAG"
+_BAG_VERSION = 1
+_BAG_HEADER = struct.Struct(">5sBQ")  # magic, version, index record offset (0 until bag is closed)
+_RECORD = struct.Struct(">BQ")        # record kind, body length
+_TOPIC = struct.Struct(">HBB")        # topic id, node and field name lengths, names follow
+_CHUNK = struct.Struct(">HI")         # topic id, message count, messages follow
+_MESSAGE = struct.Struct(">dI")       # receive time, payload length, payload follows
+_INDEX = struct.Struct(">HI")         # topic count, chunk count, TOPIC bodies and index entries follow
+_INDEX_ENTRY = struct.Struct(">HQIdd") # topic id, chunk record offset, message count, first and last message time
+
+CHUNK_SIZE = 1 << 20 # bytes of messages buffered per topic before chunk is written
+
+class RecordKind(Enum):
+    TOPIC = 0x01
+    CHUNK = 0x02
+    INDEX = 0x03
+
+class _Chunk:
+    __slots__ = ("topic_id", "messages", "size")
+
+    def __init__(self, topic_id: int):
+        self.topic_id = topic_id
+        self.messages: list[tuple[float, bytes]] = []
+        self.size = 0
+
+class ChunkInfo:
+    __slots__ = ("topic_id", "offset", "count", "start", "end")
+
+    def __init__(self, topic_id: int, offset: int, count: int, start: float, end: float):
+        self.topic_id = topic_id
+        self.offset = offset # of CHUNK record
+        self.count = count
+        self.start = start
+        self.end = end
+
+def _topic_body(topic_id: int, node: str, field: str) -> bytes:
+    raw_node, raw_field = node.encode(), field.encode()
+    return _TOPIC.pack(topic_id, len(raw_node), len(raw_field)) + raw_node + raw_field
+
+def _read_topic(data, offset: int) -> tuple[int, str, str, int]:
+    """
+    :return: topic id, node, field and offset after TOPIC body
+    """
+
+    topic_id, node_length, field_length = _TOPIC.unpack_from(data, offset)
+    offset += _TOPIC.size
+
+    node = bytes(data[offset:offset+node_length]).decode()
+    offset += node_length
+
+    field = bytes(data[offset:offset+field_length]).decode()
+    offset += field_length
+
+    return topic_id, node, field, offset
+
+class BagWriter:
+    """
+    Append-only bag writer.
+
+    add() only buffers messages of each topic into chunks, full chunks are written to file by writer thread,
+    so caller (e.g. receive loop) never waits for disk
+
+    :param path: bag file, overwritten if exists
+    :param chunk_size: bytes of messages buffered per topic before its chunk is written
+    """
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+
+        self.topics: dict[tuple[str, str], int] = {}
+        self._chunks: dict[int, _Chunk] = {}
+
+        self.messages = 0
+        self.bytes = 0
+
+        self._file = open(path, "wb")
+        self._file.write(_BAG_HEADER.pack(_BAG_MAGIC, _BAG_VERSION, 0))
+
+        # written by writer thread only
+        self._offset = _BAG_HEADER.size
+        self._index: list[ChunkInfo] = []
+        self._topic_bodies: list[bytes] = []
+        self._error: BaseException | None = None
+
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, name=f"bag-writer {path}", daemon=True)
+        self._thread.start()
+
+    def add(self, node: str, field: str, data: bytes, stamp: float | None = None) -> None:
+        """
+        Buffers message, data must not change after the call
+
+        :param stamp: receive time, now if None
+        """
+
+        if self._error is not None:
+            raise self._error
+
+        topic_id = self.topics.get((node, field))
+
+        if topic_id is None:
+            if len(self.topics) >= 0xffff:
+                raise ValueError("bag can`t have more than 65535 topics")
+
+            topic_id = self.topics[(node, field)] = len(self.topics)
+
+            self._chunks[topic_id] = _Chunk(topic_id)
+            self._queue.put((RecordKind.TOPIC, _topic_body(topic_id, node, field)))
+
+        chunk = self._chunks[topic_id]
+        chunk.messages.append((time.time() if stamp is None else stamp, data))
+        chunk.size += _MESSAGE.size + len(data)
+
+        self.messages += 1
+        self.bytes += len(data)
+
+        if chunk.size >= self.chunk_size:
+            self._flush_chunk(chunk)
+
+    def _flush_chunk(self, chunk: _Chunk) -> None:
+        if not chunk.messages:
+            return
+
+        self._queue.put((RecordKind.CHUNK, chunk))
+        self._chunks[chunk.topic_id] = _Chunk(chunk.topic_id)
+
+    def flush(self) -> None:
+        """
+        Sends all buffered messages to writer thread, e.g. periodically, so killed recorder loses less
+        """
+
+        for chunk in tuple(self._chunks.values()):
+            self._flush_chunk(chunk)
+
+    def _write_record(self, kind: RecordKind, parts: list) -> None:
+        length = sum(len(part) for part in parts)
+
+        self._file.write(_RECORD.pack(kind.value, length))
+        for part in parts:
+            self._file.write(part)
+
+        self._offset += _RECORD.size + length
+
+    def _write_loop(self) -> None:
+        try:
+            while (item := self._queue.get()) is not None:
+                kind, body = item
+
+                if kind == RecordKind.TOPIC:
+                    self._topic_bodies.append(body)
+                    self._write_record(kind, [body])
+                    continue
+
+                parts = [_CHUNK.pack(body.topic_id, len(body.messages))]
+                for stamp, data in body.messages:
+                    parts.append(_MESSAGE.pack(stamp, len(data)))
+                    parts.append(data)
+
+                self._index.append(ChunkInfo(body.topic_id, self._offset, len(body.messages), body.messages[0][0], body.messages[-1][0]))
+                self._write_record(kind, parts)
+        except BaseException as e:
+            self._error = e
+
+    def close(self) -> None:
+        """
+        Writes buffered messages and index
+        """
+
+        if self._file.closed:
+            return
+
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+        try:
+            if self._error is None:
+                index_offset = self._offset
+
+                parts = [_INDEX.pack(len(self._topic_bodies), len(self._index)), *self._topic_bodies]
+                parts.extend(_INDEX_ENTRY.pack(info.topic_id, info.offset, info.count, info.start, info.end) for info in self._index)
+                self._write_record(RecordKind.INDEX, parts)
+
+                self._file.seek(0)
+                self._file.write(_BAG_HEADER.pack(_BAG_MAGIC, _BAG_VERSION, index_offset))
+        finally:
+            self._file.close()
+
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> "BagWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+class BagReader:
+    """
+    Reads bag through memory map, payloads are memoryviews over it (valid until close)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._map)
+
+        if len(self.data) < _BAG_HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not a bag")
+
+        magic, version, index_offset = _BAG_HEADER.unpack_from(self.data)
+
+        if magic != _BAG_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a bag")
+
+        if version != _BAG_VERSION:
+            self.close()
+            raise ValueError(f"unknown bag version {version}")
+
+        self.topics: dict[int, tuple[str, str]] = {}
+        self.chunks: list[ChunkInfo] = []
+
+        # closed bag
+        self.indexed = index_offset != 0
+
+        if self.indexed:
+            self._read_index(index_offset)
+        else:
+            self._scan()
+
+    def _read_index(self, offset: int) -> None:
+        offset += _RECORD.size
+        topic_count, chunk_count = _INDEX.unpack_from(self.data, offset)
+        offset += _INDEX.size
+
+        for _ in range(topic_count):
+            topic_id, node, field, offset = _read_topic(self.data, offset)
+            self.topics[topic_id] = (node, field)
+
+        for _ in range(chunk_count):
+            self.chunks.append(ChunkInfo(*_INDEX_ENTRY.unpack_from(self.data, offset)))
+            offset += _INDEX_ENTRY.size
+
+    def _scan(self) -> None:
+        offset = _BAG_HEADER.size
+
+        while offset + _RECORD.size <= len(self.data):
+            kind, length = _RECORD.unpack_from(self.data, offset)
+            body = offset + _RECORD.size
+
+            # last record of killed recorder can be cut
+            if body + length > len(self.data):
+                break
+
+            if kind == RecordKind.TOPIC.value:
+                topic_id, node, field, _ = _read_topic(self.data, body)
+                self.topics[topic_id] = (node, field)
+
+            elif kind == RecordKind.CHUNK.value:
+                topic_id, count = _CHUNK.unpack_from(self.data, body)
+                stamps = [stamp for stamp, _ in self._chunk_messages(offset)]
+                self.chunks.append(ChunkInfo(topic_id, offset, count, stamps[0], stamps[-1]))
+
+            offset = body + length
+
+    def _chunk_messages(self, offset: int) -> Iterator[tuple[float, memoryview]]:
+        offset += _RECORD.size
+        _, count = _CHUNK.unpack_from(self.data, offset)
+        offset += _CHUNK.size
+
+        for _ in range(count):
+            stamp, length = _MESSAGE.unpack_from(self.data, offset)
+            offset += _MESSAGE.size
+
+            yield stamp, self.data[offset:offset+length]
+            offset += length
+
+    def _topic_messages(self, topic_id: int) -> Iterator[tuple[float, int, memoryview]]:
+        for info in self.chunks:
+            if info.topic_id == topic_id:
+                for stamp, payload in self._chunk_messages(info.offset):
+                    yield stamp, topic_id, payload
+
+    def messages(self, topics: list[tuple[str, str]] | None = None) -> Iterator[tuple[float, str, str, memoryview]]:
+        """
+        :param topics: (node, field) list, all topics if None
+        :return: (receive time, node, field, payload) of all messages in time order
+        """
+
+        ids = [topic_id for topic_id, topic in self.topics.items() if topics is None or topic in topics]
+
+        # chunks of every topic are in time order, so topics only need merging
+        for stamp, topic_id, payload in heapq.merge(*(self._topic_messages(topic_id) for topic_id in ids), key=lambda message: message[0]):
+            node, field = self.topics[topic_id]
+            yield stamp, node, field, payload
+
+    def info(self) -> dict[str, dict]:
+        """
+        :return: {"node/field": {"messages": ..., "start": ..., "end": ...}}
+        """
+
+        info = {}
+
+        for chunk in self.chunks:
+            node, field = self.topics[chunk.topic_id]
+            topic = info.setdefault(f"{node}/{field}", {"messages": 0, "start": chunk.start, "end": chunk.end})
+
+            topic["messages"] += chunk.count
+            topic["start"] = min(topic["start"], chunk.start)
+            topic["end"] = max(topic["end"], chunk.end)
+
+        return info
+
+    def close(self) -> None:
+        self.data.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "BagReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,16 +1,29 @@
 from typing import Any
+from collections.abc import Mapping
 import numpy as np
 import cv2 as cv
-from enum import Enum
+from enum import Enum, IntFlag
 import struct
+import math
+import sys
+
+try:
+    import annotationlib
+except ImportError: # before Python 3.14
+    annotationlib = None
 
 class Datatype:
     """
     Base interface for encoding and decoding data
     """
 
+    __slots__ = ()
+
     CODE = 0x00
 
+    COMPRESSED = False # encoded data is already compressed, so topics don`t compress frames again
+    OFFLOAD = False    # encoding and decoding are slow (and release GIL), AsyncROSClient runs them in its thread pool
+
     @staticmethod
     def decode(data: bytearray) -> Any:
         """
@@ -50,7 +63,7 @@ class NumpyArrayType(Enum):
     FLOAT32 = 0x05
     FLOAT64 = 0x06
 _arr_type_to_numpy = {
-    NumpyArrayType.INT8: np.dtype('uint8'),
+    NumpyArrayType.INT8: np.dtype('int8'),
     NumpyArrayType.INT16: np.dtype('int16'),
 
     NumpyArrayType.UINT8: np.dtype('uint8'),
@@ -62,20 +75,89 @@ _arr_type_to_numpy = {
 }
 _numpy_to_arr_type = {val: key for key, val in _arr_type_to_numpy.items()}
 
+_ARRAY_MAGIC = 0xff # version 1 arrays start with NumpyArrayType
+_ARRAY_HEADER = struct.Struct(">BBBBBB") # magic, version, flags, dimensions count, dtype string length, padding before data
+_ARRAY_DIMENSION = struct.Struct(">Q")
+# data address alignment, enough for any numpy scalar type. Received payloads are bytes which start aligned,
+# so arrays encoded at known offset in them are decoded without copying into aligned arrays
+ARRAY_ALIGNMENT = 16
+
+class ArrayFlags(IntFlag):
+    NONE = 0x00
+    FORTRAN = 0x01 # data is in Fortran (column-major) order
+
 class NumpyArray(Datatype):
     @staticmethod
-    def decode(data: bytearray):
-        datatype = NumpyArrayType(data[0])
-        dtype =  _arr_type_to_numpy[datatype]
-        b = np.frombuffer(data[1:], dtype)
+    def decode(data: bytearray) -> np.ndarray:
+        """
+        Returns array over data without copying it (read-only if data is bytes), both versions are supported
+        """
+
+        if data[0] != _ARRAY_MAGIC:
+            return np.frombuffer(data, _arr_type_to_numpy[NumpyArrayType(data[0])], offset=1)
+
+        _, version, flags, ndim, dtype_length, padding = _ARRAY_HEADER.unpack_from(data)
+
+        if version != 2:
+            raise ValueError(f"unknown NumpyArray version {version}")
+
+        offset = _ARRAY_HEADER.size
+        dtype = np.dtype(bytes(data[offset:offset+dtype_length]).decode())
+        offset += dtype_length
+
+        shape = tuple(_ARRAY_DIMENSION.unpack_from(data, offset + i * _ARRAY_DIMENSION.size)[0] for i in range(ndim))
+        offset += ndim * _ARRAY_DIMENSION.size + padding
+
+        if flags & ArrayFlags.FORTRAN:
+            return np.frombuffer(data, dtype, count=math.prod(shape), offset=offset).reshape(shape[::-1]).T
+
+        return np.frombuffer(data, dtype, count=math.prod(shape), offset=offset).reshape(shape)
 
-        return b
-    
     @staticmethod
-    def encode(data: np.ndarray):
-        encoded = data.tobytes()
-        datatype = _numpy_to_arr_type[data.dtype]
-        return bytearray([datatype.value]) + encoded
+    def encode(data: np.ndarray, version: int = 2, start: int = 0) -> bytearray:
+        """
+        :param version: 2 keeps shape, any dtype and byte order and aligns data, so decode returns aligned view over received message.
+            1 is the old flat format (7 dtypes), for nodes with older miniros
+        :param start: offset of encoded array in message (e.g. after datatype`s own header), data is aligned relative to message start
+        """
+
+        if version == 1:
+            return bytearray([_numpy_to_arr_type[data.dtype].value]) + data.tobytes()
+
+        if data.dtype.hasobject:
+            raise TypeError("arrays of python objects can`t be encoded")
+
+        # dtype string of structured array is plain void ("|V6"), its fields would be lost
+        if data.dtype.fields is not None:
+            raise TypeError("structured arrays can`t be encoded, encode their fields separately")
+
+        flags = ArrayFlags.NONE
+        if not data.flags.c_contiguous:
+            if data.flags.f_contiguous:
+                # transposed Fortran array is C-contiguous view of the same memory
+                flags = ArrayFlags.FORTRAN
+                contiguous = data.T
+            else:
+                contiguous = np.ascontiguousarray(data)
+        else:
+            contiguous = data
+
+        raw_dtype = data.dtype.str.encode()
+
+        offset = _ARRAY_HEADER.size + len(raw_dtype) + data.ndim * _ARRAY_DIMENSION.size
+        padding = -(start + offset) % ARRAY_ALIGNMENT
+
+        encoded = bytearray(offset + padding)
+        _ARRAY_HEADER.pack_into(encoded, 0, _ARRAY_MAGIC, 2, flags, data.ndim, len(raw_dtype), padding)
+        encoded[_ARRAY_HEADER.size:_ARRAY_HEADER.size+len(raw_dtype)] = raw_dtype
+
+        for i, size in enumerate(data.shape):
+            _ARRAY_DIMENSION.pack_into(encoded, _ARRAY_HEADER.size + len(raw_dtype) + i * _ARRAY_DIMENSION.size, size)
+
+        # bytes are copied from array`s memory straight into message (slice assignment would zero-fill it first)
+        encoded += memoryview(contiguous.reshape(-1).view(np.uint8))
+
+        return encoded
 
 OpenCV_IMDECODE = int
 class OpenCVImageType(Enum):
@@ -88,17 +170,78 @@ _img_type_to_cv = {
     OpenCVImageType.BGR: cv.IMREAD_COLOR_BGR,
 }
 # _cv_to_img_type = {value: key for key, value in _img_type_to_cv.items()} # uncomment if needed
+
+class ImageCodec(Enum):
+    RAW = 0x00      # pixels with shape, no encoding time, biggest messages
+    JPEG = 0x01     # lossy, quality 0-100
+    PNG = 0x02      # lossless, level 0-9
+    LOSSLESS = 0x03 # PNG with fast RLE compression, several times faster than default PNG level
+
+_IMAGE_RAW = 0xff # raw images start with it, encoded ones start with OpenCVImageType
+
 class OpenCVImage(NumpyArray):
+    """
+    OpenCV image, JPEG with default quality unless configured with OpenCVImage.codec.
+
+    Encoded images are `OpenCVImageType, NumpyArray v1 of encoded bytes`, which any miniros version decodes.
+    Raw images are `0xff, OpenCVImageType, NumpyArray v2 of pixels`
+    """
+
+    CODEC = ImageCodec.JPEG
+    PARAMS: tuple[int, ...] = () # cv.imencode params
+    IMAGE_TYPE = OpenCVImageType.BGR
+
+    COMPRESSED = True
+    OFFLOAD = True
+
+    @classmethod
+    def codec(cls, codec: ImageCodec, quality: int = 95, level: int = 3, image_type: OpenCVImageType = OpenCVImageType.BGR) -> type["OpenCVImage"]:
+        """
+        Creates datatype for topic, e.g. await client.topic("camera", OpenCVImage.codec(ImageCodec.JPEG, quality=80))
+
+        :param quality: JPEG quality
+        :param level: PNG compression level
+        :param image_type: colors which subscribers decode encoded images to. Raw images are decoded as they were posted
+        """
+
+        if codec == ImageCodec.JPEG:
+            params = (cv.IMWRITE_JPEG_QUALITY, quality)
+        elif codec == ImageCodec.PNG:
+            params = (cv.IMWRITE_PNG_COMPRESSION, level)
+        elif codec == ImageCodec.LOSSLESS:
+            params = (cv.IMWRITE_PNG_COMPRESSION, 1, cv.IMWRITE_PNG_STRATEGY, cv.IMWRITE_PNG_STRATEGY_RLE)
+        else:
+            params = ()
+
+        return type(f"OpenCVImage{codec.name.capitalize()}", (cls,), {
+            "CODEC": codec,
+            "PARAMS": params,
+            "IMAGE_TYPE": image_type,
+            "COMPRESSED": codec != ImageCodec.RAW,
+        })
+
     @staticmethod
     def decode(data: bytearray) -> cv.Mat:
+        if data[0] == _IMAGE_RAW:
+            return NumpyArray.decode(memoryview(data)[2:])
+
         datatype = OpenCVImageType(data[0])
-        arr = NumpyArray.decode(data[1:])
+        arr = NumpyArray.decode(memoryview(data)[1:])
         return cv.imdecode(arr, _img_type_to_cv[datatype])
-    
-    @staticmethod
-    def encode(image: cv.Mat, datatype: OpenCVImageType) -> bytearray:
-        arr = cv.imencode(".jpg", image)[1]
-        return bytearray([datatype.value]) + NumpyArray.encode(arr)
+
+    @classmethod
+    def encode(cls, image: cv.Mat, datatype: OpenCVImageType | None = None) -> bytearray:
+        """
+        :param datatype: colors which subscribers decode image to, configured image type if None
+        """
+
+        datatype = datatype or cls.IMAGE_TYPE
+
+        if cls.CODEC == ImageCodec.RAW:
+            return bytearray([_IMAGE_RAW, datatype.value]) + NumpyArray.encode(image, start=2)
+
+        arr = cv.imencode(".jpg" if cls.CODEC == ImageCodec.JPEG else ".png", image, cls.PARAMS)[1]
+        return bytearray([datatype.value]) + NumpyArray.encode(arr, version=1)
 
 class String(Datatype):
     @staticmethod
@@ -107,7 +250,7 @@ class String(Datatype):
     
     @staticmethod
     def decode(data):
-        return data.decode()
+        return str(data, "utf-8")
     
 class Int(Datatype):
     @staticmethod
@@ -147,13 +290,207 @@ class Bytes(Datatype):
         return data
 
 
-class Vector(Datatype):
-    def __init__(self, x: float, y: float, z: float):
-        super().__init__()
+class Scalar:
+    """
+    Fixed-size field type of Message
+
+    :param format: struct format character
+    :param default: value of field which isn`t passed to constructor
+    """
+
+    __slots__ = ("format", "default")
+
+    def __init__(self, format: str, default: Any = 0):
+        self.format = format
+        self.default = default
+
+    def __repr__(self):
+        return f"Scalar({self.format!r})"
+
+Bool = Scalar("?", False)
+Int8 = Scalar("b")
+Int16 = Scalar("h")
+Int32 = Scalar("i")
+Int64 = Scalar("q")
+UInt8 = Scalar("B")
+UInt16 = Scalar("H")
+UInt32 = Scalar("I")
+UInt64 = Scalar("Q")
+Float32 = Scalar("f", 0.0)
+Float64 = Scalar("d", 0.0)
+
+class MessageMeta(type):
+    """
+    Compiles typed fields of Message class into one struct.Struct, __slots__ and generated
+    __init__ and (un)flattening functions, so encoding and decoding are one pack/unpack call
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        inherited = [field for base in bases for field in getattr(base, "_fields", ())]
+        own = []
+
+        for field_name, field_type in mcs._annotations(name, namespace).items():
+            if not isinstance(field_type, Scalar) and not (isinstance(field_type, MessageMeta) and field_type._fields):
+                raise TypeError(f"field '{field_name}' of message '{name}' must be Scalar or non-empty Message, not {field_type!r}")
+
+            # slot would conflict with class attribute, so default goes to __init__
+            default = namespace.pop(field_name, field_type.default if isinstance(field_type, Scalar) else None)
+            own.append((field_name, field_type, default))
+
+        namespace["__slots__"] = tuple(field_name for field_name, _, _ in own)
+
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls._fields = tuple(inherited + own)
+
+        if cls._fields:
+            mcs._compile(cls)
+
+        return cls
+
+    @staticmethod
+    def _annotations(name: str, namespace: dict) -> dict[str, Any]:
+        """
+        Evaluated field annotations of class body, also when they are strings (from __future__ import annotations)
+        or lazy (Python 3.14+)
+        """
+
+        annotations = namespace.get("__annotations__")
+
+        if annotations is None and annotationlib is not None:
+            annotate = annotationlib.get_annotate_from_class_namespace(namespace)
+
+            if annotate is not None:
+                annotations = annotationlib.call_annotate_function(annotate, annotationlib.Format.VALUE)
+
+        module = sys.modules.get(namespace.get("__module__"))
+        scope = vars(module) if module is not None else {}
+
+        evaluated = {}
+
+        for field_name, field_type in (annotations or {}).items():
+            if isinstance(field_type, str):
+                try:
+                    field_type = eval(field_type, scope, dict(namespace))
+                except NameError as e:
+                    raise TypeError(f"field '{field_name}' of message '{name}' has unresolved type '{field_type}': {e}") from e
+
+            evaluated[field_name] = field_type
 
-        self.x = x
-        self.y = y
-        self.z = z
+        return evaluated
+
+    @staticmethod
+    def _compile(cls) -> None:
+        scope = {"cls": cls}
+        formats = []
+        values = []
+        index = 0
+
+        def build(message: MessageMeta) -> str:
+            nonlocal index
+
+            args = []
+            for _, field_type, _ in message._fields:
+                if isinstance(field_type, Scalar):
+                    formats.append(field_type.format)
+                    args.append(f"v[{index}]")
+                    index += 1
+                else:
+                    args.append(build(field_type))
+
+            scope[message.__name__] = message
+            return f"{message.__name__}({', '.join(args)})"
+
+        def flatten(message: MessageMeta, path: str) -> None:
+            for field_name, field_type, _ in message._fields:
+                if isinstance(field_type, Scalar):
+                    values.append(f"{path}.{field_name}")
+                else:
+                    flatten(field_type, f"{path}.{field_name}")
+
+        source_build = f"def _build(v):\n    return {build(cls)}\n"
+        flatten(cls, "m")
+
+        # nested messages are created for every instance, so they aren`t shared between instances
+        params, body = [], []
+        for field_name, field_type, default in cls._fields:
+            scope[f"D_{field_name}"] = default
+            params.append(f"{field_name}=D_{field_name}")
+
+            if isinstance(field_type, Scalar):
+                body.append(f"    self.{field_name} = {field_name}")
+            else:
+                scope[f"N_{field_name}"] = field_type
+                body.append(f"    self.{field_name} = N_{field_name}() if {field_name} is None else {field_name}")
+
+        source = "\n".join((
+            source_build,
+            f"def _flatten(m):\n    return ({', '.join(values)},)\n",
+            f"def __init__(self, {', '.join(params)}):\n" + "\n".join(body) + "\n",
+        ))
+        exec(source, scope)
+
+        cls._struct = struct.Struct(">" + "".join(formats))
+        cls.SIZE = cls._struct.size
+        cls._build = staticmethod(scope["_build"])
+        cls._flatten = staticmethod(scope["_flatten"])
+
+        # own __init__ of class is kept
+        if "__init__" not in cls.__dict__:
+            cls.__init__ = scope["__init__"]
+
+class Message(Datatype, metaclass=MessageMeta):
+    """
+    Fixed-size message, declared with typed fields (Scalar types and other messages)::
+
+        class Pose(Message):
+            position: Vector
+            yaw: Float32 = 0.0
+
+    Fields are packed big-endian without padding, in declaration order, nested messages inline
+    """
+
+    __slots__ = ()
+
+    SIZE = 0
+
+    @classmethod
+    def encode(cls, data: "Message") -> bytes:
+        return cls._struct.pack(*cls._flatten(data))
+
+    @classmethod
+    def decode(cls, data: bytearray) -> "Message":
+        return cls._build(cls._struct.unpack_from(data))
+
+    @classmethod
+    def pack_into(cls, buffer: bytearray, offset: int, data: "Message") -> None:
+        """
+        Encodes message into buffer (e.g. shared memory or preallocated frame)
+        """
+
+        cls._struct.pack_into(buffer, offset, *cls._flatten(data))
+
+    @classmethod
+    def unpack_from(cls, buffer: bytearray, offset: int = 0) -> "Message":
+        return cls._build(cls._struct.unpack_from(buffer, offset))
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+
+        return all(getattr(self, field_name) == getattr(other, field_name) for field_name, _, _ in self._fields)
+
+    # equal messages must have equal hashes, e.g. as dict keys and in sets
+    def __hash__(self):
+        return hash((type(self), *(getattr(self, field_name) for field_name, _, _ in self._fields)))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(" + ", ".join(f"{field_name}={getattr(self, field_name)!r}" for field_name, _, _ in self._fields) + ")"
+
+
+class Vector(Message):
+    x: Float32
+    y: Float32
+    z: Float32
 
     def __add__(self, other: "Vector") -> "Vector":
         return Vector(self.x + other.x, self.y + other.y, self.z + other.z)
@@ -164,78 +501,181 @@ class Vector(Datatype):
     def __str__(self):
         return f"Vector({self.x}, {self.y}, {self.z})"
 
-    @staticmethod
-    def encode(data: "Vector") -> bytearray:
-        return struct.pack(">fff", data.x, data.y, data.z)
-    
-    @staticmethod
-    def decode(data: bytearray) -> "Vector":
-        return Vector(*struct.unpack(">fff", data))
+_dict_encoders: dict[type, tuple[Datatype, int]] = {
+    str: (String, 0),
+    int: (Int, 1),
+    float: (Float, 2),
+    bytes: (Bytes, 3),
+    bytearray: (Bytes, 3),
+    Vector: (Vector, 4),
+}
+_dict_decoders: dict[int, Datatype] = {
+    0: String,
+    1: Int,
+    2: Float,
+    3: Bytes,
+    4: Vector,
+}
+
+_DICT_MAGIC = 0xff # version 1 dicts start with length of the first value, it never starts with this byte
+_DICT_HEADER = struct.Struct(">BBI") # magic, version, keys count
+_DICT_ENTRY = struct.Struct(">HBII") # key length, type code, value offset, value length
+
+class DictView(Mapping):
+    """
+    Read-only mapping over encoded Dict.
+    Only keys and value offsets are read on creation, values are decoded on first access
+    """
+
+    __slots__ = ("_data", "_decoders", "_entries", "_values")
+
+    def __init__(self, data: bytearray, decoders: dict[int, Datatype] = _dict_decoders):
+        self._data = data
+        self._decoders = decoders
+        self._values: dict[str, Any] = {}
+
+        # key -> (type code, value start, value end)
+        self._entries: dict[str, tuple[int, int, int]] = {}
+
+        with memoryview(data) as view:
+            if len(view) > 0 and view[0] == _DICT_MAGIC:
+                self._read_table(view)
+            else:
+                self._read_legacy(view)
+
+    def _read_table(self, view: memoryview) -> None:
+        _, version, count = _DICT_HEADER.unpack_from(view)
+
+        if version != 2:
+            raise ValueError(f"unknown Dict version {version}")
+
+        offset = _DICT_HEADER.size
+        key_offset = offset + count * _DICT_ENTRY.size
+
+        for _ in range(count):
+            key_length, code, start, length = _DICT_ENTRY.unpack_from(view, offset)
+            offset += _DICT_ENTRY.size
+
+            self._entries[str(view[key_offset:key_offset+key_length], "utf-8")] = (code, start, start + length)
+            key_offset += key_length
+
+    def _read_legacy(self, view: memoryview) -> None:
+        # version 1: (value length, type code, value) entries, then keys joined with zero bytes and their length
+        metadata_length = struct.unpack_from(">I", view, len(view) - 4)[0]
+        values_end = len(view) - 4 - metadata_length
+
+        keys = bytes(view[values_end:-4]).split(b"\x00")
+
+        i = 0
+        offset = 0
+        while offset < values_end:
+            length = struct.unpack_from(">I", view, offset)[0]
+            self._entries[keys[i].decode()] = (view[offset+4], offset + 5, offset + 5 + length)
+
+            i += 1
+            offset += 5 + length
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+
+        code, start, end = self._entries[key]
+
+        if code not in self._decoders:
+            raise TypeError(f"decoder for type '{code}' is not found")
+
+        value = self._values[key] = self._decoders[code].decode(self._data[start:end])
+        return value
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
 
 class Dict(Datatype):
     @staticmethod
-    def encode(data: dict[str, Any], encoders: dict[type, tuple[Datatype, int]] = {
-        str: (String, 0),
-        int: (Int, 1),
-        float: (Float, 2),
-        bytes: (Bytes, 3),
-        bytearray: (Bytes, 3),
-        Vector: (Vector, 4)
-    }) -> bytearray:
-        keys = list(data.keys())
-
-        metadata = b'\x00'.join(map(str.encode, keys))
-        metadata_length = struct.pack(">I", len(metadata))
-        metadata += metadata_length
-
-        encoded = b''
-        for key in keys:
-            if type(data[key]) in encoders:
-                e, ind = encoders[type(data[key])]
-                e = e.encode(data[key])
-
-                l = struct.pack(">I", len(e))
-                encoded += l + bytearray([ind]) + e
-            else:
-                raise TypeError(f"encoder for type '{type(data[key])}' is not found")
+    def encode(data: dict[str, Any], encoders: dict[type, tuple[Datatype, int]] = _dict_encoders, version: int = 2) -> bytearray:
+        """
+        :param version: 2 puts keys and value offsets in front, so values can be decoded lazily (see DictView).
+            1 is the old format, for nodes with older miniros
+        """
+
+        raw_keys = []
+        values = []
+        codes = []
+
+        for key, value in data.items():
+            if type(value) not in encoders:
+                raise TypeError(f"encoder for type '{type(value)}' is not found")
+
+            encoder, code = encoders[type(value)]
+
+            raw_keys.append(key.encode())
+            values.append(encoder.encode(value))
+            codes.append(code)
+
+        if version == 1:
+            return Dict._encode_legacy(raw_keys, values, codes)
+
+        table_size = _DICT_HEADER.size + len(values) * _DICT_ENTRY.size
+        keys_size = sum(map(len, raw_keys))
+
+        encoded = bytearray(table_size + keys_size + sum(map(len, values)))
+        _DICT_HEADER.pack_into(encoded, 0, _DICT_MAGIC, 2, len(values))
+
+        offset = _DICT_HEADER.size
+        key_offset = table_size
+        value_offset = table_size + keys_size
+
+        for raw_key, value, code in zip(raw_keys, values, codes):
+            _DICT_ENTRY.pack_into(encoded, offset, len(raw_key), code, value_offset, len(value))
+            offset += _DICT_ENTRY.size
+
+            encoded[key_offset:key_offset+len(raw_key)] = raw_key
+            key_offset += len(raw_key)
+
+            encoded[value_offset:value_offset+len(value)] = value
+            value_offset += len(value)
+
+        return encoded
 
-        return encoded + metadata
-    
     @staticmethod
-    def decode(data: bytearray, decoders: dict[int, Datatype] = {
-        0: String,
-        1: Int,
-        2: Float,
-        3: Bytes,
-    }) -> dict[str, Any]:
-        metadata_length = struct.unpack(">I", data[-4:])[0]
-        metadata = data[-4-metadata_length:-4]
+    def _encode_legacy(raw_keys: list[bytes], values: list[bytes], codes: list[int]) -> bytearray:
+        metadata = b"\x00".join(raw_keys)
 
-        keys = list(map(bytes.decode, metadata.split(b"\x00")))
+        encoded = bytearray()
+        for value, code in zip(values, codes):
+            encoded += struct.pack(">IB", len(value), code)
+            encoded += value
 
-        i = 0
-        decoded = {}
-        while len(data[:-4-metadata_length]) > 0:
-            length = struct.unpack(">I", data[:4])[0]
-            ind = data[4]
-            key = data[5:5+length]
+        encoded += metadata
+        encoded += struct.pack(">I", len(metadata))
 
-            if ind not in decoders:
-                raise TypeError(f"decoder for type '{ind}' is not found")
+        return encoded
 
-            decoded[keys[i]] = decoders[ind].decode(key)
+    @staticmethod
+    def decode(data: bytearray, decoders: dict[int, Datatype] = _dict_decoders) -> dict[str, Any]:
+        """
+        Decodes all values, both versions are supported
+        """
 
-            i += 1
-            data = data[5+length:]
+        return dict(DictView(data, decoders))
 
-        return decoded
+    @staticmethod
+    def view(data: bytearray, decoders: dict[int, Datatype] = _dict_decoders) -> DictView:
+        """
+        Decodes values lazily, when they are accessed. Handler which reads a few keys of a large dict doesn`t decode the rest
+        """
 
-class Movement(Dict):
-    def __init__(self, pos: Vector, ang: Vector):
-        super().__init__()
+        return DictView(data, decoders)
 
-        self.pos = pos
-        self.ang = ang
+class Movement(Message):
+    pos: Vector
+    ang: Vector
 
     def __add__(self, other: "Movement"):
         return Movement(other.pos + self.pos, other.ang + self.ang)
@@ -246,17 +686,11 @@ class Movement(Dict):
     def __str__(self):
         return f"Movement({self.pos}, {self.ang})"
 
-    @staticmethod
-    def encode(data: "Movement", encoders = { Vector: (Vector, 0) }):
-        return Dict.encode({
-            "pos": data.pos,
-            "ang": data.ang,
-        }, encoders)
+    @classmethod
+    def decode(cls, data: bytearray) -> "Movement":
+        # nodes with older miniros send Movement as Dict
+        if len(data) != cls.SIZE:
+            d = Dict.decode(data, { 0: Vector })
+            return Movement(d["pos"], d["ang"])
 
-    @staticmethod
-    def decode(data, decoders = { 0: Vector }):
-        d = Dict.decode(data, decoders)
-        return Movement(
-            d["pos"],
-            d["ang"]
-        )
+        return super().decode(data)
@@ -1,4 +1,6 @@
 import threading
+import asyncio
+from miniros.util.sock import QoS
 
 class decorators:
     @staticmethod
@@ -18,11 +20,30 @@ class decorators:
         def wwrapper(func):
             async def wrapper(*args, **kwargs):
                 args = list(args)
-                args[arg] = datatype.decode(args[arg])
+
+                if getattr(datatype, "OFFLOAD", False):
+                    # handlers of AsyncROSClient subclasses decode in client`s thread pool
+                    executor = getattr(args[0], "executor", None) if arg > 0 else None
+                    args[arg] = await asyncio.get_running_loop().run_in_executor(executor, datatype.decode, args[arg])
+                else:
+                    args[arg] = datatype.decode(args[arg])
+
                 return await func(*args, **kwargs)
             return wrapper
         return wwrapper
 
+    @staticmethod
+    def qos(max_rate: float = 0.0, every: int = 1, latest: float = 0.0):
+        """
+        Sets QoS of on_ handler`s subscription (see QoS), must be the outermost decorator
+        """
+
+        def wwrapper(func):
+            func.qos = QoS(max_rate, every, latest)
+            return func
+
+        return wwrapper
+
     # def symlink(name: str):
     #     def wwrapper(func):
     #         owner = func.__self__
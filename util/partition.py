@@ -0,0 +1,52 @@
+from bisect import bisect
+import hashlib
+import struct
+
+_POINT = struct.Struct(">Q")
+
+REPLICAS = 64 # default points per worker
+
+
+def _hash(key: str) -> int:
+    # python`s hash() is salted per process, clients and servers must agree on owners
+    return _POINT.unpack(hashlib.blake2b(key.encode(), digest_size=8).digest())[0]
+
+
+class HashRing:
+    """
+    Consistent hash ring, maps topics to broker workers.
+
+    Every worker gets `replicas` points on the ring, topic belongs to the worker of the first point after topic`s hash.
+    When worker count changes, only about 1/workers of topics move
+
+    :param workers: number of workers
+    :param replicas: points per worker, more points spread topics more evenly
+    """
+
+    def __init__(self, workers: int, replicas: int = REPLICAS):
+        if workers < 1:
+            raise ValueError("ring needs at least one worker")
+
+        self.workers = workers
+        self.replicas = replicas
+
+        points = sorted((_hash(f"{worker}#{replica}"), worker) for worker in range(workers) for replica in range(replicas))
+
+        self._points = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+        self._cache: dict[tuple[str, str], int] = {}
+
+    def owner(self, node: str, field: str) -> int:
+        """
+        :return: index of worker which owns node`s field
+        """
+
+        key = (node, field)
+        worker = self._cache.get(key)
+
+        if worker is None:
+            index = bisect(self._points, _hash(f"{node}/{field}")) % len(self._points)
+            worker = self._cache[key] = self._owners[index]
+
+        return worker
@@ -0,0 +1,147 @@
+import re
+from fnmatch import translate
+
+WILDCARDS = "*?["
+
+_SEPARATOR = "\x00" # between node and field in trie keys, names don`t contain it
+
+
+class TopicPattern:
+    """
+    Compiled topic pattern, node and field are matched separately with shell-style wildcards (*, ?, [abc]),
+    so "*/pos" matches field "pos" of every node
+    """
+
+    __slots__ = ("node", "field", "_node", "_field")
+
+    def __init__(self, node: str, field: str):
+        self.node = node
+        self.field = field
+
+        self._node = re.compile(translate(node))
+        self._field = re.compile(translate(field))
+
+    @property
+    def prefix(self) -> str:
+        """
+        Literal start of pattern`s trie key, topics which match pattern start with it
+        """
+
+        key = self.node + _SEPARATOR + self.field
+
+        for i, char in enumerate(key):
+            if char in WILDCARDS:
+                return key[:i]
+
+        return key
+
+    def matches(self, node: str, field: str) -> bool:
+        return self._node.match(node) is not None and self._field.match(field) is not None
+
+    def __repr__(self) -> str:
+        return f"TopicPattern({self.node}/{self.field})"
+
+
+class _TrieNode:
+    __slots__ = ("children", "patterns")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.patterns: dict[tuple[str, str], tuple[TopicPattern, set[str]]] = {} # (node, field) -> pattern, subscribers
+
+
+class PatternIndex:
+    """
+    Pattern subscriptions of server.
+
+    Patterns are stored in trie by their literal prefix, so topic is checked only against patterns
+    whose prefix it starts with (e.g. "camera*/image" isn`t checked for "lidar/scan"), patterns which start
+    with wildcard are checked for every topic. Matching is done once per new topic, not per message
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._owned: dict[str, dict[tuple[str, str], TopicPattern]] = {} # subscriber -> its patterns
+
+    def __len__(self) -> int:
+        return len(self._owned)
+
+    def _node(self, prefix: str, create: bool = False) -> _TrieNode | None:
+        node = self._root
+
+        for char in prefix:
+            child = node.children.get(char)
+
+            if child is None:
+                if not create:
+                    return None
+
+                child = node.children[char] = _TrieNode()
+
+            node = child
+
+        return node
+
+    def add(self, node: str, field: str, subscriber: str) -> TopicPattern:
+        pattern = TopicPattern(node, field)
+        trie_node = self._node(pattern.prefix, create=True)
+
+        if (node, field) in trie_node.patterns:
+            pattern = trie_node.patterns[(node, field)][0]
+        else:
+            trie_node.patterns[(node, field)] = (pattern, set())
+
+        trie_node.patterns[(node, field)][1].add(subscriber)
+        self._owned.setdefault(subscriber, {})[(node, field)] = pattern
+
+        return pattern
+
+    def remove(self, node: str, field: str, subscriber: str) -> None:
+        owned = self._owned.get(subscriber)
+
+        if owned is None or (node, field) not in owned:
+            return
+
+        del owned[(node, field)]
+        if not owned:
+            del self._owned[subscriber]
+
+        trie_node = self._node(TopicPattern(node, field).prefix)
+        _, subscribers = trie_node.patterns[(node, field)]
+
+        subscribers.discard(subscriber)
+        if not subscribers:
+            # empty branches are kept, patterns usually come back
+            del trie_node.patterns[(node, field)]
+
+    def remove_subscriber(self, subscriber: str) -> None:
+        for node, field in tuple(self._owned.get(subscriber, ())):
+            self.remove(node, field, subscriber)
+
+    def owned(self, subscriber: str) -> list[TopicPattern]:
+        return list(self._owned.get(subscriber, {}).values())
+
+    def match(self, node: str, field: str) -> set[str]:
+        """
+        :return: subscribers which have patterns matching topic
+        """
+
+        subscribers = set()
+        trie_node = self._root
+
+        for char in node + _SEPARATOR + field:
+            for pattern, pattern_subscribers in trie_node.patterns.values():
+                if pattern.matches(node, field):
+                    subscribers |= pattern_subscribers
+
+            trie_node = trie_node.children.get(char)
+
+            if trie_node is None:
+                return subscribers
+
+        # patterns without wildcards
+        for pattern, pattern_subscribers in trie_node.patterns.values():
+            if pattern.matches(node, field):
+                subscribers |= pattern_subscribers
+
+        return subscribers
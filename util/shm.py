@@ -0,0 +1,190 @@
+from multiprocessing import shared_memory
+from typing import Any
+import numpy as np
+import atexit
+import struct
+
+from miniros.util.datatypes import Datatype
+
+_MAGIC = b"MRSH"
+
+_SEGMENT_HEADER = struct.Struct("<4sBxxxIQ") # magic, version, slots, slot size
+_SLOT_SEQ = struct.Struct("<Q")              # sequence number of message in slot, 0 while slot is being written
+_DESCRIPTOR = struct.Struct(">IQB")          # slot, sequence number, ndim
+
+_HEADER_SIZE = 64 # segment and slot headers are padded, so array data is 64-byte aligned
+
+_owned: set[str] = set() # segments of rings created by this process
+
+
+class ShmRing:
+    """
+    Ring buffer of fixed-size slots in shared memory, written by a single publisher
+
+    Message N is written to slot N % slots, so a slot is overwritten after `slots` newer messages.
+    Only small descriptors (segment name, slot, sequence number, dtype and shape) are sent through the server
+
+    :param slots: number of slots, readers can hold views of this many latest messages
+    :param slot_size: max array size in bytes
+    """
+
+    def __init__(self, slots: int, slot_size: int):
+        self.slots = slots
+        self.slot_size = (slot_size + _HEADER_SIZE - 1) // _HEADER_SIZE * _HEADER_SIZE
+        self.seq = 0
+
+        self.shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + self.slots * (_HEADER_SIZE + self.slot_size))
+        _SEGMENT_HEADER.pack_into(self.shm.buf, 0, _MAGIC, 1, self.slots, self.slot_size)
+
+        self.raw_name = self.shm.name.encode()
+        _owned.add(self.shm.name)
+
+        atexit.register(self.close)
+
+    def write(self, array: np.ndarray) -> bytes:
+        """
+        Copies array to the next slot
+
+        :return: descriptor to send to subscribers (see SharedArray)
+        """
+
+        if array.nbytes > self.slot_size:
+            raise ValueError(f"array of {array.nbytes} bytes doesn`t fit into {self.slot_size} bytes slot")
+
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = _HEADER_SIZE + slot * (_HEADER_SIZE + self.slot_size)
+
+        # readers see slot as invalid until data is completely written
+        _SLOT_SEQ.pack_into(self.shm.buf, offset, 0)
+        np.ndarray(array.shape, array.dtype, buffer=self.shm.buf, offset=offset + _HEADER_SIZE)[...] = array
+        _SLOT_SEQ.pack_into(self.shm.buf, offset, self.seq)
+
+        dtype = array.dtype.str.encode()
+
+        return b"".join((
+            bytes([len(self.raw_name)]),
+            self.raw_name,
+            _DESCRIPTOR.pack(slot, self.seq, array.ndim),
+            struct.pack(f">{array.ndim}Q", *array.shape),
+            bytes([len(dtype)]),
+            dtype,
+        ))
+
+    def close(self) -> None:
+        if self.shm is None:
+            return
+
+        atexit.unregister(self.close)
+        _owned.discard(self.shm.name)
+
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name)
+
+    # segment is owned by publisher, reader process must not unlink it on exit.
+    # Publisher in this process shares its registration, which unlinking the ring removes
+    if name not in _owned:
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+    magic, _, _, _ = _SEGMENT_HEADER.unpack_from(shm.buf, 0)
+    if magic != _MAGIC:
+        shm.close()
+        raise ValueError(f"shared memory segment '{name}' is not a MiniROS ring")
+
+    return shm
+
+
+class SharedArray(np.ndarray, Datatype):
+    """
+    Read-only zero-copy view of array in publisher`s shared memory ring
+
+    The view stays valid until publisher writes `slots` newer messages to the topic, then its data is overwritten.
+    Check `valid` after reading or copy array (np.array(view)) to keep it longer.
+    Works only for nodes on the same host.
+
+    Segments stay attached until close(), use reader() to detach segments of one subscription
+    """
+
+    _segments: dict[str, shared_memory.SharedMemory] = {}
+    _SINGLE = False # reader of one topic keeps only the latest segment attached
+
+    def __array_finalize__(self, obj: Any) -> None:
+        self._slot_offset = getattr(obj, "_slot_offset", None)
+        self._shm = getattr(obj, "_shm", None)
+        self.seq = getattr(obj, "seq", 0)
+
+    @property
+    def valid(self) -> bool:
+        """
+        False if slot was overwritten (or is being overwritten) by a newer message
+        """
+
+        return self._shm is not None and _SLOT_SEQ.unpack_from(self._shm.buf, self._slot_offset)[0] == self.seq
+
+    @staticmethod
+    def encode(data: bytes) -> bytes:
+        # descriptors are created by ShmRing.write
+        return data
+
+    @classmethod
+    def reader(cls) -> type["SharedArray"]:
+        """
+        Creates datatype for one subscription, e.g.
+        images = SharedArray.reader(), subscribe with decorators.aparsedata(images) and call images.close() after unsubscribing.
+
+        Segment of publisher`s old ring (e.g. publisher restarted) is detached when descriptor of a new one arrives
+        """
+
+        return type("SharedArrayReader", (cls,), {"_segments": {}, "_SINGLE": True})
+
+    @classmethod
+    def close(cls) -> None:
+        """
+        Detaches segments, views which are still alive keep their memory until they are gone
+        """
+
+        # views hold their segment (numpy doesn`t keep buffer export, so closing it under them would unmap their memory),
+        # SharedMemory closes itself when the last reference is gone
+        cls._segments.clear()
+
+    @classmethod
+    def decode(cls, data: bytes) -> "SharedArray":
+        name_length = data[0]
+        name = bytes(data[1:1+name_length]).decode()
+        offset = 1 + name_length
+
+        slot, seq, ndim = _DESCRIPTOR.unpack_from(data, offset)
+        offset += _DESCRIPTOR.size
+
+        shape = struct.unpack_from(f">{ndim}Q", data, offset)
+        offset += 8 * ndim
+
+        dtype_length = data[offset]
+        dtype = np.dtype(bytes(data[offset+1:offset+1+dtype_length]).decode())
+
+        shm = cls._segments.get(name)
+        if shm is None:
+            if cls._SINGLE:
+                cls.close()
+
+            shm = cls._segments[name] = _attach(name)
+
+        _, _, _, slot_size = _SEGMENT_HEADER.unpack_from(shm.buf, 0)
+        slot_offset = _HEADER_SIZE + slot * (_HEADER_SIZE + slot_size)
+
+        view = np.ndarray(shape, dtype, buffer=shm.buf, offset=slot_offset + _HEADER_SIZE).view(cls)
+        view.flags.writeable = False
+        view._slot_offset = slot_offset
+        view._shm = shm
+        view.seq = seq
+
+        return view
@@ -3,12 +3,20 @@ import struct
 import logging
 import zlib
 import threading
-from enum import Enum
-from typing import Callable
-import json
+from enum import Enum, IntFlag
+from typing import Callable, Iterable
 import time
 import asyncio
 import random
+import os
+import stat
+import tempfile
+from collections import deque
+from miniros.util.partition import HashRing, REPLICAS
+from miniros.util.trace import Trace, TraceAggregator, TRACE_POST, TRACE_SEND
+from miniros.util.pattern import PatternIndex, TopicPattern
+import inspect
+import math
 
 AddrLike = str | tuple[str, int]
 
@@ -27,7 +35,38 @@ class Datatypes(Enum):
     ANON = 0x07
     SEND_ANON = 0x08
 
-    ROSSTAT = 0xfd
+    TOPIC = 0x09
+
+    SUBSCRIBE_MANY = 0x0a
+    UNSUBSCRIBE_MANY = 0x0b
+
+    DECLARE_ID = 0x0c
+    POST_ID = 0x0d
+    ANON_ID = 0x0e
+    SEND_GET_ID = 0x0f
+    SEND_TOPIC_ID = 0x10
+
+    SEND_GET_MANY = 0x11
+
+    DIRECT_ADDR = 0x12 # publisher`s direct listener address, announced to server and sent by server to subscribers
+    DIRECT = 0x13      # publisher tells server that subscriber of its field gets data directly (or not anymore)
+    BROKERED = 0x14    # server tells publisher whether it needs field data (has non-direct subscribers or field is latched)
+
+    PARTITIONS = 0x15 # server tells client addresses of broker workers, topics are served by their owning worker (see HashRing)
+
+    TRACE = 0x16 # wraps POST/POST_ID of traced topic with TRACE_POST header, and SEND_GET/SEND_GET_ID with TRACE_SEND header (see Trace)
+
+    CALL = 0x17       # client calls node`s service, server forwards it to node as SEND_CALL with caller`s name (see _CALL)
+    SEND_CALL = 0x18
+    REPLY = 0x19      # service node answers call, server forwards it to caller as SEND_REPLY (see _REPLY)
+    SEND_REPLY = 0x1a
+
+    GET_MANY = 0x1b # client reads cached values of several topics, server answers with SEND_GET_MANY with the same request id
+
+    SUBSCRIBE_PATTERN = 0x1c   # subscribes to existing and future topics matching node and field patterns (see TopicPattern)
+    UNSUBSCRIBE_PATTERN = 0x1d
+
+    ROSSTAT = 0xfb # used to share 0xfd with SEND_UDP_AUTH
 
     GET_UDP_AUTH = 0xfc
     SEND_UDP_AUTH = 0xfd
@@ -41,6 +80,7 @@ class Errortypes(Enum):
     INVALID_SUBSCRIBE = 0x03
     INVALID_ANON_CREDENTIALS = 0x04
     INVALID_GET_UDP_CREDENTIALS = 0x05
+    INVALID_TOPIC_ID = 0x06
 
 class DistributedDatatypes(Enum):
     PING = 0x00
@@ -48,46 +88,664 @@ class DistributedDatatypes(Enum):
 
     ANON = 0x02
 
+    FRAGMENT = 0x03 # part of message larger than UDP_MAX_PAYLOAD (see AsyncDistrubutedClient.send_udp)
+
 class Status(Enum):
     OK = 0x00
     ERROR = 0x01
 
-def new_sock(use_udp: bool = False) -> socket.socket:
+class ServiceStatus(Enum):
+    OK = 0x00
+    ERROR = 0x01       # service handler raised, reply is error text
+    NOT_FOUND = 0x02   # node has no such service
+    UNREACHABLE = 0x03 # node isn`t connected or doesn`t support services
+
+class ServiceError(Exception):
+    """
+    Raised by call when service didn`t answer with OK
+    """
+
+    def __init__(self, status: ServiceStatus, message: str = ""):
+        super().__init__(f"{status.name}: {message}" if message else status.name)
+
+        self.status = status
+        self.message = message
+
+class Capabilities(IntFlag):
+    """
+    Protocol extensions, negotiated in REQUEST_AUTH/SEND_AUTH.
+    Old peers don`t send capabilities and are treated as NONE
+    """
+
+    NONE = 0x00
+    FRAME_FLAGS = 0x01   # every frame body starts with Compression byte
+    TOPIC_OPTIONS = 0x02 # TOPIC message is supported
+    BATCH_SUBSCRIBE = 0x04 # SUBSCRIBE_MANY and UNSUBSCRIBE_MANY messages are supported
+    TOPIC_IDS = 0x08       # topics can be addressed by numeric ids instead of names
+    BULK_GET = 0x10        # several topic values can be sent in one SEND_GET_MANY message
+    DIRECT_TOPICS = 0x20   # client connects to publishers directly, server only tracks subscriptions (see AsyncDistrubutedClient direct mode)
+    PARTITIONS = 0x40      # topics are served by broker workers (see AsyncDistributedServer workers), offered only by servers which have them
+    TRACE = 0x80           # messages of traced topics are wrapped with TRACE header
+    SERVICES = 0x100       # CALL and REPLY messages are supported
+    GET_MANY = 0x200       # GET_MANY message is supported
+    PATTERNS = 0x400       # SUBSCRIBE_PATTERN and UNSUBSCRIBE_PATTERN messages are supported
+    QOS = 0x800            # SUBSCRIBE can be followed by QoS (see QoS)
+
+SUPPORTED_CAPABILITIES = (
+    Capabilities.FRAME_FLAGS | Capabilities.TOPIC_OPTIONS | Capabilities.BATCH_SUBSCRIBE | Capabilities.TOPIC_IDS |
+    Capabilities.BULK_GET | Capabilities.DIRECT_TOPICS | Capabilities.PARTITIONS | Capabilities.TRACE |
+    Capabilities.SERVICES | Capabilities.GET_MANY | Capabilities.PATTERNS | Capabilities.QOS
+)
+
+class TopicFlags(IntFlag):
+    """
+    Topic options, sent in TOPIC message after compression policy
+    """
+
+    NONE = 0x00
+    LATCHED = 0x01 # last value is sent to new subscribers right away
+
+class Compression(Enum):
+    """
+    Frame compression.
+    RAW, FAST and BEST are sent in frame flag byte, ADAPTIVE picks one of them for each frame
+    """
+
+    RAW = 0x00
+    FAST = 0x01
+    BEST = 0x02
+
+    ADAPTIVE = 0x03
+
+_compression_levels = {
+    Compression.FAST: 1,
+    Compression.BEST: 9,
+}
+
+COMPRESSION_MIN_SIZE = 256            # smaller payloads are always sent raw
+COMPRESSION_SAMPLE_SIZE = 4096        # part of payload used for compressibility check
+COMPRESSION_MIN_RATIO = 0.9           # sample must shrink by at least 10% to be compressed
+COMPRESSION_BEST_MAX_SIZE = 64 * 1024 # larger payloads use fast compression
+
+def choose_compression(data: bytes, compression: Compression) -> Compression:
+    """
+    Resolves compression policy to compression used for exact payload
+    """
+
+    if compression is not Compression.ADAPTIVE:
+        return compression
+
+    length = len(data)
+    if length < COMPRESSION_MIN_SIZE:
+        return Compression.RAW
+
+    # sample from the middle to skip headers (e.g. JPEG ones)
+    start = max(0, length // 2 - COMPRESSION_SAMPLE_SIZE // 2)
+    sample = data[start:start + COMPRESSION_SAMPLE_SIZE]
+
+    if len(zlib.compress(sample, 1)) > len(sample) * COMPRESSION_MIN_RATIO:
+        return Compression.RAW
+
+    return Compression.BEST if length <= COMPRESSION_BEST_MAX_SIZE else Compression.FAST
+
+def pack_frame(data: bytes, compression: Compression | None = None) -> bytes:
+    """
+    Packs message into frame
+
+    :param compression: compression policy, None for old frames without flag byte (always zlib)
+    """
+
+    if compression is None:
+        data = zlib.compress(data)
+        return struct.pack(">I", len(data)) + data
+
+    compression = choose_compression(data, compression)
+
+    if compression is not Compression.RAW:
+        data = zlib.compress(data, _compression_levels[compression])
+
+    return b"".join((struct.pack(">IB", len(data) + 1, compression.value), data))
+
+def unpack_frame(body: bytes, flagged: bool = False) -> bytes:
+    """
+    Restores message from frame body (frame without length)
+
+    :param flagged: frame body starts with Compression byte
+    """
+
+    if not flagged:
+        return zlib.decompress(body)
+
+    if body[0] == Compression.RAW.value:
+        return body[1:]
+
+    return zlib.decompress(memoryview(body)[1:])
+
+def pack_topics(topics: Iterable[tuple[str, str]]) -> bytes:
+    """
+    Packs (node, field) pairs for batched messages
+    """
+
+    packed = []
+    for node, field in topics:
+        raw_node, raw_field = node.encode(), field.encode()
+        packed += [bytes([len(raw_node), len(raw_field)]), raw_node, raw_field]
+
+    return struct.pack(">H", len(packed) // 3) + b"".join(packed)
+
+def unpack_topics(data: bytes) -> list[tuple[str, str]]:
+    """
+    Restores (node, field) pairs packed with pack_topics
+    """
+
+    count = struct.unpack(">H", data[:2])[0]
+
+    topics = []
+    offset = 2
+    for _ in range(count):
+        name_length, field_length = data[offset], data[offset+1]
+        offset += 2
+
+        topics.append((
+            bytes(data[offset:offset+name_length]).decode(),
+            bytes(data[offset+name_length:offset+name_length+field_length]).decode(),
+        ))
+        offset += name_length + field_length
+
+    return topics
+
+def pack_values(request_id: int, values: Iterable[tuple[Status, bytes, bytes, bytes]]) -> bytes:
+    """
+    Packs SEND_GET_MANY payload
+
+    :param request_id: id of request, 0 for values pushed by server (latched topics)
+    :param values: (status, raw node name, raw field name, data) list
+    """
+
+    packed = []
+    for status, raw_node, raw_field, data in values:
+        packed += [struct.pack(">BBBI", status.value, len(raw_node), len(raw_field), len(data)), raw_node, raw_field, data]
+
+    return struct.pack(">IH", request_id, len(packed) // 4) + b"".join(packed)
+
+def unpack_values(data: bytes) -> tuple[int, list[tuple[Status, str, str, bytes]]]:
+    """
+    Restores request id and (status, node, field, data) list packed with pack_values
+    """
+
+    request_id, count = struct.unpack(">IH", data[:6])
+
+    values = []
+    offset = 6
+    for _ in range(count):
+        status, name_length, field_length, data_length = struct.unpack(">BBBI", data[offset:offset+7])
+        offset += 7
+
+        values.append((
+            Status(status),
+            bytes(data[offset:offset+name_length]).decode(),
+            bytes(data[offset+name_length:offset+name_length+field_length]).decode(),
+            bytes(data[offset+name_length+field_length:offset+name_length+field_length+data_length]),
+        ))
+        offset += name_length + field_length + data_length
+
+    return request_id, values
+
+def new_sock(use_udp: bool = False, family: socket.AddressFamily = socket.AF_INET) -> socket.socket:
     """
     Initializes new fast socket
-    :param 
+    :param family: AF_INET or AF_UNIX (see parse_address)
     """
     
-    sock = None
-    if "AF_UNIX" in socket.__dict__:
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM if use_udp else socket.SOCK_STREAM)
-
-    else:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if use_udp else socket.SOCK_STREAM)
+    sock = socket.socket(family, socket.SOCK_DGRAM if use_udp else socket.SOCK_STREAM)
 
-    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) if not use_udp else ...
+    # unix sockets have no Nagle`s algorithm to disable
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) if not use_udp and family == socket.AF_INET else ...
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024 * 32)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 32)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) if family == socket.AF_INET else ...
     # sock.setblocking(False)
 
     return sock
 
 
+def parse_address(address: str, port: int | None = None) -> tuple[socket.AddressFamily, str, int | None]:
+    """
+    Parses server address.
+    Supported forms: "unix:/path/to.sock", "unix:///path/to.sock", "tcp://host:port", "host:port" and "host"
+
+    :param port: used if address has no port
+    :return: (family, host or socket path, port or None for unix sockets)
+    """
+
+    if address.startswith("unix:"):
+        if "AF_UNIX" not in socket.__dict__:
+            raise ValueError("unix sockets are not supported on this platform")
+
+        path = address[5:]
+        if path.startswith("//"):
+            path = path[2:]
+
+        return socket.AF_UNIX, path, None
+
+    if address.startswith("tcp://"):
+        address = address[6:]
+
+    # "[::1]:3000" and "localhost:3000", but not bare ipv6 "::1"
+    host, sep, tail = address.rpartition(":")
+    if sep and tail.isdigit() and (host.endswith("]") or ":" not in host):
+        address, port = host, int(tail)
+
+    return socket.AF_INET, address.strip("[]"), port
+
+
+class QueuePolicy(Enum):
+    """
+    What to do when connection`s outbound queue is full
+    """
+
+    BLOCK = 0x00       # sender waits until queue has room
+    DROP_OLDEST = 0x01 # oldest queued message is dropped
+    KEEP_LATEST = 0x02 # all queued messages are dropped, only the new one is kept
+
+
+_QOS = struct.Struct(">fIf") # max rate, every Nth message, latest-only period; appended to SUBSCRIBE
+
+class QoS:
+    """
+    Delivery options of subscription, server applies them before message is compressed and queued to subscriber,
+    so dropped messages cost neither compression nor bandwidth.
+    Subscriptions with QoS get data through server, not by direct links
+
+    :param max_rate: messages per second at most, messages which come sooner after the last sent one are dropped. No limit if 0
+    :param every: only every Nth message is sent, starting with the first one
+    :param latest: seconds, only the latest message is sent once per period. Unlike max_rate, the last message isn`t dropped,
+        it is sent when period ends. No period if 0
+    """
+
+    __slots__ = ("max_rate", "every", "latest")
+
+    def __init__(self, max_rate: float = 0.0, every: int = 1, latest: float = 0.0):
+        self.max_rate = max_rate
+        self.every = max(every, 1)
+        self.latest = latest
+
+    @property
+    def interval(self) -> float:
+        """
+        Seconds between sent messages at least
+        """
+
+        return max(1.0 / self.max_rate if self.max_rate > 0 else 0.0, self.latest)
+
+    def __bool__(self) -> bool:
+        return self.max_rate > 0 or self.every > 1 or self.latest > 0
+
+    def pack(self) -> bytes:
+        return _QOS.pack(self.max_rate, self.every, self.latest)
+
+    @staticmethod
+    def unpack(data: bytes) -> "QoS":
+        return QoS(*_QOS.unpack_from(data))
+
+    def __repr__(self) -> str:
+        return f"QoS(max_rate={self.max_rate}, every={self.every}, latest={self.latest})"
+
+
+class _Throttle:
+    """
+    Server-side state of subscription with QoS
+    """
+
+    __slots__ = ("qos", "interval", "count", "last_sent", "pending", "timer")
+
+    def __init__(self, qos: QoS):
+        self.qos = qos
+        self.interval = qos.interval
+
+        self.count = 0
+        self.last_sent = -math.inf # monotonic time
+        self.pending: bytes | None = None # latest message waiting for period end
+        self.timer: asyncio.TimerHandle | None = None
+
+    def admit(self, data: bytes, now: float) -> bool:
+        """
+        :return: message is sent now, otherwise it is dropped or kept as pending
+        """
+
+        self.count += 1
+
+        if (self.count - 1) % self.qos.every != 0:
+            return False
+
+        if now - self.last_sent < self.interval:
+            if self.qos.latest > 0:
+                self.pending = data
+
+            return False
+
+        self.last_sent = now
+        self.pending = None
+
+        return True
+
+    def cancel(self) -> None:
+        self.pending = None
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+class Outbox:
+    """
+    Bounded outbound queue of one connection
+
+    Frames are written to transport directly while its buffer has room.
+    When transport pauses writing, frames wait in queue, where queue policy is applied.
+    Only droppable frames (topic data, ANON) are counted against queue limit and dropped.
+    Control frames (replies, errors, auth) are always queued
+    """
+
+    __slots__ = ("writer", "maxsize", "policy", "frames", "control", "dropped", "sent", "sent_bytes", "closed", "paused", "_seq", "_room")
+
+    def __init__(self, writer: asyncio.WriteTransport, maxsize: int = 256, policy: QueuePolicy = QueuePolicy.BLOCK):
+        self.writer = writer
+        self.maxsize = maxsize
+        self.policy = policy
+
+        # queued (sequence number, frame), droppable and control frames are kept apart,
+        # so dropping is O(1) and resume writes both in order of put
+        self.frames: deque[tuple[int, bytes]] = deque()
+        self.control: deque[tuple[int, bytes]] = deque()
+        self._seq = 0
+
+        self.dropped = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.closed = False
+        self.paused = False # transport buffer is over its high-water mark
+
+        self._room = asyncio.Event()
+        self._room.set()
+
+    @property
+    def depth(self) -> int:
+        return len(self.frames) + len(self.control)
+
+    def pause(self) -> None:
+        self.paused = True
+
+    def resume(self) -> None:
+        """
+        Writes queued frames until transport pauses again
+        """
+
+        self.paused = False
+
+        frames, control = self.frames, self.control
+
+        while (len(frames) > 0 or len(control) > 0) and not self.paused and not self.closed:
+            if len(control) == 0 or len(frames) > 0 and frames[0][0] < control[0][0]:
+                _, frame = frames.popleft()
+            else:
+                _, frame = control.popleft()
+
+            # may pause writing right away
+            self.writer.write(frame)
+            self.sent += 1
+            self.sent_bytes += len(frame)
+
+        if len(self.frames) < self.maxsize:
+            self._room.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.frames.clear()
+        self.control.clear()
+        self._room.set()
+
+    def put(self, frame: bytes, droppable: bool = True) -> bool:
+        """
+        Queues frame without waiting
+
+        :return: False if queue is full and sender should wait (see wait_room) before sending more
+        """
+
+        if self.closed:
+            if droppable:
+                self.dropped += 1
+            return True
+
+        if not self.paused and len(self.frames) == 0 and len(self.control) == 0:
+            self.writer.write(frame)
+            self.sent += 1
+            self.sent_bytes += len(frame)
+            return True
+
+        self._seq += 1
+
+        if not droppable:
+            self.control.append((self._seq, frame))
+            return True
+
+        if len(self.frames) >= self.maxsize:
+            match self.policy:
+                case QueuePolicy.DROP_OLDEST:
+                    self.frames.popleft()
+                    self.dropped += 1
+
+                case QueuePolicy.KEEP_LATEST:
+                    self.dropped += len(self.frames)
+                    self.frames.clear()
+
+        self.frames.append((self._seq, frame))
+
+        if len(self.frames) >= self.maxsize:
+            self._room.clear()
+            return self.policy is not QueuePolicy.BLOCK
+
+        return True
+
+    async def wait_room(self) -> None:
+        await self._room.wait()
+
+    async def send(self, frame: bytes, droppable: bool = True) -> None:
+        """
+        Queues frame, waits for room if queue is full and policy is BLOCK
+        """
+
+        if not self.put(frame, droppable):
+            await self.wait_room()
+
+
+_TOPIC_ID = struct.Struct(">I")
+_CALL = struct.Struct(">IIBB")  # request id, timeout in milliseconds (0 for none), node (caller`s in SEND_CALL) and service name lengths, names and request follow
+_REPLY = struct.Struct(">IBB")  # request id, ServiceStatus, caller`s name length, name and reply follow
+_SEND_REPLY = struct.Struct(">IB") # request id, ServiceStatus, reply follows
+
 class Field:
-    __slots__ = ("data", "subscribers")
-    def __init__(self, data: bytearray, subscribers: list[str]):
+    __slots__ = (
+        "data", "subscribers", "compression", "latched", "id", "header", "id_header", "direct", "brokered", "qos",
+        "published", "published_bytes", "sent", "sent_bytes", "last_publish", "rates", "_counted",
+    )
+    def __init__(self, data: bytearray, subscribers: set[str], compression: Compression | None = None, id: int = 0, header: bytes = b""):
         self.data = data
         self.subscribers = subscribers
+        self.compression = compression # topic policy, overrides subscriber`s one
+        self.latched = False # last value is sent to new subscribers
+
+        self.id = id # server-wide topic id
+        self.header = header # SEND_GET header with node and field names
+        self.id_header = struct.pack(">BI", Datatypes.SEND_GET_ID.value, id)
+
+        self.direct: set[str] = set() # subscribers which get data from publisher directly
+        self.brokered = True          # publisher was told that server needs field data
+        self.qos: dict[str, _Throttle] = {} # subscribers with QoS
+
+        # statistics (see encode_stats)
+        self.published = 0
+        self.published_bytes = 0 # payload bytes, before compression
+        self.sent = 0            # messages queued to subscribers
+        self.sent_bytes = 0      # frame bytes queued to subscribers, after compression
+        self.last_publish = 0.0  # unix time
+        self.rates = (0.0, 0.0, 0.0, 0.0) # per second over the last stats interval: published, published bytes, sent, sent bytes
+        self._counted = (0, 0, 0, 0)      # counters at the last stats interval
 
 
 class Connection:
-    __slots__ = ("name", "fields", "socket", "udp_addr")
-    def __init__(self, name: str, fields: dict[str, Field], socket: "socket.socket", udp_addr: AddrLike):
+    __slots__ = (
+        "name", "fields", "socket", "udp_addr", "capabilities", "use_ids", "compression", "outbox", "subscriptions", "post_ids", "anon_ids",
+        "direct_addr", "received", "received_bytes", "received_raw_bytes", "rates", "_counted",
+    )
+    def __init__(
+        self,
+        name: str,
+        fields: dict[str, Field],
+        socket: "socket.socket",
+        udp_addr: AddrLike = None,
+        capabilities: Capabilities = Capabilities.NONE,
+        compression: Compression | None = None,
+        outbox: Outbox | None = None,
+    ):
         self.name = name
         self.fields = fields
         self.socket = socket
         self.udp_addr = udp_addr
+        self.capabilities = capabilities
+        self.use_ids = bool(capabilities & Capabilities.TOPIC_IDS) # checked for every sent message, flag operations are slow
+        self.compression = compression # None until frame flags are negotiated
+        self.outbox = outbox
+        self.subscriptions: set[tuple[str, str]] = set() # (node, field) this connection is subscribed to
+
+        # topic ids declared by client
+        self.post_ids: dict[int, Field] = {}
+        self.anon_ids: dict[int, tuple[str, bytes]] = {}
+
+        self.direct_addr: str | None = None # address of node`s direct listener
+
+        # statistics (see encode_stats), sent messages are counted by outbox
+        self.received = 0
+        self.received_bytes = 0     # frame bytes, after compression
+        self.received_raw_bytes = 0 # message bytes, before compression
+        self.rates = (0.0, 0.0, 0.0, 0.0) # per second over the last stats interval: received, received bytes, sent, sent bytes
+        self._counted = (0, 0, 0, 0)      # counters at the last stats interval
+
+
+STATS_NODE = "rosstat" # reserved node of server, its STATS_FIELD topic gets encoded stats every stats interval
+STATS_FIELD = "stats"
+
+_STATS_COUNT = struct.Struct(">H")
+_NODE_STATS = struct.Struct(">QQQQQII4fH")  # received, received bytes, received raw bytes, sent, sent bytes, queue depth, dropped, rates, fields count
+_TOPIC_STATS = struct.Struct(">QQQQd4fBH") # published, published bytes, sent, sent bytes, last publish, rates, TopicFlags, subscribers count
+
+def update_rates(connections: Iterable[Connection], elapsed: float) -> None:
+    """
+    Recalculates per second rates of connections and their fields from counters change over elapsed seconds
+    """
+
+    for conn in connections:
+        sent, sent_bytes = (conn.outbox.sent, conn.outbox.sent_bytes) if conn.outbox is not None else (0, 0)
+
+        counters = (conn.received, conn.received_bytes, sent, sent_bytes)
+        conn.rates = tuple((new - old) / elapsed for new, old in zip(counters, conn._counted))
+        conn._counted = counters
+
+        for field in conn.fields.values():
+            counters = (field.published, field.published_bytes, field.sent, field.sent_bytes)
+            field.rates = tuple((new - old) / elapsed for new, old in zip(counters, field._counted))
+            field._counted = counters
+
+def encode_stats(connections: Iterable[Connection]) -> bytes:
+    """
+    Packs graph (nodes, their fields and subscribers) with node and topic counters, see decode_stats
+    """
+
+    connections = tuple(connections)
+    packed = [_STATS_COUNT.pack(len(connections))]
+
+    for conn in connections:
+        outbox = conn.outbox
+        raw_name = conn.name.encode()
+
+        packed += [bytes([len(raw_name)]), raw_name, _NODE_STATS.pack(
+            conn.received, conn.received_bytes, conn.received_raw_bytes,
+            outbox.sent if outbox else 0, outbox.sent_bytes if outbox else 0,
+            outbox.depth if outbox else 0, outbox.dropped if outbox else 0,
+            *conn.rates,
+            len(conn.fields),
+        )]
+
+        for field_name, field in conn.fields.items():
+            raw_field_name = field_name.encode()
+            flags = TopicFlags.LATCHED if field.latched else TopicFlags.NONE
+
+            packed += [bytes([len(raw_field_name)]), raw_field_name, _TOPIC_STATS.pack(
+                field.published, field.published_bytes, field.sent, field.sent_bytes, field.last_publish,
+                *field.rates,
+                flags.value,
+                len(field.subscribers),
+            )]
+
+            for subscriber in field.subscribers:
+                raw_subscriber = subscriber.encode()
+                packed += [bytes([len(raw_subscriber)]), raw_subscriber]
+
+    return b"".join(packed)
+
+def decode_stats(data: bytes) -> dict[str, dict]:
+    """
+    Restores stats packed with encode_stats
+
+    :return: {node: {counters..., "fields": {field: {counters..., "subscribers": [node, ...]}}}}
+    """
+
+    def name() -> str:
+        nonlocal offset
+        length = data[offset]
+        offset += 1 + length
+        return bytes(data[offset-length:offset]).decode()
+
+    stats = {}
+    offset = _STATS_COUNT.size
+
+    for _ in range(_STATS_COUNT.unpack_from(data)[0]):
+        node_name = name()
+
+        received, received_bytes, received_raw_bytes, sent, sent_bytes, depth, dropped, *rates, fields_count = _NODE_STATS.unpack_from(data, offset)
+        offset += _NODE_STATS.size
+
+        fields = {}
+        for _ in range(fields_count):
+            field_name = name()
+
+            published, published_bytes, field_sent, field_sent_bytes, last_publish, *field_rates, flags, subscribers_count = _TOPIC_STATS.unpack_from(data, offset)
+            offset += _TOPIC_STATS.size
+
+            fields[field_name] = {
+                "published": published,
+                "published_bytes": published_bytes,
+                "sent": field_sent,
+                "sent_bytes": field_sent_bytes,
+                "last_publish": last_publish,
+                "rates": dict(zip(("published", "published_bytes", "sent", "sent_bytes"), field_rates)),
+                "latched": bool(flags & TopicFlags.LATCHED),
+                "subscribers": [name() for _ in range(subscribers_count)],
+            }
+
+        stats[node_name] = {
+            "received": received,
+            "received_bytes": received_bytes,
+            "received_raw_bytes": received_raw_bytes,
+            "sent": sent,
+            "sent_bytes": sent_bytes,
+            "queue_depth": depth,
+            "dropped": dropped,
+            "rates": dict(zip(("received", "received_bytes", "sent", "sent_bytes"), rates)),
+            "fields": fields,
+        }
+
+    return stats
 
 
 class SockServer:
@@ -104,20 +762,26 @@ class SockServer:
         self.sending = False # fix for byte-mismatch
 
 
+    def pack(self, data: bytearray, compression: Compression | None = None) -> bytes:
+        """
+        Compresses message and prepends length, so the result can be written to any connection as is
+        """
+
+        return pack_frame(data, compression)
+
+
     def send(self, sock: socket.socket, data: bytearray, addr: None | AddrLike) -> None:
-        data = zlib.compress(data)
-        length = len(data)
-        length = struct.pack(">I", length)
+        frame = self.pack(data)
 
         while self.sending:
             time.sleep(0.01)
         
         self.sending = True
 
-        self._send(sock, length, addr)
-        self._send(sock, data, addr)
-        
-        self.sending = False
+        try:
+            self._send(sock, frame, addr)
+        finally:
+            self.sending = False
 
 
     def recv(self, sock: socket.socket, addr: None | AddrLike) -> bytearray:
@@ -204,7 +868,7 @@ class SockServer:
                             if field_name not in self.servers[CREDENTIALS].fields:
                                 self.servers[CREDENTIALS].fields[field_name] = Field(
                                     data=data[data_start:],
-                                    subscribers=[]
+                                    subscribers=set()
                                 )
                                 
                             else:
@@ -250,10 +914,10 @@ class SockServer:
                             if field_name not in self.servers[node_name].fields:
                                 self.servers[node_name].fields[field_name] = Field(
                                     data=None,
-                                    subscribers=[CREDENTIALS],
+                                    subscribers={CREDENTIALS},
                                 )
                             else:
-                                self.servers[node_name].fields[field_name].subscribers.append(CREDENTIALS)
+                                self.servers[node_name].fields[field_name].subscribers.add(CREDENTIALS)
 
                         case Datatypes.ANON:
                             logging.debug("GOT ANON")
@@ -288,22 +952,7 @@ class SockServer:
                         case Datatypes.ROSSTAT:
                             logging.debug("GOT ROSSTAT")
 
-                            # tosend = {}
-                            # for x in self.servers.keys():
-                            #     v = self.servers[x]
-
-                            #     for fld in v.fields.keys():
-                            #         del v.fields[fld].data
-
-                            #     del v.socket
-                            #     tosend[x] = v
-
-                            # self.send(conn, bytearray([
-                            #     Datatypes.ROSSTAT.value,
-                            #     *json.dumps(tosend).encode()
-                            # ]), addr)
-
-                            # TODO: fix rosstat (add json encoder to Field and Connection classes)
+                            self.send(conn, bytes([Datatypes.ROSSTAT.value]) + encode_stats(tuple(self.servers.values())), addr)
 
                         case _:
                             raise Exception
@@ -388,6 +1037,9 @@ class SockClient:
             *field.encode(),
         ]))
 
+        if node in self.handlers:
+            self.handlers[node].pop(field, None)
+
     def post(self, field: str, data: bytearray) -> None:
         self.send(bytearray([
             Datatypes.POST.value,
@@ -396,6 +1048,24 @@ class SockClient:
             *data,
         ]))
 
+    def declare(self, field: str, compression: Compression | None = None, latched: bool = False) -> None:
+        """
+        Creates topic on server and sets its options. Old servers reply with error
+
+        :param compression: compression policy for topic frames, connection`s policy is used if None
+        :param latched: last value is sent to new subscribers right away
+        """
+
+        raw_field = field.encode()
+
+        self.send(bytearray([
+            Datatypes.TOPIC.value,
+            len(raw_field),
+            *raw_field,
+            0xff if compression is None else compression.value,
+            TopicFlags.LATCHED if latched else TopicFlags.NONE,
+        ]))
+
     def anon(self, node: str, field: str, data: bytearray) -> None:
         self.send(bytearray([
             Datatypes.ANON.value,
@@ -486,7 +1156,9 @@ class SockClient:
                         self.anon_handlers[field_name](data[data_start:], node_name)
 
                     case Datatypes.ROSSTAT:
-                        self.on_rosstat(json.loads(data.decode()))
+                        logging.debug("GOT ROSSTAT")
+
+                        self.on_rosstat(decode_stats(data))
 
                     case _:
                         raise Exception
@@ -497,8 +1169,10 @@ class SockClient:
 
 class TCPSockServer(SockServer):
     def __init__(self, ip: str, port: int):
-        self.sock = new_sock(False)
-        self.sock.bind((ip, port))
+        family, ip, port = parse_address(ip, port)
+
+        self.sock = new_sock(False, family)
+        self.sock.bind((ip, port) if family == socket.AF_INET else ip)
         super().__init__(ip, port)
 
     def run(self) -> None:
@@ -511,12 +1185,18 @@ class TCPSockServer(SockServer):
         return sock.recv(length)
     
     def _send(self, sock: socket.socket, data, addr):
-        return sock.send(data)
+        return sock.sendall(data)
 
 class TCPSockClient(SockClient):
     def __init__(self, ip: str, port: int, name: str):
-        self.sock = new_sock(False)
-        self.sock.connect((ip, port))
+        """
+        :param ip: server host or address string (see parse_address)
+        """
+
+        family, ip, port = parse_address(ip, port)
+
+        self.sock = new_sock(False, family)
+        self.sock.connect((ip, port) if family == socket.AF_INET else ip)
         super().__init__(ip, port, name)
 
     def _recv(self, length):
@@ -526,728 +1206,2824 @@ class TCPSockClient(SockClient):
         return self.sock.send(data)
 
 
-class AsyncDistributedServer(SockServer):
+_FRAME_LENGTH = struct.Struct(">I")
+
+class _FrameProtocol(asyncio.Protocol):
     """
-    Async TCP server class
-     
-    Allows adding a "udp_addr" property to each tcp connection which can be requested by other clients.
-    
-    Requested address can be used on clients to send ANON messages to other clients directly
+    Splits stream into frames.
+    Any number of frames is parsed from each received chunk without copying it, only incomplete tail is buffered
     """
 
-    def __init__(self, ip: str, port: int):
+    def __init__(self):
+        super().__init__()
 
-        self.sock = None
-        # self.udp_transport = None
-        # self.udp_protocol = None
-        
-        super().__init__(ip, port)
+        self.transport: asyncio.Transport = None
+        self.buffer = bytearray()
+        self.paused = False # frames are left in buffer until resume()
 
+    @property
+    def flagged(self) -> bool:
+        """
+        Frame bodies start with Compression byte
+        """
 
-    async def run(self) -> None:
-        # loop = asyncio.get_running_loop()
+        return False
 
-        # tp, pr = loop.create_datagram_endpoint(lambda: _DistributedServerUDPModule(self), (self.ip, self.port + 1))
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
 
-        # self.udp_transport: asyncio.DatagramTransport = tp
-        # self.udp_protocol: _DistributedServerUDPModule = pr
+    def data_received(self, data: bytes) -> None:
+        if len(self.buffer) > 0 or self.paused:
+            self.buffer += data
 
-        self.sock: asyncio.Server = await asyncio.start_server(self.tcp_handler, self.ip, self.port)
+            if not self.paused:
+                del self.buffer[:self._parse(self.buffer)]
 
-        # await asyncio.gather(
-            # self.sock.serve_forever(),
-            # self.udp_handler(),
-        # )
+            return
 
-        await self.sock.serve_forever()
+        parsed = self._parse(data)
 
+        if parsed < len(data):
+            self.buffer += memoryview(data)[parsed:]
 
-    async def _tcp_recv(self, sock: asyncio.StreamReader, length: int, addr: None = None):
-        return await sock.readexactly(length)
-    
-    async def _tcp_send(self, sock: asyncio.StreamWriter, data: bytes, addr: None = None):
-        sock.write(data)
-        await sock.drain()
+    def pause(self) -> None:
+        """
+        Stops reading, frames after the current one wait in buffer
+        """
 
-    async def tcp_recv(self, sock):
-        try:
-            length = await self._tcp_recv(sock, 4)
-            length = struct.unpack(">I", length)[0]
-            return zlib.decompress(await self._tcp_recv(sock, length))        
-        except:
-            return bytearray([])
+        self.paused = True
+        self.transport.pause_reading()
 
-    async def tcp_send(self, sock, data):
-        data = zlib.compress(data)
-        length = len(data)
-        length = struct.pack(">I", length)
+    def resume(self) -> None:
+        self.paused = False
 
-        while self.sending:
-            await asyncio.sleep(0.01)
-        
-        self.sending = True
+        # frames read before connection was closed are handled too
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
 
-        await self._tcp_send(sock, length)
-        await self._tcp_send(sock, data)
-        
-        self.sending = False
+        del self.buffer[:self._parse(self.buffer)]
 
-    async def tcp_broadcast(self, sockets: list[str], data):
-        tasks = []
-        for socket in sockets.copy():
-            tasks.append(self.tcp_send(self.servers[socket].socket, data))
-        await asyncio.gather(*tasks, return_exceptions=False)
+    def _parse(self, data: bytes | bytearray) -> int:
+        """
+        Handles all complete frames of data
 
-    async def tcp_handler(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
-        async def rcv():
-            return await self.tcp_recv(r)
-        
-        async def snd(data: bytes):
-            return await self.tcp_send(w, data)
+        :return: parsed bytes count
+        """
 
-        await self.handler(
-            rcv,
-            snd,
-            r, w
-        )
+        offset = 0
+        length = len(data)
 
+        with memoryview(data) as view:
+            while not self.paused and length - offset >= 4:
+                end = offset + 4 + _FRAME_LENGTH.unpack_from(view, offset)[0]
+                if end > length:
+                    break
 
-    async def handler(self, r: Callable[[], bytes], w: Callable[[bytes, None], None], reader, writer: asyncio.StreamWriter) -> None:
-        CREDENTIALS = None
+                body = view[offset+4:end]
+                offset = end
+
+                try:
+                    # raw message is handled in place, so its payload is copied once, where it is kept (see message_received)
+                    if not self.flagged:
+                        message = memoryview(zlib.decompress(body))
+                    elif body[0] == Compression.RAW.value:
+                        message = body[1:]
+                    else:
+                        message = memoryview(zlib.decompress(body[1:]))
+
+                    opcode = message[0]
+
+                except (zlib.error, IndexError) as e:
+                    # stream can`t be resynchronized after broken frame
+                    logging.error(f"broken frame: {e}")
+                    body.release()
+                    self.transport.close()
+                    break
+
+                self.message_received(opcode, message[1:])
+                message.release()
+                body.release()
+
+        return offset
+
+    def message_received(self, opcode: int, data: memoryview) -> None:
+        """
+        :param data: view over message without opcode, possibly over receive buffer. Views mustn`t outlive the call,
+            data which is stored or passed to user code is converted to bytes
+        """
+
+        ...
+
+
+class _ServerProtocol(_FrameProtocol):
+    def __init__(self, server: "AsyncDistributedServer"):
+        super().__init__()
+
+        self.server = server
+        self.conn: Connection = None
+        self.lost = False # connection is closed, but frames read before it wait in buffer
+
+    @property
+    def flagged(self) -> bool:
+        return self.conn.compression is not None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        super().connection_made(transport)
+
+        self.conn = Connection(name=None, fields={}, socket=transport, outbox=Outbox(transport, self.server.queue_size, self.server.queue_policy))
+
+        self.server.reply(self.conn, bytearray([
+            Datatypes.REQUEST_AUTH.value,
+            *struct.pack(">I", self.server.capabilities),
+        ]))
+
+    def data_received(self, data: bytes) -> None:
+        self.conn.received_bytes += len(data)
+        super().data_received(data)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # nothing can be sent to closed connection anymore
+        self.conn.outbox.close()
+
+        # sender held by full BLOCK queues (see _wait_room) has already sent frames which wait in buffer,
+        # node is removed after they are published
+        if self.paused and len(self.buffer) > 0:
+            self.lost = True
+            return
+
+        self._disconnect()
+
+    def _disconnect(self) -> None:
+        # cleanup when disconnected
+        if self.server.servers.get(self.conn.name) is self.conn:
+            self.server.disconnect(self.conn)
+
+    def pause_writing(self) -> None:
+        self.conn.outbox.pause()
+
+    def resume_writing(self) -> None:
+        self.conn.outbox.resume()
+
+    def message_received(self, opcode: int, data: bytes) -> None:
+        conn = self.conn
+        conn.received += 1
+        conn.received_raw_bytes += 1 + len(data)
+
+        handler = (self.server._handlers if conn.name is not None else self.server._auth_handlers)[opcode]
+
+        try:
+            if handler is None:
+                raise ConnectionError(f"unknown or unauthorized message {opcode}")
+
+            blocked = handler(self.conn, data)
+
+        except Exception as e:
+            logging.error(e)
+            self.server.reply(self.conn, bytearray([Datatypes.ERROR.value, Errortypes.METHOD_NOT_FOUND.value]))
+            return
+
+        # sender is held until full BLOCK queues of receivers have room
+        if blocked:
+            self.pause()
+            asyncio.ensure_future(self._wait_room(blocked))
+
+    async def _wait_room(self, blocked: list[Outbox]) -> None:
+        await asyncio.gather(*(outbox.wait_room() for outbox in blocked))
+        self.resume()
+
+        if self.lost and not self.paused:
+            self.lost = False
+            self._disconnect()
+
+
+class AsyncDistributedServer(SockServer):
+    """
+    Async TCP server class
+     
+    Allows adding a "udp_addr" property to each tcp connection which can be requested by other clients.
+    
+    Requested address can be used on clients to send ANON messages to other clients directly
+    """
+
+    # handlers get connection and message without opcode,
+    # return outboxes which must have room before the next message of connection is read
+    _message_handlers = {
+        Datatypes.SEND_AUTH: "_on_send_auth",
+        Datatypes.SEND_UDP_AUTH: "_on_send_udp_auth",
+        Datatypes.GET_UDP_AUTH: "_on_get_udp_auth",
+        Datatypes.GET: "_on_get",
+        Datatypes.POST: "_on_post",
+        Datatypes.SUBSCRIBE: "_on_subscribe",
+        Datatypes.UNSUBSCRIBE: "_on_unsubscribe",
+        Datatypes.SUBSCRIBE_MANY: "_on_subscribe_many",
+        Datatypes.UNSUBSCRIBE_MANY: "_on_unsubscribe_many",
+        Datatypes.ANON: "_on_anon",
+        Datatypes.DECLARE_ID: "_on_declare_id",
+        Datatypes.POST_ID: "_on_post_id",
+        Datatypes.ANON_ID: "_on_anon_id",
+        Datatypes.TOPIC: "_on_topic",
+        Datatypes.DIRECT_ADDR: "_on_direct_addr",
+        Datatypes.DIRECT: "_on_direct",
+        Datatypes.ROSSTAT: "_on_rosstat",
+        Datatypes.TRACE: "_on_trace",
+        Datatypes.CALL: "_on_call",
+        Datatypes.REPLY: "_on_reply",
+        Datatypes.GET_MANY: "_on_get_many",
+        Datatypes.SUBSCRIBE_PATTERN: "_on_subscribe_pattern",
+        Datatypes.UNSUBSCRIBE_PATTERN: "_on_unsubscribe_pattern",
+        Datatypes.ERROR: "_on_error",
+    }
+
+    # allowed before SEND_AUTH
+    _auth_message_handlers = (Datatypes.SEND_AUTH, Datatypes.ERROR)
+
+    def __init__(
+        self,
+        ip: str | None,
+        port: int,
+        queue_size: int = 256,
+        queue_policy: QueuePolicy = QueuePolicy.BLOCK,
+        unix_path: str | None = None,
+        stats_interval: float | None = 1.0,
+        workers: list[tuple[int | None, str | None]] | None = None,
+        worker_index: int | None = None,
+    ):
+        """
+        :param ip: TCP listener host, TCP is disabled if None
+        :param unix_path: unix socket listener path, clients connect to it with "unix:<path>" address
+        :param queue_size: outbound queue limit of each connection, in messages
+        :param queue_policy: default full queue policy, clients can request their own one
+        :param stats_interval: seconds between rates updates and STATS_NODE/STATS_FIELD publishes, None disables both
+        :param workers: (TCP port, unix socket path) of broker workers on this host, None if worker has no such listener.
+            Clients which support partitions connect to every worker and send each topic`s traffic to its owner (see HashRing).
+            ANON, UDP addresses, stats and clients without partitions stay on this server
+        :param worker_index: index of this server in workers of front server. Topic ids of workers don`t collide,
+            and subscriptions to nodes which haven`t connected to this worker yet are kept until they do
+        """
 
-        await w(bytearray([Datatypes.REQUEST_AUTH.value]))
+        self.sock = None
+        self.unix_sock = None
+        self.unix_path = unix_path
+        # self.udp_transport = None
+        # self.udp_protocol = None
+
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.stats_interval = stats_interval
+
+        self.workers = workers
+        self.worker_index = worker_index
+        self.capabilities = SUPPORTED_CAPABILITIES if workers else SUPPORTED_CAPABILITIES & ~Capabilities.PARTITIONS
+
+        # client can get SEND_TOPIC_ID from every worker, so each worker has its own id range
+        self._last_topic_id = 0 if worker_index is None else (worker_index + 1) << 24
+
+        self._placeholders: set[str] = set() # nodes which have subscribers on worker, but haven`t connected to it yet
+        self.patterns = PatternIndex() # pattern subscriptions, new fields are matched against them once
+        self._pattern_topics: dict[str, set[tuple[str, str]]] = {} # subscriber -> topics it got only by patterns
+        self._trace: tuple[int, float, float] | None = None # (sequence number, published, received) of handled TRACE message
+
+        # PARTITIONS message, sent to every client which supports it
+        self._partitions = b""
+        if workers:
+            packed = [struct.pack(">BBH", Datatypes.PARTITIONS.value, len(workers), REPLICAS)]
+            for worker_port, worker_path in workers:
+                raw_path = (worker_path or "").encode()
+                packed += [struct.pack(">HB", worker_port or 0, len(raw_path)), raw_path]
+
+            self._partitions = b"".join(packed)
+
+        # opcode -> bound handler
+        self._handlers: list[Callable | None] = [None] * 256
+        self._auth_handlers: list[Callable | None] = [None] * 256
+
+        for datatype, name in self._message_handlers.items():
+            self._handlers[datatype.value] = getattr(self, name)
+
+            if datatype in self._auth_message_handlers:
+                self._auth_handlers[datatype.value] = self._handlers[datatype.value]
         
+        super().__init__(ip, port)
+
+        # stats topic belongs to server
+        self.servers[STATS_NODE] = self._closed_connection(STATS_NODE)
+        self.stats_field = self.get_field(STATS_NODE, STATS_FIELD)
+        self.stats_field.latched = True
+
+
+    async def run(self, listening: Callable[[], None] | None = None) -> None:
+        """
+        :param listening: called once server listens on all its sockets, before it serves them
+        """
+
+        # loop = asyncio.get_running_loop()
+
+        # tp, pr = loop.create_datagram_endpoint(lambda: _DistributedServerUDPModule(self), (self.ip, self.port + 1))
+
+        # self.udp_transport: asyncio.DatagramTransport = tp
+        # self.udp_protocol: _DistributedServerUDPModule = pr
+
+        loop = asyncio.get_running_loop()
+        listeners: list[asyncio.Server] = []
+
+        if self.ip is not None:
+            self.sock = await loop.create_server(lambda: _ServerProtocol(self), self.ip, self.port)
+            listeners.append(self.sock)
+
+        if self.unix_path is not None:
+            # socket file is left after crashed server
+            if os.path.exists(self.unix_path) and stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                os.unlink(self.unix_path)
+
+            self.unix_sock = await loop.create_unix_server(lambda: _ServerProtocol(self), self.unix_path)
+            listeners.append(self.unix_sock)
+
+        if len(listeners) == 0:
+            raise ValueError("server has neither TCP nor unix socket listener")
+
+        if listening is not None:
+            listening()
+
+        # await asyncio.gather(
+            # self.sock.serve_forever(),
+            # self.udp_handler(),
+        # )
+
+        tasks = [listener.serve_forever() for listener in listeners]
+        if self.stats_interval is not None:
+            tasks.append(self._stats_mainloop())
+
         try:
-        # if True:
-            while True:
-                data = await r()
+            await asyncio.gather(*tasks)
+        finally:
+            if self.unix_path is not None and os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
 
-                if len(data) <= 0:
-                    writer.close()
-                    break
+    async def _stats_mainloop(self) -> None:
+        last = time.monotonic()
 
-                data, datatype = data[1:], data[0]
+        while True:
+            await asyncio.sleep(self.stats_interval)
 
-                try:
-                    match Datatypes(datatype):
-                        case Datatypes.SEND_AUTH:
-                            logging.debug("GOT SEND_AUTH")
+            now = time.monotonic()
+            update_rates(self.servers.values(), now - last)
+            last = now
 
-                            CREDENTIALS = data[1:].decode()
+            # stats are encoded only when somebody reads them
+            if len(self.stats_field.subscribers) > 0:
+                self.publish(self.stats_field, encode_stats(self.servers.values()))
 
-                            if CREDENTIALS in self.servers:
-                                await w(bytearray([Datatypes.ERROR.value, Errortypes.INVALID_CREDENTIALS.value]))
-                                continue
 
-                            self.servers[CREDENTIALS] = Connection(
-                                name=CREDENTIALS,
-                                fields={},
-                                socket=writer,
-                                udp_addr=None,
-                            )
+    def _closed_connection(self, name: str) -> Connection:
+        """
+        Node without client, its closed outbox drops everything sent to it
+        """
 
-                        case Datatypes.SEND_UDP_AUTH:
-                            if CREDENTIALS is None: raise ConnectionError("node hasn`t sended valid credentials")
+        conn = Connection(name=name, fields={}, socket=None, outbox=Outbox(None))
+        conn.outbox.close()
 
-                            logging.debug("GOT SEND_UDP_AUTH")
+        return conn
 
-                            ip = data[:-2].decode()
-                            port = struct.unpack(">H", data[-2:])[0]
+    def reply(self, conn: Connection, data) -> None:
+        """
+        Queues control message (reply, error) to connection`s outbox, it is never dropped
+        """
 
-                            self.servers[CREDENTIALS].udp_addr = (ip, port)
+        conn.outbox.put(self.pack(data, conn.compression), droppable=False)
 
-                        case Datatypes.GET_UDP_AUTH:
-                            if CREDENTIALS is None: raise ConnectionError("node hasn`t sended valid credentials")
+    async def tcp_send(self, conn: Connection, data, droppable: bool = True):
+        """
+        Queues message to connection`s outbox
 
-                            logging.debug("GOT GET_UDP_AUTH")
+        :param droppable: message may be dropped by queue policy (topic data and ANON; not replies)
+        """
 
-                            node_name = data.decode()
+        await conn.outbox.send(self.pack(data, conn.compression), droppable)
 
-                            if node_name not in self.servers:
-                                await w(bytearray([
-                                    Datatypes.ERROR.value,
-                                    Errortypes.INVALID_GET_UDP_CREDENTIALS.value,
-                                    *data,
-                                ]))
+    def queue_stats(self) -> dict[str, tuple[int, int]]:
+        """
+        Outbound queue depth and dropped messages count of each connection
+        """
 
-                            else:
-                                ip, port = self.servers[node_name].udp_addr
+        return {name: (conn.outbox.depth, conn.outbox.dropped) for name, conn in self.servers.items()}
 
-                                await w(bytearray([
-                                    Datatypes.SEND_UDP_AUTH.value,
-                                    len(data),
-                                    *data,
-                                    *ip.encode(),
-                                    *struct.pack(">H", port)
-                                ]))
+    def broadcast(
+        self,
+        sockets: Iterable[str],
+        data,
+        compression: Compression | None = None,
+        header: bytes = b"",
+        id_header: bytes | None = None,
+        field: Field | None = None,
+        trace: tuple[int, float, float] | None = None,
+    ) -> list[Outbox]:
+        """
+        Sends one message to several connections without waiting
 
-                        case Datatypes.GET:
-                            if CREDENTIALS is None: raise ConnectionError("node hasn`t sended valid credentials")
+        Message is compressed once per used compression policy and the same frame is queued to every subscriber`s outbox
 
-                            logging.debug("GOT GET")
+        :param compression: topic compression policy, subscriber`s policy is used if None
+        :param header: prepended to data
+        :param id_header: prepended to data instead of header for connections which support topic ids
+        :param field: topic which sent messages are counted to
+        :param trace: (sequence number, published, received) of traced message, subscribers which support traces get it in TRACE header
+        :return: full BLOCK outboxes, sender should wait for their room
+        """
 
-                            name_length = data[0]
-                            field_length = data[1]
+        frames: dict[tuple[bool, Compression | None, bool], bytes] = {}
+        sent = sent_bytes = 0
 
-                            data_start = 2+name_length+field_length
+        trace_header = b"" if trace is None else bytes([Datatypes.TRACE.value]) + TRACE_SEND.pack(*trace, time.time())
 
-                            raw_node_name = data[2:2+name_length]
-                            raw_field_name = data[2+name_length:2+name_length+field_length]
+        blocked = []
+        for name in tuple(sockets):
+            if name not in self.servers:
+                continue
 
-                            node_name = raw_node_name.decode()
-                            field_name = raw_field_name.decode()
+            conn = self.servers[name]
+            if conn.outbox.closed:
+                continue
 
-                            if node_name not in self.servers or field_name not in self.servers[node_name].fields:
-                                await w(bytearray([
-                                    Datatypes.ERROR.value,
-                                    Errortypes.INVALID_CREDENTIALS.value
-                                ]))
-                                continue
+            # old clients can read only zlib frames without flag
+            policy = None if conn.compression is None else (conn.compression if compression is None else compression)
 
-                            send = self.servers[node_name].fields[field_name].data
-                            send = send if send else bytearray([])
-                            await w(bytearray([
-                                Datatypes.SEND_GET.value,
-                                len(raw_node_name),
-                                len(raw_field_name),
-                                *raw_node_name,
-                                *raw_field_name,
-                                *send,
-                            ]))
+            use_ids = id_header is not None and conn.use_ids
+            traced = bool(trace_header) and bool(conn.capabilities & Capabilities.TRACE)
 
-                        case Datatypes.POST:
-                            if CREDENTIALS is None: raise ConnectionError("node hasn`t sended valid credentials")
+            key = (use_ids, policy, traced)
+            if key not in frames:
+                frames[key] = self.pack(b"".join((trace_header if traced else b"", id_header if use_ids else header, data)), policy)
 
-                            logging.debug("GOT POST")
+            frame = frames[key]
+            sent += 1
+            sent_bytes += len(frame)
 
-                            field_length = data[0]
+            if not conn.outbox.put(frame):
+                blocked.append(conn.outbox)
 
-                            data_start = 1+field_length
+        if field is not None:
+            field.sent += sent
+            field.sent_bytes += sent_bytes
 
-                            raw_field_name = data[1:data_start]
-                            field_name = raw_field_name.decode()
+        return blocked
 
-                            if field_name not in self.servers[CREDENTIALS].fields:
-                                self.servers[CREDENTIALS].fields[field_name] = Field(
-                                    data=data[data_start:],
-                                    subscribers=[]
-                                )
-                                
-                            else:
-                                self.servers[CREDENTIALS].fields[field_name].data = data[data_start:]
-                            
-                            await self.tcp_broadcast(self.servers[CREDENTIALS].fields[field_name].subscribers, bytearray([
-                                Datatypes.SEND_GET.value,
-                                len(CREDENTIALS),
-                                len(raw_field_name),
-                                *CREDENTIALS.encode(),
-                                *raw_field_name,
-                                *self.servers[CREDENTIALS].fields[field_name].data,
-                            ]))
-                            
+    async def tcp_broadcast(self, sockets: Iterable[str], data, compression: Compression | None = None, header: bytes = b"", id_header: bytes | None = None):
+        """
+        Sends one message to several connections, waits only for subscribers with full BLOCK queues (see broadcast)
+        """
 
-                            await w(bytearray([
-                                Datatypes.SEND_POST.value,
-                                Status.OK.value
-                            ]))
+        blocked = self.broadcast(sockets, data, compression, header, id_header)
+
+        if len(blocked) > 0:
+            await asyncio.gather(*(outbox.wait_room() for outbox in blocked))
+
+    def _on_send_auth(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT SEND_AUTH")
+
+        name_length = data[0]
+        name = bytes(data[1:1+name_length]).decode()
+
+        # new clients append capabilities and wanted compression policy
+        extension = data[1+name_length:]
+        if len(extension) >= 5:
+            conn.capabilities = Capabilities(struct.unpack(">I", extension[:4])[0] & self.capabilities)
+            conn.use_ids = bool(conn.capabilities & Capabilities.TOPIC_IDS)
+
+            if conn.capabilities & Capabilities.FRAME_FLAGS:
+                conn.compression = Compression(extension[4])
+
+            if len(extension) >= 6 and extension[5] != 0xff:
+                conn.outbox.policy = QueuePolicy(extension[5])
+
+        if name in self.servers and name not in self._placeholders:
+            self.reply(conn, bytearray([Datatypes.ERROR.value, Errortypes.INVALID_CREDENTIALS.value]))
+            return
+
+        # node takes fields which were subscribed to before it connected
+        if name in self._placeholders:
+            self._placeholders.discard(name)
+            conn.fields = self.servers[name].fields
+
+        conn.name = name
+        self.servers[name] = conn
+
+        if conn.capabilities & Capabilities.PARTITIONS:
+            self.reply(conn, self._partitions)
+
+    def _on_send_udp_auth(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT SEND_UDP_AUTH")
+
+        ip = bytes(data[:-2]).decode()
+        port = struct.unpack(">H", data[-2:])[0]
+
+        conn.udp_addr = (ip, port)
+
+    def _on_get_udp_auth(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT GET_UDP_AUTH")
+
+        node_name = bytes(data).decode()
+
+        if node_name not in self.servers:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_GET_UDP_CREDENTIALS.value,
+                *data,
+            ]))
+            return
+
+        ip, port = self.servers[node_name].udp_addr
+
+        self.reply(conn, bytearray([
+            Datatypes.SEND_UDP_AUTH.value,
+            len(data),
+            *data,
+            *ip.encode(),
+            *struct.pack(">H", port)
+        ]))
+
+    def _on_get(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT GET")
+
+        name_length = data[0]
+        field_length = data[1]
+
+        raw_node_name = data[2:2+name_length]
+        raw_field_name = data[2+name_length:2+name_length+field_length]
+
+        node_name = bytes(raw_node_name).decode()
+        field_name = bytes(raw_field_name).decode()
+
+        if node_name not in self.servers or field_name not in self.servers[node_name].fields:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_CREDENTIALS.value
+            ]))
+            return
+
+        send = self.servers[node_name].fields[field_name].data
+        send = send if send else bytearray([])
+        self.reply(conn, bytearray([
+            Datatypes.SEND_GET.value,
+            len(raw_node_name),
+            len(raw_field_name),
+            *raw_node_name,
+            *raw_field_name,
+            *send,
+        ]))
+
+    def _on_get_many(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT GET_MANY")
+
+        values = []
+
+        for node_name, field_name in unpack_topics(data[_TOPIC_ID.size:]):
+            node = self.servers.get(node_name)
+            field = None if node is None else node.fields.get(field_name)
+
+            # unlike GET, unknown topics don`t close connection
+            values.append((Status.OK if field is not None else Status.ERROR, node_name.encode(), field_name.encode(), (field.data if field is not None else None) or b""))
+
+        self.reply(conn, bytes([Datatypes.SEND_GET_MANY.value]) + pack_values(_TOPIC_ID.unpack_from(data)[0], values))
+
+    def _on_post(self, conn: Connection, data: bytes) -> list[Outbox]:
+        logging.debug("GOT POST")
+
+        field_length = data[0]
+        field_name = bytes(data[1:1+field_length]).decode()
+
+        blocked = self.publish(self.get_field(conn.name, field_name), data[1+field_length:])
+
+        self.reply(conn, bytearray([
+            Datatypes.SEND_POST.value,
+            Status.OK.value
+        ]))
+
+        return blocked
+
+    def _on_subscribe(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT SUBSCRIBE")
+
+        name_length = data[0]
+        field_length = data[1]
+
+        node_name = bytes(data[2:2+name_length]).decode()
+        field_name = bytes(data[2+name_length:2+name_length+field_length]).decode()
+
+        # new clients may append QoS
+        extension = data[2+name_length+field_length:]
+        qos = QoS.unpack(extension) if len(extension) >= _QOS.size else None
+
+        field = self.subscribe(conn, node_name, field_name, qos=qos)
+
+        if field is None:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_SUBSCRIBE.value
+            ]))
+
+        # empty value is posted by clients to create topic, it is not sent
+        elif field.latched and field.data:
+            self.send_value(conn, field)
+
+    def _on_unsubscribe(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT UNSUBSCRIBE")
+
+        name_length = data[0]
+        field_length = data[1]
+
+        node_name = bytes(data[2:2+name_length]).decode()
+        field_name = bytes(data[2+name_length:2+name_length+field_length]).decode()
+
+        self.unsubscribe(conn, node_name, field_name)
+
+    def _on_subscribe_pattern(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT SUBSCRIBE_PATTERN")
+
+        name_length = data[0]
+        field_length = data[1]
+
+        pattern = self.patterns.add(
+            bytes(data[2:2+name_length]).decode(),
+            bytes(data[2+name_length:2+name_length+field_length]).decode(),
+            conn.name,
+        )
+
+        # existing topics are matched once here, new ones when they are created (see get_field)
+        for node_name, node in tuple(self.servers.items()):
+            for field_name in tuple(node.fields):
+                if pattern.matches(node_name, field_name) and (node_name, field_name) not in conn.subscriptions:
+                    field = self.subscribe(conn, node_name, field_name, pattern=True)
+
+                    if field.latched and field.data:
+                        self.send_value(conn, field)
+
+    def _on_unsubscribe_pattern(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT UNSUBSCRIBE_PATTERN")
+
+        name_length = data[0]
+        field_length = data[1]
+
+        node_pattern = bytes(data[2:2+name_length]).decode()
+        field_pattern = bytes(data[2+name_length:2+name_length+field_length]).decode()
+
+        self.patterns.remove(node_pattern, field_pattern, conn.name)
+
+        pattern = TopicPattern(node_pattern, field_pattern)
+        remaining = self.patterns.owned(conn.name)
+        attached = self._pattern_topics.get(conn.name, set())
+
+        # explicit subscriptions and topics of other patterns stay
+        for node_name, field_name in tuple(attached):
+            if pattern.matches(node_name, field_name) and not any(other.matches(node_name, field_name) for other in remaining):
+                attached.discard((node_name, field_name))
+                self.unsubscribe(conn, node_name, field_name)
+
+    def _on_subscribe_many(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT SUBSCRIBE_MANY")
+
+        latched = []
+
+        for node_name, field_name in unpack_topics(data):
+            field = self.subscribe(conn, node_name, field_name)
+
+            if field is None:
+                self.reply(conn, bytearray([
+                    Datatypes.ERROR.value,
+                    Errortypes.INVALID_SUBSCRIBE.value
+                ]))
+
+            elif field.latched and field.data:
+                latched.append((node_name, field_name, field))
+
+        if len(latched) == 0:
+            return
+
+        # e.g. reconnected client gets all its latched values at once
+        if conn.capabilities & Capabilities.BULK_GET:
+            conn.outbox.put(self.pack(bytes([Datatypes.SEND_GET_MANY.value]) + pack_values(0, (
+                (Status.OK, node_name.encode(), field_name.encode(), field.data) for node_name, field_name, field in latched
+            )), conn.compression))
+
+        else:
+            for _, _, field in latched:
+                self.send_value(conn, field)
+
+    def _on_unsubscribe_many(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT UNSUBSCRIBE_MANY")
+
+        for node_name, field_name in unpack_topics(data):
+            self.unsubscribe(conn, node_name, field_name)
+
+    def _on_anon(self, conn: Connection, data: bytes) -> list[Outbox]:
+        logging.debug("GOT ANON")
+
+        name_length = data[0]
+        field_length = data[1]
+
+        node_name = bytes(data[2:2+name_length]).decode()
+
+        if node_name not in self.servers:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_ANON_CREDENTIALS.value
+            ]))
+            return
+
+        return self.anon(conn, node_name, data[2+name_length:2+name_length+field_length], data[2+name_length+field_length:])
+
+    def _on_call(self, conn: Connection, data: bytes) -> list[Outbox]:
+        logging.debug("GOT CALL")
+
+        request_id, timeout, name_length, service_length = _CALL.unpack_from(data)
+
+        offset = _CALL.size
+        node = self.servers.get(bytes(data[offset:offset+name_length]).decode())
+
+        # placeholders and stats node have closed outboxes
+        if node is None or node.outbox.closed or not node.capabilities & Capabilities.SERVICES:
+            self.reply(conn, bytes([Datatypes.SEND_REPLY.value]) + _SEND_REPLY.pack(request_id, ServiceStatus.UNREACHABLE.value))
+            return
+
+        raw_name = conn.name.encode()
+        outbox = node.outbox
+
+        # calls aren`t dropped by queue policy, caller waits for room of BLOCK queue like publishers do
+        full = not outbox.put(self.pack(b"".join((
+            bytes([Datatypes.SEND_CALL.value]),
+            _CALL.pack(request_id, timeout, len(raw_name), service_length),
+            raw_name,
+            data[offset+name_length:],
+        )), node.compression), droppable=False)
+
+        return [outbox] if full else []
+
+    def _on_reply(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT REPLY")
+
+        request_id, status, name_length = _REPLY.unpack_from(data)
+        caller = self.servers.get(bytes(data[_REPLY.size:_REPLY.size+name_length]).decode())
+
+        # caller has disconnected
+        if caller is None or caller.outbox.closed:
+            return
+
+        self.reply(caller, b"".join((
+            bytes([Datatypes.SEND_REPLY.value]),
+            _SEND_REPLY.pack(request_id, status),
+            data[_REPLY.size+name_length:],
+        )))
+
+    def _on_declare_id(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT DECLARE_ID")
+
+        kind, topic_id, name_length, field_length = struct.unpack(">BIBB", data[:7])
+
+        node_name = bytes(data[7:7+name_length]).decode()
+        raw_field_name = bytes(data[7+name_length:7+name_length+field_length])
+
+        if kind == Datatypes.POST.value:
+            conn.post_ids[topic_id] = self.get_field(conn.name, raw_field_name.decode())
+        else:
+            conn.anon_ids[topic_id] = (node_name, raw_field_name)
+
+    def _on_post_id(self, conn: Connection, data: bytes) -> list[Outbox]:
+        field = conn.post_ids.get(_TOPIC_ID.unpack_from(data)[0])
+
+        if field is None:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_TOPIC_ID.value
+            ]))
+            return
+
+        # unlike POST, not acknowledged with SEND_POST
+        return self.publish(field, data[4:])
+
+    def _on_anon_id(self, conn: Connection, data: bytes) -> list[Outbox]:
+        topic_id = _TOPIC_ID.unpack_from(data)[0]
+
+        if topic_id not in conn.anon_ids:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_TOPIC_ID.value
+            ]))
+            return
+
+        node_name, raw_field_name = conn.anon_ids[topic_id]
+
+        if node_name not in self.servers:
+            self.reply(conn, bytearray([
+                Datatypes.ERROR.value,
+                Errortypes.INVALID_ANON_CREDENTIALS.value
+            ]))
+            return
+
+        return self.anon(conn, node_name, raw_field_name, data[4:])
+
+    def _on_topic(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT TOPIC")
+
+        field_length = data[0]
+        field_name = bytes(data[1:1+field_length]).decode()
+
+        options = data[1+field_length:]
+        compression = None if len(options) < 1 or options[0] == 0xff else Compression(options[0])
+        flags = TopicFlags(options[1]) if len(options) >= 2 else TopicFlags.NONE
+
+        field = self.get_field(conn.name, field_name)
+        field.compression = compression
+        field.latched = bool(flags & TopicFlags.LATCHED)
+
+        self.update_brokered(conn, field_name, field)
+
+    def _on_direct_addr(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT DIRECT_ADDR")
+
+        conn.direct_addr = bytes(data).decode()
+
+        # worker may have subscribers which subscribed before node connected to it
+        for field_name, field in conn.fields.items():
+            for subscriber in field.subscribers:
+                if subscriber in self.servers:
+                    self.send_direct_addr(self.servers[subscriber], conn, field)
+
+    def _on_direct(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT DIRECT")
+
+        enabled, field_length, name_length = data[0], data[1], data[2]
+
+        field_name = bytes(data[3:3+field_length]).decode()
+        subscriber = bytes(data[3+field_length:3+field_length+name_length]).decode()
+
+        field = self.get_field(conn.name, field_name)
+
+        # subscriber may have unsubscribed while publisher was handling its direct link
+        if enabled and subscriber in field.subscribers:
+            field.direct.add(subscriber)
+        else:
+            field.direct.discard(subscriber)
+
+        self.update_brokered(conn, field_name, field)
+
+    def _on_rosstat(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT ROSSTAT")
+
+        self.reply(conn, bytes([Datatypes.ROSSTAT.value]) + encode_stats(self.servers.values()))
+
+    def _on_trace(self, conn: Connection, data: bytes) -> list[Outbox]:
+        seq, published = TRACE_POST.unpack_from(data)
+        opcode = data[TRACE_POST.size]
+
+        if opcode != Datatypes.POST.value and opcode != Datatypes.POST_ID.value:
+            raise ConnectionError(f"TRACE can`t wrap message {opcode}")
+
+        # publish stamps forward time when it sends wrapped message to subscribers
+        self._trace = (seq, published, time.time())
+
+        try:
+            return self._handlers[opcode](conn, data[TRACE_POST.size+1:])
+        finally:
+            self._trace = None
+
+    def _on_error(self, conn: Connection, data: bytes) -> None:
+        logging.debug("GOT ERROR")
+
+        try:
+            logging.warning(Errortypes(data[0]))
+        except:
+            pass
+
+    def subscribe(self, conn: Connection, node_name: str, field_name: str, pattern: bool = False, qos: QoS | None = None) -> Field | None:
+        """
+        Subscribes connection to node`s field, creates field if needed
+
+        :param pattern: subscription comes from pattern (see PatternIndex), it is removed with the pattern
+        :param qos: replaces QoS of existing subscription, removes it if None
+        :return: subscribed field, None if node doesn`t exist
+        """
+
+        if pattern:
+            self._pattern_topics.setdefault(conn.name, set()).add((node_name, field_name))
+        elif conn.name in self._pattern_topics:
+            self._pattern_topics[conn.name].discard((node_name, field_name))
+
+        if node_name not in self.servers:
+            # client connects to workers after server, so its subscribers may come first
+            if self.worker_index is None:
+                return None
+
+            self.servers[node_name] = self._closed_connection(node_name)
+            self._placeholders.add(node_name)
+
+        field = self.get_field(node_name, field_name)
+
+        field.subscribers.add(conn.name)
+        conn.subscriptions.add((node_name, field_name))
+
+        self._drop_throttle(field, conn.name)
+        if qos:
+            field.qos[conn.name] = _Throttle(qos)
+
+        # data of this topic will be sent with id, so client has to know it first
+        if conn.capabilities & Capabilities.TOPIC_IDS:
+            conn.outbox.put(self.pack(b"".join((
+                struct.pack(">BI", Datatypes.SEND_TOPIC_ID.value, field.id),
+                field.header[1:],
+            )), conn.compression), droppable=False)
+
+        owner = self.servers[node_name]
+
+        self.send_direct_addr(conn, owner, field)
+        self.update_brokered(owner, field_name, field)
+
+        return field
+
+    def send_direct_addr(self, conn: Connection, owner: Connection, field: Field) -> None:
+        """
+        Tells direct subscriber where to get owner`s field data from.
+        Subscriber gets data through server until publisher reports its direct link (see _on_direct)
+        """
+
+        # publisher doesn`t apply QoS
+        if owner.direct_addr is not None and conn.capabilities & Capabilities.DIRECT_TOPICS and owner is not conn and conn.name not in field.qos:
+            conn.outbox.put(self.pack(b"".join((
+                bytes([Datatypes.DIRECT_ADDR.value]),
+                field.header[1:],
+                owner.direct_addr.encode(),
+            )), conn.compression), droppable=False)
+
+    def send_value(self, conn: Connection, field: Field, data: bytes | None = None) -> None:
+        """
+        Sends field`s current value to connection as if it was just published
+
+        :param data: sent instead of current value
+        """
+
+        policy = None if conn.compression is None else (conn.compression if field.compression is None else field.compression)
+
+        frame = self.pack(b"".join((field.id_header if conn.use_ids else field.header, field.data if data is None else data)), policy)
+
+        field.sent += 1
+        field.sent_bytes += len(frame)
+
+        conn.outbox.put(frame)
+
+    def update_brokered(self, owner: Connection, field_name: str, field: Field) -> None:
+        """
+        Tells direct publisher whether server still needs data of its field (see Datatypes.BROKERED)
+        """
+
+        if owner.direct_addr is None:
+            return
+
+        brokered = field.latched or len(field.subscribers) > len(field.direct)
+
+        if brokered != field.brokered:
+            field.brokered = brokered
+
+            raw_field_name = field_name.encode()
+            self.reply(owner, bytes([Datatypes.BROKERED.value, brokered, len(raw_field_name)]) + raw_field_name)
+
+    def get_field(self, node_name: str, field_name: str) -> Field:
+        """
+        Returns node`s field, creates it if needed
+        """
+
+        fields = self.servers[node_name].fields
+
+        if field_name not in fields:
+            raw_node_name, raw_field_name = node_name.encode(), field_name.encode()
+            self._last_topic_id += 1
+
+            fields[field_name] = Field(
+                data=None,
+                subscribers=set(),
+                id=self._last_topic_id,
+                header=b"".join((
+                    bytes([Datatypes.SEND_GET.value, len(raw_node_name), len(raw_field_name)]),
+                    raw_node_name,
+                    raw_field_name,
+                )),
+            )
+
+            if len(self.patterns) > 0:
+                self._attach_patterns(node_name, field_name)
+
+        return fields[field_name]
+
+    def _attach_patterns(self, node_name: str, field_name: str) -> None:
+        """
+        Subscribes pattern subscribers to new field
+        """
+
+        for subscriber in self.patterns.match(node_name, field_name):
+            conn = self.servers.get(subscriber)
+
+            if conn is not None and not conn.outbox.closed:
+                self.subscribe(conn, node_name, field_name, pattern=True)
+
+    def publish(self, field: Field, data: bytes) -> list[Outbox]:
+        """
+        Updates field and sends new value to its subscribers
+
+        :return: full BLOCK outboxes of subscribers (see broadcast)
+        """
+
+        # kept until the next publish, received data is view over connection`s buffer
+        field.data = data = bytes(data)
+        field.published += 1
+        field.published_bytes += len(data)
+        field.last_publish = time.time()
+
+        if len(field.subscribers) == 0:
+            return []
+
+        # direct subscribers get data from publisher
+        subscribers = field.subscribers - field.direct if field.direct else field.subscribers
+
+        if field.qos:
+            subscribers = self._throttle(field, subscribers, data)
+
+        return self.broadcast(subscribers, data, field.compression, field.header, field.id_header, field, self._trace)
+
+    def _throttle(self, field: Field, subscribers: set[str], data: bytes) -> set[str]:
+        """
+        Applies QoS of field`s subscribers to published message
+
+        :return: subscribers which get message now
+        """
+
+        subscribers = set(subscribers)
+        now = time.monotonic()
+
+        for name, throttle in field.qos.items():
+            if name not in subscribers or throttle.admit(data, now):
+                continue
+
+            subscribers.discard(name)
+
+            if throttle.pending is not None and throttle.timer is None:
+                throttle.timer = asyncio.get_running_loop().call_later(
+                    throttle.last_sent + throttle.interval - now, self._send_pending, name, field, throttle,
+                )
+
+        return subscribers
+
+    def _send_pending(self, name: str, field: Field, throttle: _Throttle) -> None:
+        """
+        Sends latest message of subscriber with latest-only QoS when its period ends
+        """
+
+        throttle.timer = None
+
+        conn = self.servers.get(name)
+        if throttle.pending is None or conn is None or conn.outbox.closed:
+            return
+
+        self.send_value(conn, field, throttle.pending)
+
+        throttle.pending = None
+        throttle.last_sent = time.monotonic()
+
+    def _drop_throttle(self, field: Field, name: str) -> None:
+        throttle = field.qos.pop(name, None)
+
+        if throttle is not None:
+            throttle.cancel()
+
+    def anon(self, conn: Connection, node_name: str, raw_field_name: bytes, data: bytes) -> list[Outbox]:
+        """
+        Sends ANON message from connection to existing node
+
+        :return: node`s outbox if it is full and has BLOCK policy
+        """
+
+        raw_name = conn.name.encode()
+        outbox = self.servers[node_name].outbox
+
+        full = not outbox.put(self.pack(b"".join((
+            bytes([
+                Datatypes.SEND_ANON.value,
+                len(raw_name),
+                len(raw_field_name),
+            ]),
+            raw_name,
+            raw_field_name,
+            data, # additional info
+        )), self.servers[node_name].compression))
+
+        return [outbox] if full else []
+
+    def unsubscribe(self, conn: Connection, node_name: str, field_name: str) -> None:
+        conn.subscriptions.discard((node_name, field_name))
+
+        if node_name in self.servers and field_name in self.servers[node_name].fields:
+            field = self.servers[node_name].fields[field_name]
+            field.subscribers.discard(conn.name)
+            field.direct.discard(conn.name)
+            self._drop_throttle(field, conn.name)
+
+            self.update_brokered(self.servers[node_name], field_name, field)
+
+    def disconnect(self, conn: Connection) -> None:
+        """
+        Removes connection with its fields and subscriptions.
+        Touches only connection`s own subscriptions and subscribers of its fields
+        """
+
+        del self.servers[conn.name]
+
+        self.patterns.remove_subscriber(conn.name)
+        self._pattern_topics.pop(conn.name, None)
+
+        for node_name, field_name in conn.subscriptions:
+            if node_name in self.servers and field_name in self.servers[node_name].fields:
+                field = self.servers[node_name].fields[field_name]
+                field.subscribers.discard(conn.name)
+                field.direct.discard(conn.name)
+                self._drop_throttle(field, conn.name)
+
+                self.update_brokered(self.servers[node_name], field_name, field)
+
+        # fields are removed with the node, so its subscribers lose these subscriptions
+        for field_name, field in conn.fields.items():
+            for throttle in field.qos.values():
+                throttle.cancel()
+
+            for subscriber in field.subscribers:
+                if subscriber in self.servers:
+                    self.servers[subscriber].subscriptions.discard((conn.name, field_name))
+
+class _ClientRecvProtocol(asyncio.DatagramProtocol):
+    def __init__(self, root):
+        super().__init__()
+        self.root: "AsyncDistrubutedClient" = root
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: AddrLike):
+        self.root._datagram_received(data, addr)
+
+DISPATCH_QUEUE_SIZE = 256 # client stops reading when this many messages wait for handlers
+UDP_QUEUE_SIZE = 256      # ANON datagrams waiting for handlers per peer, the oldest are dropped when full
+UNBROKERED_REFRESH = 1.0  # seconds, server gets the latest value of fields which only direct subscribers need this often
+
+UDP_MAX_PAYLOAD = 60000                   # larger messages are split into fragments of this size
+UDP_MAX_FRAGMENTS = 1024                  # fragments per message, about 60 MB
+UDP_REASSEMBLY_TIMEOUT = 2.0              # incomplete messages are dropped after this many seconds
+UDP_REASSEMBLY_MAX_BYTES = 64 * 1024 ** 2 # fragments of incomplete messages kept in memory, the oldest messages are dropped above it
+
+_UDP_PONG = struct.pack(">IB", 1, DistributedDatatypes.PONG.value)
+_UDP_FRAGMENT = struct.Struct(">BIHH") # FRAGMENT, message id, fragment index, fragments count
+
+class _Reassembly:
+    """
+    Received fragments of one UDP message
+    """
+
+    __slots__ = ("chunks", "received", "size", "started")
+
+    def __init__(self, count: int, started: float):
+        self.chunks: list[bytes | None] = [None] * count
+        self.received = 0
+        self.size = 0
+        self.started = started
+
+class _UDPQueue:
+    """
+    Handler calls of one UDP peer, awaited in order of datagrams by its own task
+    """
+
+    __slots__ = ("calls", "wakeup", "task", "dropped")
+
+    def __init__(self):
+        self.calls: deque[tuple[Callable, tuple]] = deque(maxlen=UDP_QUEUE_SIZE)
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.dropped = 0
+
+CALL_TIMEOUT = 10.0      # seconds, default timeout of service calls
+GET_TIMEOUT = 10.0       # seconds, default timeout of get and get_many
+GET_MANY_BATCH = 0xffff  # topics per GET_MANY message
+SERVICE_CONCURRENCY = 8  # calls of one service handled at once by default, others wait
+
+def _bind_topic(handler: Callable, node_name: str, field_name: str) -> Callable:
+    """
+    :return: handler of one topic, which passes topic`s node and field to pattern handler positionally
+    """
+
+    try:
+        accepts_trace = "trace" in inspect.signature(handler).parameters
+    except (TypeError, ValueError):
+        accepts_trace = False
+
+    # dispatcher checks bound handler`s signature for trace parameter (see _call_traced)
+    if accepts_trace:
+        return lambda data, trace: handler(data, node_name, field_name, trace=trace)
+
+    return lambda data: handler(data, node_name, field_name)
+
+class _Service:
+    """
+    Service handler of client, calls above concurrency limit wait for running ones
+    """
+
+    __slots__ = ("handler", "limit")
+
+    def __init__(self, handler: Callable, concurrency: int):
+        self.handler = handler
+        self.limit = asyncio.Semaphore(concurrency)
+
+    async def call(self, data: bytes, node: str) -> bytes:
+        async with self.limit:
+            return await self.handler(data, node)
+
+class _ClientProtocol(_FrameProtocol):
+    def __init__(self, root: "AsyncDistrubutedClient"):
+        super().__init__()
+
+        self.root = root
+
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    @property
+    def flagged(self) -> bool:
+        return self.root._flagged
+
+    def pause_writing(self) -> None:
+        self.writable.clear()
+
+    def resume_writing(self) -> None:
+        self.writable.set()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.writable.set()
+        self.root._connection_lost()
+
+    def write(self, data, compression: Compression | None = None) -> None:
+        self.root._write(data, compression)
+
+    def message_received(self, opcode: int, data: bytes) -> None:
+        handler = self.root._handlers[opcode]
+
+        try:
+            if handler is None:
+                raise ConnectionError(f"unknown message {opcode}")
+
+            handler(data)
+
+        except Exception as e:
+            logging.debug(e)
+            self.write(bytearray([Datatypes.ERROR.value, Errortypes.METHOD_NOT_FOUND.value]))
+
+class _WorkerProtocol(_ClientProtocol):
+    """
+    Connection to broker worker, which serves part of topics (see Datatypes.PARTITIONS).
+    Messages from worker are handled by client as server`s ones, messages written before worker authorizes client wait in pending
+    """
+
+    def __init__(self, root: "AsyncDistrubutedClient", index: int):
+        super().__init__(root)
+
+        self.index = index
+        self.authorized = False
+        self.pending: list[tuple[bytes, Compression | None]] = []
+        self._flagged = False
+
+    @property
+    def flagged(self) -> bool:
+        return self._flagged
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.writable.set()
+        self.root._worker_lost(self)
+
+    def write(self, data, compression: Compression | None = None) -> None:
+        if not self.authorized:
+            self.pending.append((data, compression))
+            return
+
+        if not self._flagged:
+            compression = None
+        elif compression is None:
+            compression = self.root.compression
+
+        self.transport.write(pack_frame(data, compression))
+
+    def authorize(self, data: bytes) -> None:
+        root = self.root
+
+        # worker supports the same protocol as server, partitions aren`t nested
+        capabilities = Capabilities(struct.unpack(">I", data[:4])[0]) & root.capabilities & ~Capabilities.PARTITIONS
+
+        self.transport.write(pack_frame(root._auth_message(capabilities)))
+        self._flagged = bool(capabilities & Capabilities.FRAME_FLAGS)
+        self.authorized = True
+
+        if root.direct_addr is not None and capabilities & Capabilities.DIRECT_TOPICS:
+            self.write(bytes([Datatypes.DIRECT_ADDR.value]) + root.direct_addr.encode())
+
+        for data, compression in self.pending:
+            self.write(data, compression)
+
+        self.pending.clear()
+
+    def message_received(self, opcode: int, data: bytes) -> None:
+        if opcode == Datatypes.REQUEST_AUTH.value:
+            logging.debug("GOT REQUEST_AUTH")
+            self.authorize(data)
+            return
+
+        super().message_received(opcode, data)
+
+        # same limit as for server connection (see AsyncDistrubutedClient._dispatch)
+        if len(self.root._dispatch_queue) >= DISPATCH_QUEUE_SIZE and not self.paused:
+            self.pause()
+            self.root._paused_links.append(self)
+
+class _PeerServerProtocol(_FrameProtocol):
+    """
+    Publisher side of direct link (see AsyncDistrubutedClient direct mode).
+    Subscriber sends SEND_AUTH and SUBSCRIBE/UNSUBSCRIBE for publisher`s fields, field data is sent to it as SEND_GET
+    """
+
+    def __init__(self, root: "AsyncDistrubutedClient"):
+        super().__init__()
+
+        self.root = root
+        self.name: str = None
+        self.outbox: Outbox = None
+        self.fields: set[str] = set()
+
+    @property
+    def flagged(self) -> bool:
+        return True
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        super().connection_made(transport)
+
+        self.outbox = Outbox(transport)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.outbox.close()
+
+        for field in tuple(self.fields):
+            self.root._peer_unsubscribed(self, field)
+
+    def pause_writing(self) -> None:
+        self.outbox.pause()
+
+    def resume_writing(self) -> None:
+        self.outbox.resume()
+
+    def message_received(self, opcode: int, data: bytes) -> None:
+        try:
+            match opcode:
+                case Datatypes.SEND_AUTH.value:
+                    name_length = data[0]
+                    self.name = bytes(data[1:1+name_length]).decode()
+
+                    # same extension as SEND_AUTH to server, only queue policy is used
+                    extension = data[1+name_length:]
+                    if len(extension) >= 6 and extension[5] != 0xff:
+                        self.outbox.policy = QueuePolicy(extension[5])
+
+                case Datatypes.SUBSCRIBE.value | Datatypes.UNSUBSCRIBE.value:
+                    if self.name is None:
+                        raise ConnectionError("direct link is not authorized")
+
+                    name_length = data[0]
+                    field_length = data[1]
+                    field = bytes(data[2+name_length:2+name_length+field_length]).decode()
+
+                    if opcode == Datatypes.SUBSCRIBE.value and field not in self.fields:
+                        self.fields.add(field)
+                        self.root._peer_subscribed(self, field)
+
+                    elif opcode == Datatypes.UNSUBSCRIBE.value and field in self.fields:
+                        self.root._peer_unsubscribed(self, field)
+
+                case _:
+                    raise ConnectionError(f"unknown direct link message {opcode}")
+
+        except Exception as e:
+            logging.error(e)
+            self.transport.close()
+
+class _PeerClientProtocol(_FrameProtocol):
+    """
+    Subscriber side of direct link, receives publisher`s field data as SEND_GET
+    """
+
+    def __init__(self, root: "AsyncDistrubutedClient", node: str, address: str):
+        super().__init__()
+
+        self.root = root
+        self.node = node
+        self.address = address
+        self.fields: set[str] = set() # subscribed fields of node
+
+    @property
+    def flagged(self) -> bool:
+        return True
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        super().connection_made(transport)
+
+        root = self.root
+        raw_name = root.name.encode()
+
+        self.send(b"".join((
+            bytes([Datatypes.SEND_AUTH.value, len(raw_name)]),
+            raw_name,
+            struct.pack(">I", Capabilities.FRAME_FLAGS),
+            bytes([root.compression.value, 0xff if root.queue_policy is None else root.queue_policy.value]),
+        )))
+
+        for field in self.fields:
+            self.subscribe(field)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # publisher tells server to send data of this link`s fields again
+        if self.root.links.get(self.node) is self:
+            del self.root.links[self.node]
+
+    def send(self, data: bytes) -> None:
+        self.transport.write(pack_frame(data, Compression.RAW))
+
+    def subscribe(self, field: str, datatype: Datatypes = Datatypes.SUBSCRIBE) -> None:
+        raw_node, raw_field = self.node.encode(), field.encode()
+        self.send(b"".join((bytes([datatype.value, len(raw_node), len(raw_field)]), raw_node, raw_field)))
+
+    def unsubscribe(self, field: str) -> None:
+        self.subscribe(field, Datatypes.UNSUBSCRIBE)
+
+    def message_received(self, opcode: int, data: bytes) -> None:
+        if opcode == Datatypes.SEND_GET.value:
+            self.root._on_send_get(data)
+        elif opcode == Datatypes.TRACE.value:
+            self.root._on_trace(data)
+        else:
+            logging.debug(f"unknown direct link message {opcode}")
+            return
+
+        # same limit as for server connection (see AsyncDistrubutedClient._dispatch)
+        if len(self.root._dispatch_queue) >= DISPATCH_QUEUE_SIZE and not self.paused:
+            self.pause()
+            self.root._paused_links.append(self)
+
+class UDPConnection:
+    def __init__(self, ip: str, port: int, name: str):
+        self.ip = ip
+        self.port = port
+        self.name = name
+
+        self.has_connection = False
+        self.has_tried_to_connect = False
+
+class AsyncDistrubutedClient(SockClient):
+    # handlers get message without opcode, user handlers are called from dispatcher task (see _dispatch)
+    _message_handlers = {
+        Datatypes.REQUEST_AUTH: "_on_request_auth",
+        Datatypes.SEND_UDP_AUTH: "_on_send_udp_auth",
+        Datatypes.SEND_GET: "_on_send_get",
+        Datatypes.SEND_GET_ID: "_on_send_get_id",
+        Datatypes.SEND_TOPIC_ID: "_on_send_topic_id",
+        Datatypes.SEND_GET_MANY: "_on_send_get_many",
+        Datatypes.SEND_POST: "_on_send_post",
+        Datatypes.ERROR: "_on_error",
+        Datatypes.SEND_ANON: "_on_send_anon",
+        Datatypes.DIRECT_ADDR: "_on_direct_addr",
+        Datatypes.BROKERED: "_on_brokered",
+        Datatypes.ROSSTAT: "_on_rosstat",
+        Datatypes.PARTITIONS: "_on_partitions",
+        Datatypes.TRACE: "_on_trace",
+        Datatypes.SEND_CALL: "_on_send_call",
+        Datatypes.SEND_REPLY: "_on_send_reply",
+    }
+
+    def __init__(self, ip, port, name, compression: Compression = Compression.ADAPTIVE, queue_policy: QueuePolicy | None = None, direct: bool = False, direct_address: str | None = None):
+        """
+        :param ip: server host or address string, e.g. "unix:/tmp/miniros.sock" (see parse_address)
+        :param direct: topic data goes directly between publishers and subscribers which both use direct mode,
+            server only tracks nodes and subscriptions. Data goes through server if direct link can`t be set up
+        :param direct_address: address of direct listener, e.g. "0.0.0.0:4000" or "unix:/tmp/node.sock".
+            If None, unix socket is used for unix socket server and TCP on the interface which reaches server otherwise
+        """
+
+        family, ip, port = parse_address(ip, port)
+
+        super().__init__(ip, port, name)
+
+        self.family = family # for unix sockets ip is socket path
+
+        self.compression = compression # used for sent frames and requested for received ones
+        self.queue_policy = queue_policy # requested policy of server`s outbound queue to this client, None for server default
+        self.capabilities = Capabilities.NONE # negotiated with server
+
+        # capabilities checked for every message, flag operations are slow
+        self._flagged = False
+        self._use_ids = False
+
+        self.udp_servers: dict[str, UDPConnection] = {}
+        self.udp_queues: dict[AddrLike, _UDPQueue] = {} # peer address -> its handler calls
+
+        self.udp_fragments: dict[tuple[AddrLike, int], _Reassembly] = {} # (peer address, message id) -> incomplete message, oldest first
+        self.udp_fragments_bytes = 0
+        self.udp_fragments_dropped = 0 # incomplete messages dropped by timeout or memory limit
+        self._udp_message_id = 0
+
+        self.direct = direct
+        self.direct_address = direct_address
+        self.direct_addr: str | None = None # announced address of direct listener
+        self.direct_server: asyncio.Server = None
+        self._direct_dir: str | None = None # temporary directory of automatically placed direct unix socket
+        self.peer_subscribers: dict[str, set[_PeerServerProtocol]] = {} # own field -> direct subscribers
+        self.links: dict[str, _PeerClientProtocol] = {}                # publisher node -> direct link to it
+        self._failed_links: set[tuple[str, str]] = set()               # (node, address) which couldn`t be connected
+        self._paused_links: list[_FrameProtocol] = []                 # direct links and workers paused by dispatch queue limit
+        self._peer_headers: dict[str, bytes] = {}                      # field -> SEND_GET header
+        self._unbrokered: set[str] = set()                             # fields server doesn`t need data of
+        self._refresh: dict[str, tuple[bytearray, Compression | None]] = {} # unbrokered field -> latest value for server (see UNBROKERED_REFRESH)
+
+        self.traced: dict[str, int] = {} # own traced field -> last sequence number (see trace)
+        self.tracer: TraceAggregator | None = None # gets traces of all received traced messages
+        self._trace: Trace | None = None # trace of handled TRACE message
+        self._trace_kwarg: dict[Callable, bool] = {} # handler -> it has trace parameter
+
+        self.topic_ids: dict[tuple[Datatypes, str, str], int] = {} # declared by this client
+        self.received_ids: dict[int, tuple[str, str]] = {} # declared by server
+        self._last_topic_id = 0
+        self._post_headers: dict[str, bytes] = {} # field -> POST_ID header
+        self._anon_headers: dict[tuple[str, str], bytes] = {} # (node, field) -> ANON_ID header
+
+        self.ring: HashRing | None = None # topic owners, when server has workers (see Datatypes.PARTITIONS)
+        self.workers: list[_WorkerProtocol] = []
+
+        self.w: asyncio.Transport = None
+        self.protocol: _ClientProtocol = None
+
+        self.transport: _ClientRecvProtocol = None
+
+        # opcode -> bound handler
+        self._handlers: list[Callable | None] = [None] * 256
+        for datatype, name in self._message_handlers.items():
+            self._handlers[datatype.value] = getattr(self, name)
+
+        self._dispatch_queue: deque[tuple[Callable, tuple] | None] = deque()
+        self._dispatch_wakeup: asyncio.Event = None
+
+        self._rosstat_waiters: deque[asyncio.Future] = deque() # replies come in order of requests
+
+        self.services: dict[str, _Service] = {}
+        self._calls: dict[int, asyncio.Future] = {} # request id -> reply of own call in flight
+        self._gets: dict[int, asyncio.Future] = {}  # request id -> values of get_many in flight
+
+        self.pattern_handlers: dict[tuple[str, str], tuple[TopicPattern, Callable]] = {} # (node, field) patterns -> handler
+        self._pattern_cache: dict[tuple[str, str], Callable | None] = {} # topic -> its pattern handler, None if no pattern matches
+        self._last_request_id = 0
+        self._serving: set[asyncio.Task] = set() # handled calls of other nodes and refresh posts (see _send_refresh)
+
+        self._is_running = False
+        self._is_authorized = False
+
+
+    async def subscribe(self, node: str, field: str, handler: Callable | None, qos: QoS | None = None) -> None:
+        """
+        :param qos: server sends only part of messages (see QoS), e.g. when handler needs 10 Hz of kHz topic
+        """
+
+        message = bytearray([
+            Datatypes.SUBSCRIBE.value,
+            len(node),
+            len(field),
+            *node.encode(),
+            *field.encode(),
+        ])
+
+        if qos:
+            if not self.capabilities & Capabilities.QOS:
+                raise ConnectionError("server doesn`t support subscription QoS")
+
+            message += qos.pack()
+
+            # direct link would bypass QoS, data comes through server instead
+            self._unlink(node, field)
+
+        await self.send_to(self._owner(node, field), message)
+
+        if handler is not None:
+            if node not in self.handlers:
+                self.handlers[node] = {}
+
+            self.handlers[node][field] = handler
+
+            logging.debug(f"ADDED HANDLER {node}:{field}")
+
+    async def unsubscribe(self, node: str, field: str) -> None:
+        await self.send_to(self._owner(node, field), bytearray([
+            Datatypes.UNSUBSCRIBE.value,
+            len(node),
+            len(field),
+            *node.encode(),
+            *field.encode(),
+        ]))
+
+        if node in self.handlers:
+            self.handlers[node].pop(field, None)
+
+        self._unlink(node, field)
+
+    async def subscribe_pattern(self, node: str, field: str, handler: Callable) -> None:
+        """
+        Subscribes to existing and future topics which match node and field patterns with shell-style wildcards,
+        e.g. ("*", "pos") or ("camera*", "image"). Server matches every topic once, when it is created
+
+        :param handler: async (data, node, field), exact subscriptions of the same topic take precedence
+        """
+
+        if not self.capabilities & Capabilities.PATTERNS:
+            raise ConnectionError("server doesn`t support pattern subscriptions")
+
+        # registered first, values of latched topics come right after subscribing
+        self.pattern_handlers[(node, field)] = (TopicPattern(node, field), handler)
+        self._pattern_cache.clear()
+
+        raw_node, raw_field = node.encode(), field.encode()
+        message = bytes([Datatypes.SUBSCRIBE_PATTERN.value, len(raw_node), len(raw_field)]) + raw_node + raw_field
+
+        # every worker has part of topics
+        for connection in (self.protocol, *self.workers):
+            await self.send_to(connection, message)
+
+    async def unsubscribe_pattern(self, node: str, field: str) -> None:
+        """
+        Removes pattern subscription and unsubscribes from topics which match it
+        """
+
+        raw_node, raw_field = node.encode(), field.encode()
+        message = bytes([Datatypes.UNSUBSCRIBE_PATTERN.value, len(raw_node), len(raw_field)]) + raw_node + raw_field
+
+        for connection in (self.protocol, *self.workers):
+            await self.send_to(connection, message)
+
+        self.pattern_handlers.pop((node, field), None)
+
+        cached = self._pattern_cache
+        self._pattern_cache = {}
+
+        # direct links of topics which no other pattern or exact subscription needs
+        for (node_name, field_name), handler in cached.items():
+            if handler is not None and self._pattern_handler(node_name, field_name) is None and field_name not in self.handlers.get(node_name, {}):
+                self._unlink(node_name, field_name)
+
+    def _pattern_handler(self, node_name: str, field_name: str) -> Callable | None:
+        topic = (node_name, field_name)
+        handler = self._pattern_cache.get(topic, False)
+
+        # patterns are checked once per topic
+        if handler is False:
+            handler = None
+
+            for pattern, pattern_handler in self.pattern_handlers.values():
+                if pattern.matches(node_name, field_name):
+                    handler = _bind_topic(pattern_handler, node_name, field_name)
+                    break
+
+            self._pattern_cache[topic] = handler
+
+        return handler
+
+    async def subscribe_many(self, topics: Iterable[tuple[str, str, Callable | None]]) -> None:
+        """
+        Subscribes to several topics with one message
+
+        :param topics: (node, field, handler) list
+        """
+
+        topics = list(topics)
+
+        if not self.capabilities & Capabilities.BATCH_SUBSCRIBE:
+            for node, field, handler in topics:
+                await self.subscribe(node, field, handler)
+            return
+
+        for owner, group in self._group_topics((node, field) for node, field, _ in topics).items():
+            await self.send_to(owner, bytes([Datatypes.SUBSCRIBE_MANY.value]) + pack_topics(group))
+
+        for node, field, handler in topics:
+            if handler is not None:
+                if node not in self.handlers:
+                    self.handlers[node] = {}
+
+                self.handlers[node][field] = handler
+
+    async def unsubscribe_many(self, topics: Iterable[tuple[str, str]]) -> None:
+        """
+        Unsubscribes from several topics with one message
+
+        :param topics: (node, field) list
+        """
+
+        topics = list(topics)
+
+        if not self.capabilities & Capabilities.BATCH_SUBSCRIBE:
+            for node, field in topics:
+                await self.unsubscribe(node, field)
+            return
+
+        for owner, group in self._group_topics(topics).items():
+            await self.send_to(owner, bytes([Datatypes.UNSUBSCRIBE_MANY.value]) + pack_topics(group))
+
+        for node, field in topics:
+            if node in self.handlers:
+                self.handlers[node].pop(field, None)
+
+            self._unlink(node, field)
+
+    async def topic_id(self, kind: Datatypes, node: str, field: str) -> int:
+        """
+        Returns numeric id of topic, declares it on server if needed
+
+        :param kind: Datatypes.POST for own topics, Datatypes.ANON for ANON targets
+        """
+
+        key = (kind, node, field)
+
+        if key not in self.topic_ids:
+            self._last_topic_id += 1
+            self.topic_ids[key] = self._last_topic_id
+
+            raw_node, raw_field = node.encode(), field.encode()
+
+            # own topics are posted to their owner, ANON always goes through server
+            await self.send_to(self._owner(node, field) if kind is Datatypes.POST else self.protocol, b"".join((
+                struct.pack(">BBIBB", Datatypes.DECLARE_ID.value, kind.value, self._last_topic_id, len(raw_node), len(raw_field)),
+                raw_node,
+                raw_field,
+            )))
+
+        return self.topic_ids[key]
+
+    async def post(self, field: str, data: bytearray, compression: Compression | None = None) -> None:
+        trace = None
+
+        if field in self.traced:
+            seq = self.traced[field] = (self.traced[field] + 1) & 0xffffffff
+            trace = (seq, time.time())
+
+        peers = self.peer_subscribers.get(field)
+
+        if peers:
+            header = self._peer_headers.get(field)
+
+            if header is None:
+                raw_name, raw_field = self.name.encode(), field.encode()
+                header = self._peer_headers[field] = bytes([Datatypes.SEND_GET.value, len(raw_name), len(raw_field)]) + raw_name + raw_field
+
+            # direct subscribers get trace without broker times
+            trace_header = b"" if trace is None else bytes([Datatypes.TRACE.value]) + TRACE_SEND.pack(*trace, 0.0, 0.0)
+
+            # packed once for all direct subscribers
+            frame = pack_frame(b"".join((trace_header, header, data)), self.compression if compression is None else compression)
+
+            blocked = [peer.outbox for peer in tuple(peers) if not peer.outbox.put(frame)]
+            if len(blocked) > 0:
+                await asyncio.gather(*(outbox.wait_room() for outbox in blocked))
+
+            if field in self._unbrokered:
+                # server still gets the latest value now and then, for get, get_many and rosstat
+                if field not in self._refresh:
+                    asyncio.get_running_loop().call_later(UNBROKERED_REFRESH, self._send_refresh, field)
+
+                self._refresh[field] = (data, compression)
+                return
+
+        await self._post_brokered(field, data, compression, trace)
+
+    def _send_refresh(self, field: str) -> None:
+        pending = self._refresh.pop(field, None)
+
+        # field became brokered again (see _on_brokered), its newer values went to server already
+        if pending is None or field not in self._unbrokered:
+            return
+
+        task = asyncio.ensure_future(self._post_brokered(field, *pending))
+        self._serving.add(task)
+        task.add_done_callback(self._serving.discard)
+
+    async def _post_brokered(self, field: str, data: bytearray, compression: Compression | None, trace: tuple[int, float] | None = None) -> None:
+        """
+        Sends POST of own field to server
+        """
+
+        trace_header = b""
+        if trace is not None and self.capabilities & Capabilities.TRACE:
+            trace_header = bytes([Datatypes.TRACE.value]) + TRACE_POST.pack(*trace)
+
+        if self._use_ids:
+            header = self._post_headers.get(field)
+
+            if header is None:
+                header = struct.pack(">BI", Datatypes.POST_ID.value, await self.topic_id(Datatypes.POST, self.name, field))
+                self._post_headers[field] = header
+
+            await self.send_to(self._owner(self.name, field), b"".join((trace_header, header, data)), compression)
+            return
+
+        raw_field = field.encode()
+
+        await self.send_to(self._owner(self.name, field), b"".join((
+            trace_header,
+            bytes([
+                Datatypes.POST.value,
+                len(raw_field),
+            ]),
+            raw_field,
+            data,
+        )), compression)
+
+    def trace(self, field: str) -> None:
+        """
+        Sends trace header with every post of own field: sequence number and publish time,
+        server adds its receive and forward times. Subscribers get it as Trace (see _on_trace)
+        """
+
+        if field not in self.traced:
+            self.traced[field] = 0
+
+    async def declare(self, field: str, compression: Compression | None = None, latched: bool = False) -> bool:
+        """
+        Creates topic on server and sets its options
+
+        :param compression: compression policy for topic frames, connection`s policy is used if None
+        :param latched: last value is sent to new subscribers right away
+        :return: False if server doesn`t support topic options
+        """
+
+        if not self.capabilities & Capabilities.TOPIC_OPTIONS:
+            return False
+
+        raw_field = field.encode()
+
+        await self.send_to(self._owner(self.name, field), bytearray([
+            Datatypes.TOPIC.value,
+            len(raw_field),
+            *raw_field,
+            0xff if compression is None else compression.value,
+            TopicFlags.LATCHED if latched else TopicFlags.NONE,
+        ]))
+
+        return True
+
+    def service(self, name: str, handler: Callable, concurrency: int = SERVICE_CONCURRENCY) -> None:
+        """
+        Registers service, other nodes call it with call(node, name, data)
+
+        :param handler: async (data, caller node) -> reply bytes
+        :param concurrency: calls handled at once, others wait until their timeout
+        """
+
+        self.services[name] = _Service(handler, concurrency)
+
+    async def call(self, node: str, service: str, data: bytes = b"", timeout: float | None = CALL_TIMEOUT) -> bytes:
+        """
+        Calls node`s service through server. Calls don`t wait for each other, many of them can be in flight at once
+
+        :param timeout: seconds, service node drops the call too if it hasn`t answered by then. No limit if None
+        :return: reply
+        :raises ServiceError: service raised, doesn`t exist or node can`t be reached
+        :raises TimeoutError: no reply in timeout
+        """
+
+        if not self.capabilities & Capabilities.SERVICES:
+            raise ServiceError(ServiceStatus.UNREACHABLE, "server doesn`t support services")
+
+        request_id = self._request_id(self._calls)
+        future = self._calls[request_id] = asyncio.get_running_loop().create_future()
+
+        raw_node, raw_service = node.encode(), service.encode()
+
+        try:
+            await self.send(b"".join((
+                bytes([Datatypes.CALL.value]),
+                _CALL.pack(request_id, 0 if timeout is None else min(math.ceil(timeout * 1000), 0xffffffff), len(raw_node), len(raw_service)),
+                raw_node,
+                raw_service,
+                data,
+            )))
+
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            # late reply is ignored
+            del self._calls[request_id]
+
+    def _request_id(self, pending: dict[int, asyncio.Future]) -> int:
+        """
+        :return: id which isn`t used by requests in flight
+        """
+
+        while True:
+            self._last_request_id = (self._last_request_id + 1) & 0xffffffff
+
+            # 0 is SEND_GET_MANY of values pushed by server
+            if self._last_request_id != 0 and self._last_request_id not in pending:
+                return self._last_request_id
+
+    async def get(self, node: str, field: str, timeout: float | None = GET_TIMEOUT) -> bytes | None:
+        """
+        Reads last posted value of topic without subscribing
+
+        :return: value, b"" if nothing was posted yet, None if topic doesn`t exist
+        """
+
+        return (await self.get_many([(node, field)], timeout))[(node, field)]
+
+    async def get_many(self, topics: Iterable[tuple[str, str]], timeout: float | None = GET_TIMEOUT) -> dict[tuple[str, str], bytes | None]:
+        """
+        Reads last posted values of topics without subscribing, with one request and one reply
+        (per broker worker which owns some of them, see Datatypes.PARTITIONS)
+
+        :param topics: (node, field) list
+        :return: (node, field) -> value, b"" if nothing was posted yet, None if topic doesn`t exist
+        :raises TimeoutError: not all replies came in timeout
+        """
+
+        if not self.capabilities & Capabilities.GET_MANY:
+            raise ConnectionError("server doesn`t support GET_MANY")
+
+        topics = list(topics)
+        loop = asyncio.get_running_loop()
+
+        requests: list[int] = []
+
+        try:
+            for owner, owned in self._group_topics(topics).items():
+                for start in range(0, len(owned), GET_MANY_BATCH):
+                    request_id = self._request_id(self._gets)
+                    self._gets[request_id] = loop.create_future()
+                    requests.append(request_id)
+
+                    await self.send_to(owner, b"".join((
+                        bytes([Datatypes.GET_MANY.value]),
+                        _TOPIC_ID.pack(request_id),
+                        pack_topics(owned[start:start+GET_MANY_BATCH]),
+                    )))
+
+            replies = await asyncio.wait_for(asyncio.gather(*(self._gets[request_id] for request_id in requests)), timeout)
+        finally:
+            # late replies are ignored
+            for request_id in requests:
+                del self._gets[request_id]
+
+        values = {}
+        for reply in replies:
+            for status, node, field, value in reply:
+                values[(node, field)] = value if status is Status.OK else None
+
+        return {topic: values.get(topic) for topic in topics}
+
+    def _on_send_reply(self, data: bytes) -> None:
+        logging.debug("GOT SEND_REPLY")
+
+        request_id, status = _SEND_REPLY.unpack_from(data)
+        future = self._calls.get(request_id)
+
+        if future is None or future.done():
+            return
+
+        if status == ServiceStatus.OK.value:
+            future.set_result(bytes(data[_SEND_REPLY.size:]))
+        else:
+            future.set_exception(ServiceError(ServiceStatus(status), bytes(data[_SEND_REPLY.size:]).decode(errors="replace")))
+
+    def _on_send_call(self, data: bytes) -> None:
+        logging.debug("GOT SEND_CALL")
+
+        request_id, timeout, name_length, service_length = _CALL.unpack_from(data)
+
+        offset = _CALL.size
+        raw_caller = bytes(data[offset:offset+name_length])
+        service = self.services.get(bytes(data[offset+name_length:offset+name_length+service_length]).decode())
+
+        if service is None:
+            self._reply(request_id, raw_caller, ServiceStatus.NOT_FOUND)
+            return
+
+        # calls are handled concurrently, not by dispatcher, so slow service doesn`t hold topic handlers
+        task = asyncio.ensure_future(self._serve_call(service, request_id, raw_caller, bytes(data[offset+name_length+service_length:]), timeout / 1000 if timeout else None))
+        self._serving.add(task)
+        task.add_done_callback(self._serving.discard)
+
+    async def _serve_call(self, service: _Service, request_id: int, raw_caller: bytes, data: bytes, timeout: float | None) -> None:
+        try:
+            reply = await asyncio.wait_for(service.call(data, bytes(raw_caller).decode()), timeout)
+        except asyncio.TimeoutError:
+            # caller has stopped waiting too
+            return
+        except Exception as e:
+            logging.error(f"service failed: {e!r}")
+            self._reply(request_id, raw_caller, ServiceStatus.ERROR, str(e).encode())
+            return
+
+        self._reply(request_id, raw_caller, ServiceStatus.OK, reply or b"")
+
+    def _reply(self, request_id: int, raw_caller: bytes, status: ServiceStatus, data: bytes = b"") -> None:
+        if self.w is None or self.w.is_closing():
+            return
+
+        self._write(b"".join((
+            bytes([Datatypes.REPLY.value]),
+            _REPLY.pack(request_id, status.value, len(raw_caller)),
+            raw_caller,
+            data,
+        )))
+
+    async def anon(self, node: str, field: str, data: bytearray, force_to_tcp: bool = False) -> None:
+        if not force_to_tcp and node in self.udp_servers and self.udp_servers[node].has_connection:
+            await self.anon_udp(node, field, data)
+
+        elif force_to_tcp or node in self.udp_servers and self.udp_servers[node].has_tried_to_connect:
+            await self.anon_tcp(node, field, data)
+
+        elif node not in self.udp_servers:
+            await self.send(bytearray([
+                Datatypes.GET_UDP_AUTH.value,
+                *node.encode()
+            ]))
+
+            await self.anon_tcp(node, field, data)
+
+        else:
+            await self.send_udp(bytes([
+                DistributedDatatypes.PING.value,
+            ]), (self.udp_servers[node].ip, self.udp_servers[node].port))
+
+            counter = 0
+            self.udp_servers[node].has_tried_to_connect = True
+            while not self.udp_servers[node].has_connection and counter < 100:
+                counter += 1
+                await asyncio.sleep(0.05)
+
+            if self.udp_servers[node].has_connection:
+                await self.anon_udp(node, field, data)
+            
+            else:
+                await self.anon_tcp(node, field, data)
+
+    async def anon_udp(self, node: str, field: str, data: bytearray) -> None:
+        """
+        Sends ANON message directly to node, which must have UDP connection (see anon).
+        Messages which don`t fit into UDP_MAX_FRAGMENTS fragments go through server
+        """
+
+        raw_name = self.name.encode()
+        raw_field = field.encode()
+
+        if 3 + len(raw_name) + len(raw_field) + len(data) > UDP_MAX_PAYLOAD * UDP_MAX_FRAGMENTS:
+            await self.anon_tcp(node, field, data)
+            return
+
+        await self.send_udp(b"".join((
+            bytes([
+                DistributedDatatypes.ANON.value,
+                len(raw_name),
+                len(raw_field),
+            ]),
+            raw_name,
+            raw_field,
+            data,
+        )), (self.udp_servers[node].ip, self.udp_servers[node].port))
+
+    async def anon_tcp(self, node: str, field: str, data: bytearray) -> None:
+        """
+        Sends ANON message through server
+        """
+
+        if self._use_ids:
+            header = self._anon_headers.get((node, field))
+
+            if header is None:
+                header = struct.pack(">BI", Datatypes.ANON_ID.value, await self.topic_id(Datatypes.ANON, node, field))
+                self._anon_headers[(node, field)] = header
+
+            await self.send(header + data)
+            return
+
+        raw_node, raw_field = node.encode(), field.encode()
+
+        await self.send(b"".join((
+            bytes([
+                Datatypes.ANON.value,
+                len(raw_node),
+                len(raw_field),
+            ]),
+            raw_node,
+            raw_field,
+            data,
+        )))
+
+    async def rosstat(self) -> dict[str, dict]:
+        """
+        Requests server graph and counters
+
+        :return: decoded stats (see decode_stats), also passed to on_rosstat
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self._rosstat_waiters.append(future)
+
+        await self.send(bytearray([
+            Datatypes.ROSSTAT.value,
+        ]))
+
+        return await future
+
+
+    def _write(self, data, compression: Compression | None = None) -> None:
+        if not self._flagged:
+            compression = None
+        elif compression is None:
+            compression = self.compression
+
+        # single write, so frames from concurrent coroutines can`t interleave
+        self.w.write(pack_frame(data, compression))
+
+    async def send(self, data, compression: Compression | None = None):
+        self._write(data, compression)
+
+        # waits only while transport buffer is over its high-water mark
+        if not self.protocol.writable.is_set():
+            await self.protocol.writable.wait()
+
+    async def send_to(self, connection: _ClientProtocol, data, compression: Compression | None = None):
+        """
+        Sends message to server or one of its workers (see _owner)
+        """
+
+        connection.write(data, compression)
+
+        if not connection.writable.is_set():
+            await connection.writable.wait()
+
+    def _owner(self, node: str, field: str) -> _ClientProtocol:
+        """
+        :return: connection which serves node`s field, server`s one if it has no workers
+        """
+
+        if self.ring is None or node == STATS_NODE:
+            return self.protocol
+
+        return self.workers[self.ring.owner(node, field)]
+
+    def _group_topics(self, topics: Iterable[tuple[str, str]]) -> dict[_ClientProtocol, list[tuple[str, str]]]:
+        groups: dict[_ClientProtocol, list[tuple[str, str]]] = {}
+
+        for node, field in topics:
+            owner = self._owner(node, field)
+
+            if owner not in groups:
+                groups[owner] = []
+
+            groups[owner].append((node, field))
+
+        return groups
+
+
+    async def send_udp(self, data: bytes, addr: AddrLike):
+        """
+        Sends message in one datagram, messages larger than UDP_MAX_PAYLOAD are split into FRAGMENT datagrams
+        """
+
+        if len(data) <= UDP_MAX_PAYLOAD:
+            self.transport.sendto(
+                struct.pack(">I", len(data)) + data, addr
+            )
+            return
+
+        count = (len(data) + UDP_MAX_PAYLOAD - 1) // UDP_MAX_PAYLOAD
+        if count > UDP_MAX_FRAGMENTS:
+            raise ValueError(f"message of {len(data)} bytes is too large for UDP, send it through server")
+
+        self._udp_message_id = (self._udp_message_id + 1) & 0xffffffff
+
+        with memoryview(data) as view:
+            for index in range(count):
+                chunk = view[index*UDP_MAX_PAYLOAD:(index+1)*UDP_MAX_PAYLOAD]
+
+                self.transport.sendto(b"".join((
+                    _FRAME_LENGTH.pack(_UDP_FRAGMENT.size + len(chunk)),
+                    _UDP_FRAGMENT.pack(DistributedDatatypes.FRAGMENT.value, self._udp_message_id, index, count),
+                    chunk,
+                )), addr)
+
+                chunk.release()
+
+                # receiver`s socket buffer holds only a few fragments, it has to read them while the rest is sent
+                await asyncio.sleep(0)
+
+
+    def _dispatch(self, handler: Callable, *args) -> None:
+        """
+        Queues user handler call, handlers are awaited one by one in order of messages
+        """
+
+        self._dispatch_queue.append((handler, args))
+        self._dispatch_wakeup.set()
+
+        # slow handlers hold reading, so server`s queue policy applies to this client
+        if len(self._dispatch_queue) >= DISPATCH_QUEUE_SIZE and not self.protocol.paused:
+            self.protocol.pause()
+
+    async def _dispatch_mainloop(self):
+        queue = self._dispatch_queue
+
+        while True:
+            if len(queue) == 0:
+                self._dispatch_wakeup.clear()
+                await self._dispatch_wakeup.wait()
+                continue
+
+            item = queue.popleft()
+
+            # connection is closed
+            if item is None:
+                break
+
+            handler, args = item
+
+            try:
+                await handler(*args)
+            except Exception as e:
+                logging.error(e)
+
+            if len(queue) <= DISPATCH_QUEUE_SIZE // 2:
+                if self.protocol.paused:
+                    self.protocol.resume()
+
+                if len(self._paused_links) > 0:
+                    for link in self._paused_links:
+                        link.resume()
+
+                    self._paused_links.clear()
+
+    def _connection_lost(self) -> None:
+        self._is_running = False
+        self._is_authorized = False
+
+        self._dispatch_queue.append(None)
+        self._dispatch_wakeup.set()
+
+    def _on_request_auth(self, data: bytes) -> None:
+        logging.debug("GOT REQUEST_AUTH")
+
+        # old servers don`t send capabilities
+        server_capabilities = Capabilities(struct.unpack(">I", data[:4])[0]) if len(data) >= 4 else Capabilities.NONE
+        capabilities = server_capabilities & SUPPORTED_CAPABILITIES
+
+        if not self.direct:
+            capabilities &= ~Capabilities.DIRECT_TOPICS
+
+        # server switches framing right after SEND_AUTH, so no other frame may be sent in between
+        self.w.write(pack_frame(self._auth_message(capabilities)))
+        self.capabilities = capabilities
+        self._flagged = bool(capabilities & Capabilities.FRAME_FLAGS)
+        self._use_ids = bool(capabilities & Capabilities.TOPIC_IDS)
+
+        # topics can`t be routed until PARTITIONS comes
+        self._is_authorized = not capabilities & Capabilities.PARTITIONS
+
+        ip, port = self.transport.get_extra_info("sockname")[:2]
+
+        self._write(bytearray([
+            Datatypes.SEND_UDP_AUTH.value,
+            *ip.encode(),
+            *struct.pack(">H", int(port)),
+        ]))
+
+        if self.direct_addr is not None and capabilities & Capabilities.DIRECT_TOPICS:
+            self._write(bytes([Datatypes.DIRECT_ADDR.value]) + self.direct_addr.encode())
+
+    def _auth_message(self, capabilities: Capabilities) -> bytearray:
+        CREDENTIALS = self.name.encode()
+
+        if not capabilities:
+            return bytearray([
+                Datatypes.SEND_AUTH.value,
+                len(CREDENTIALS),
+                *CREDENTIALS
+            ])
+
+        return bytearray([
+            Datatypes.SEND_AUTH.value,
+            len(CREDENTIALS),
+            *CREDENTIALS,
+            *struct.pack(">I", capabilities),
+            self.compression.value,
+            0xff if self.queue_policy is None else self.queue_policy.value,
+        ])
+
+    def _on_partitions(self, data: bytes) -> None:
+        logging.debug("GOT PARTITIONS")
+
+        count, replicas = struct.unpack(">BH", data[:3])
+
+        addresses = []
+        offset = 3
+        for _ in range(count):
+            port, path_length = struct.unpack(">HB", data[offset:offset+3])
+            addresses.append((port, bytes(data[offset+3:offset+3+path_length]).decode()))
+            offset += 3 + path_length
+
+        self.ring = HashRing(count, replicas)
+        self.workers = [_WorkerProtocol(self, index) for index in range(count)]
+
+        # messages to workers wait in their pending lists until they are connected
+        self._is_authorized = True
+
+        asyncio.ensure_future(self._connect_workers(addresses))
+
+    async def _connect_workers(self, addresses: list[tuple[int, str]]) -> None:
+        loop = asyncio.get_running_loop()
 
-                        case Datatypes.SUBSCRIBE:
-                            if CREDENTIALS is None: raise ConnectionError("node hasn`t sended valid credentials")
+        try:
+            for worker, (port, path) in zip(self.workers, addresses):
+                # worker`s unix socket is used by clients connected to server over unix socket
+                if path and (self.family == socket.AF_UNIX or not port):
+                    await loop.create_unix_connection(lambda worker=worker: worker, path)
+                else:
+                    host = "localhost" if self.family == socket.AF_UNIX else self.ip
+                    await loop.create_connection(lambda worker=worker: worker, host, port, family=socket.AF_INET)
 
-                            logging.debug("GOT SUBSCRIBE")
+        except OSError as e:
+            logging.error(f"broker worker is unreachable: {e}")
+            self.w.close()
 
-                            name_length = data[0]
-                            field_length = data[1]
+    def _worker_lost(self, worker: _WorkerProtocol) -> None:
+        # worker`s topics can`t be reached without it, client is closed as if server was lost
+        if self.w is not None and not self.w.is_closing():
+            logging.error(f"lost connection to broker worker {worker.index}")
+            self.w.close()
 
-                            data_start = 2+name_length+field_length
+    def _on_send_udp_auth(self, data: bytes) -> None:
+        logging.debug("GOT SEND_UDP_AUTH")
 
-                            raw_node_name = data[2:2+name_length]
-                            raw_field_name = data[2+name_length:2+name_length+field_length]
+        node_name_len = data[0]
+        node_name = bytes(data[1:1+node_name_len]).decode()
 
-                            node_name = raw_node_name.decode()
-                            field_name = raw_field_name.decode()
+        if node_name in self.udp_servers:
+            return
 
-                            if node_name not in self.servers:
-                                await w(bytearray([
-                                    Datatypes.ERROR.value,
-                                    Errortypes.INVALID_SUBSCRIBE.value
-                                ]))
-                                continue
+        ip = bytes(data[1+node_name_len:-2]).decode()
+        port = struct.unpack(">H", data[-2:])[0]
 
-                            if field_name not in self.servers[node_name].fields:
-                                self.servers[node_name].fields[field_name] = Field(
-                                    data=None,
-                                    subscribers=[CREDENTIALS],
-                                )
-                            else:
-                                self.servers[node_name].fields[field_name].subscribers.append(CREDENTIALS)
 
-                        case Datatypes.ANON:
-                            if CREDENTIALS is None: raise ConnectionError("node hasn`t sended valid credentials")
+        self.udp_servers[node_name] = UDPConnection(
+            ip,
+            port,
+            node_name,
+        )
 
-                            logging.debug("GOT ANON")
+    def _on_send_get(self, data: bytes) -> None:
+        logging.debug("GOT SEND_GET")
+        
+        name_length = data[0]
+        field_length = data[1]
 
-                            name_length = data[0]
-                            field_length = data[1]
+        data_start = 2+name_length+field_length
 
-                            data_start = 2+name_length+field_length
+        node_name = bytes(data[2:2+name_length]).decode()
+        field_name = bytes(data[2+name_length:2+name_length+field_length]).decode()
 
-                            raw_node_name = data[2:2+name_length]
-                            raw_field_name = data[2+name_length:2+name_length+field_length]
+        self._received(node_name, field_name, data[data_start:])
 
-                            node_name = raw_node_name.decode()
-                            field_name = raw_field_name.decode()
+    def _on_send_get_id(self, data: bytes) -> None:
+        topic = self.received_ids.get(_TOPIC_ID.unpack_from(data)[0])
 
-                            if node_name not in self.servers:
-                                await w(bytearray([
-                                    Datatypes.ERROR.value,
-                                    Errortypes.INVALID_ANON_CREDENTIALS.value
-                                ]))
-                                continue
+        if topic is not None:
+            self._received(*topic, data[4:])
 
-                            await self.tcp_send(self.servers[node_name].socket, bytearray([
-                                Datatypes.SEND_ANON.value,
-                                len(CREDENTIALS),
-                                len(raw_field_name),
-                                *CREDENTIALS.encode(),
-                                *raw_field_name,
-                                *data[data_start:], # additional info
-                            ]))
+    def _on_send_topic_id(self, data: bytes) -> None:
+        logging.debug("GOT SEND_TOPIC_ID")
 
-                        case Datatypes.ROSSTAT:
-                            logging.debug("GOT ROSSTAT")
+        topic_id, name_length, field_length = struct.unpack(">IBB", data[:6])
 
-                            # tosend = {}
-                            # for x in self.servers.keys():
-                            #     v = self.servers[x]
+        self.received_ids[topic_id] = (
+            bytes(data[6:6+name_length]).decode(),
+            bytes(data[6+name_length:6+name_length+field_length]).decode(),
+        )
 
-                            #     for fld in v.fields.keys():
-                            #         del v.fields[fld].data
+    def _on_send_get_many(self, data: bytes) -> None:
+        logging.debug("GOT SEND_GET_MANY")
 
-                            #     del v.socket
-                            #     tosend[x] = v
+        request_id, values = unpack_values(data)
 
-                            # self.send(conn, bytearray([
-                            #     Datatypes.ROSSTAT.value,
-                            #     *json.dumps(tosend).encode()
-                            # ]), addr)
+        # reply to get_many, values aren`t passed to handlers
+        if request_id != 0:
+            future = self._gets.get(request_id)
 
-                            # TODO: fix rosstat (add json encoder to Field and Connection classes)
+            if future is not None and not future.done():
+                future.set_result(values)
 
-                        case Datatypes.ERROR:
-                            logging.debug("GOT ERROR")
+            return
 
-                            try:
-                                logging.warning(Errortypes(data[1]))
-                            except:
-                                pass
+        for status, node_name, field_name, value in values:
+            if status is Status.OK:
+                self._received(node_name, field_name, value)
 
-                        case _:
-                            raise Exception
-                
-                except Exception as e:
-                    logging.error(e)
-                    await w(bytearray([Datatypes.ERROR.value, Errortypes.METHOD_NOT_FOUND.value]))
+    def _on_send_post(self, data: bytes) -> None:
+        logging.debug("GOT SEND_POST")
 
-        except Exception as e:
-        # elif False:
-            logging.error(e)
-            logging.error(e.__traceback__.tb_lineno)
+    def _on_error(self, data: bytes) -> None:
+        logging.debug("GOT ERROR")
+        logging.debug(bytes(data))
 
-        finally:
-        # else:
-            # cleanup when disconnected
-            if CREDENTIALS in self.servers:
-                del self.servers[CREDENTIALS]
-                for server in self.servers.values():
-                    for field in server.fields.values():
-                        try:
-                            while CREDENTIALS in field.subscribers:
-                                field.subscribers.remove(CREDENTIALS)
-                        except: pass
+        match Errortypes(data[0]):
+            case Errortypes.NODE_EXISTS:
+                logging.error("Node name already exists")
+                self.w.close()
 
-class _ClientRecvProtocol(asyncio.DatagramProtocol):
-    def __init__(self, root):
-        super().__init__()
-        self.root: "AsyncDistrubutedClient" = root
+            case Errortypes.INVALID_CREDENTIALS:
+                logging.error("Sended invalid credentials")
+                self.w.close()
 
-    def connection_made(self, transport):
-        self.transport = transport
+            case Errortypes.METHOD_NOT_FOUND:
+                logging.error("Requested method not found")
 
-    def datagram_received(self, data: bytes, addr: AddrLike):
-        if addr in self.root.udp_buffers:
-            self.root.udp_buffers[addr] += data
-        
-        else:
-            self.root.udp_buffers[addr] = data
+            case Errortypes.INVALID_SUBSCRIBE:
+                logging.error("Sended invalid subscribe credentials")
 
-class UDPConnection:
-    def __init__(self, ip: str, port: int, name: str):
-        self.ip = ip
-        self.port = port
-        self.name = name
+            case Errortypes.INVALID_ANON_CREDENTIALS:
+                logging.error("Sended invalid ANON credentials")
 
-        self.has_connection = False
-        self.has_tried_to_connect = False
+            case Errortypes.INVALID_TOPIC_ID:
+                logging.error("Sended undeclared topic id")
 
-class AsyncDistrubutedClient(SockClient):
-    def __init__(self, ip, port, name):
-        super().__init__(ip, port, name)
+            case Errortypes.INVALID_GET_UDP_CREDENTIALS:
+                logging.error("Sended invalid GET_UDP credentials")
+                
+                name = bytes(data[2:]).decode()
+                
+                if name in self.udp_servers:
+                    self.udp_servers[name].has_connection = False
+                    self.udp_servers[name].has_tried_to_connect = True
 
-        self.udp_buffers: dict[AddrLike, bytes] = {}
-        self.udp_servers: dict[str, UDPConnection] = {}
+                else:
+                    self.udp_servers[name] = UDPConnection(
+                        "", -1, name
+                    )
+                    self.udp_servers[name].has_connection = False
+                    self.udp_servers[name].has_tried_to_connect = True
 
-        self.r: asyncio.StreamReader = None
-        self.w: asyncio.StreamWriter = None
+            case _:
+                logging.error("Got unknown error")
 
-        self.transport: _ClientRecvProtocol = None
+    def _on_send_anon(self, data: bytes) -> None:
+        logging.debug("GOT SEND_ANON")
 
-        self._is_running = False
+        name_length = data[0]
+        field_length = data[1]
 
+        data_start = 2+name_length+field_length
 
-    async def subscribe(self, node: str, field: str, handler: Callable | None) -> None:
-        await self.send(bytearray([
-            Datatypes.SUBSCRIBE.value,
-            len(node),
-            len(field),
-            *node.encode(),
-            *field.encode(),
-        ]))
+        node_name = bytes(data[2:2+name_length]).decode()
+        field_name = bytes(data[2+name_length:2+name_length+field_length]).decode()
 
-        if handler is not None:
-            if node not in self.handlers:
-                self.handlers[node] = {}
+        self._dispatch(self.anon_handlers[field_name], bytes(data[data_start:]), node_name)
 
-            self.handlers[node][field] = handler
+    def _on_direct_addr(self, data: bytes) -> None:
+        logging.debug("GOT DIRECT_ADDR")
 
-            logging.debug(f"ADDED HANDLER {node}:{field}")
+        name_length = data[0]
+        field_length = data[1]
 
-    async def unsubscribe(self, node: str, field: str) -> None:
-        await self.send(bytearray([
-            Datatypes.UNSUBSCRIBE.value,
-            len(node),
-            len(field),
-            *node.encode(),
-            *field.encode(),
-        ]))
+        node = bytes(data[2:2+name_length]).decode()
+        field = bytes(data[2+name_length:2+name_length+field_length]).decode()
+        address = bytes(data[2+name_length+field_length:]).decode()
 
-    async def post(self, field: str, data: bytearray) -> None:
-        await self.send(bytearray([
-            Datatypes.POST.value,
-            len(field),
-            *field.encode(),
-            *data,
-        ]))
+        link = self.links.get(node)
 
-    async def anon(self, node: str, field: str, data: bytearray, force_to_tcp: bool = False) -> None:
-        if not force_to_tcp and node in self.udp_servers and self.udp_servers[node].has_connection:
-            raw_name = self.name.encode()
-            raw_field = field.encode()
+        if link is not None and link.address == address:
+            if field not in link.fields:
+                link.fields.add(field)
 
-            await self.send_udp(bytes([
-                DistributedDatatypes.ANON.value,
-                len(raw_name),
-                len(raw_field),
-                *raw_name,
-                *raw_field,
-                *data
-            ]), (self.udp_servers[node].ip, self.udp_servers[node].port))
+                # not connected links subscribe to all their fields when connected
+                if link.transport is not None:
+                    link.subscribe(field)
+            return
 
-        elif force_to_tcp or node in self.udp_servers and self.udp_servers[node].has_tried_to_connect:
-            await self.send(bytearray([
-                Datatypes.ANON.value,
-                len(node),
-                len(field),
-                *node.encode(),
-                *field.encode(),
-                *data
-            ]))
+        if (node, address) in self._failed_links:
+            return
 
-        elif node not in self.udp_servers:
-            await self.send(bytearray([
-                Datatypes.GET_UDP_AUTH.value,
-                *node.encode()
-            ]))
+        # publisher reconnected with new address
+        if link is not None and link.transport is not None:
+            link.transport.close()
 
-            await self.send(bytearray([
-                Datatypes.ANON.value,
-                len(node),
-                len(field),
-                *node.encode(),
-                *field.encode(),
-                *data
-            ]))
+        link = self.links[node] = _PeerClientProtocol(self, node, address)
+        link.fields.add(field)
 
-        else:
-            await self.send_udp(bytes([
-                DistributedDatatypes.PING.value,
-            ]), (self.udp_servers[node].ip, self.udp_servers[node].port))
+        asyncio.ensure_future(self._connect_link(link))
 
-            counter = 0
-            self.udp_servers[node].has_tried_to_connect = True
-            while not self.udp_servers[node].has_connection and counter < 100:
-                counter += 1
-                await asyncio.sleep(0.05)
+    async def _connect_link(self, link: _PeerClientProtocol) -> None:
+        loop = asyncio.get_running_loop()
+        family, host, port = parse_address(link.address)
 
-            if self.udp_servers[node].has_connection:
-                raw_name = self.name.encode()
-                raw_field = field.encode()
-
-                await self.send_udp(bytes([
-                    DistributedDatatypes.ANON.value,
-                    len(raw_name),
-                    len(raw_field),
-                    *raw_name,
-                    *raw_field,
-                    *data
-                ]), (self.udp_servers[node].ip, self.udp_servers[node].port))
-            
+        try:
+            if family == socket.AF_UNIX:
+                await loop.create_unix_connection(lambda: link, host)
             else:
-                await self.send(bytearray([
-                    Datatypes.ANON.value,
-                    len(self.name),
-                    len(field),
-                    *node.encode(),
-                    *field.encode(),
-                    *data
-                ]))
+                await loop.create_connection(lambda: link, host, port)
 
-    async def rosstat(self) -> None:
-        await self.send(bytearray([
-            Datatypes.ROSSTAT.value,
-        ]))
+        except OSError as e:
+            logging.warning(f"direct link to {link.node} at {link.address} failed, data goes through server: {e}")
 
+            self._failed_links.add((link.node, link.address))
+            if self.links.get(link.node) is link:
+                del self.links[link.node]
 
-    async def _recv(self, length: int) -> bytes:
-        return await self.r.readexactly(length)
-    
-    async def _send(self, data) -> None:
-        self.w.write(data)
-        await self.w.drain()
+    def _unlink(self, node: str, field: str) -> None:
+        link = self.links.get(node)
 
-    async def recv(self):
-        try:
-            length = await self._recv(4)
-            length = struct.unpack(">I", length)[0]
-            return zlib.decompress(await self._recv(length))
-        except:
-            return bytearray([])
-        
-    async def send(self, data):
-        data = zlib.compress(data)
-        length = len(data)
-        length = struct.pack(">I", length)
+        if link is not None and field in link.fields:
+            link.fields.discard(field)
 
-        # while self.sending:
-        #     asyncio.sleep(0.01)
+            if link.transport is not None and not link.transport.is_closing():
+                link.unsubscribe(field)
 
-        # self.sending = True
+    def _on_brokered(self, data: bytes) -> None:
+        logging.debug("GOT BROKERED")
 
-        await self._send(length)
-        await self._send(data)
-        
-        # self.sending = Fals   e
+        field = bytes(data[2:2+data[1]]).decode()
 
+        if data[0]:
+            self._unbrokered.discard(field)
+            self._refresh.pop(field, None)
+        else:
+            self._unbrokered.add(field)
 
-    async def send_udp(self, data: bytes, addr: AddrLike):
-        self.transport.sendto(
-            struct.pack(">I", len(data)) + data, addr
-        )
+    def _peer_subscribed(self, peer: _PeerServerProtocol, field: str) -> None:
+        if field not in self.peer_subscribers:
+            self.peer_subscribers[field] = set()
 
+        self.peer_subscribers[field].add(peer)
 
-    async def _tcp_mainloop(self):
-        while True:
-            data = await self.recv()
-            data, datatype = data[1:], data[0]
+        # sent with posts of the field, so every post goes either through server or directly
+        self._direct(field, peer.name, True)
 
-            try:
-                match Datatypes(datatype):
-                    case Datatypes.REQUEST_AUTH:
-                        logging.debug("GOT REQUEST_AUTH")
+    def _peer_unsubscribed(self, peer: _PeerServerProtocol, field: str) -> None:
+        peer.fields.discard(field)
 
-                        CREDENTIALS = self.name.encode()
+        peers = self.peer_subscribers.get(field, set())
+        peers.discard(peer)
 
-                        await self.send(bytearray([
-                            Datatypes.SEND_AUTH.value,
-                            len(CREDENTIALS),
-                            *CREDENTIALS
-                        ]))
+        # subscriber may have reconnected already
+        if not any(other.name == peer.name for other in peers):
+            self._direct(field, peer.name, False)
 
-                        ip, port = self.transport.get_extra_info("sockname")[:2]
+    def _direct(self, field: str, subscriber: str, enabled: bool) -> None:
+        if self.w is None or self.w.is_closing():
+            return
 
-                        await self.send(bytearray([
-                            Datatypes.SEND_UDP_AUTH.value,
-                            *ip.encode(),
-                            *struct.pack(">H", int(port)),
-                        ]))
+        raw_field, raw_subscriber = field.encode(), subscriber.encode()
+        self._owner(self.name, field).write(bytes([Datatypes.DIRECT.value, enabled, len(raw_field), len(raw_subscriber)]) + raw_field + raw_subscriber)
 
-                    case Datatypes.SEND_UDP_AUTH:
-                        logging.debug("GOT SEND_UDP_AUTH")
+    async def _start_direct_server(self) -> None:
+        loop = asyncio.get_running_loop()
+        address = self.direct_address
 
-                        node_name_len = data[0]
-                        node_name = data[1:1+node_name_len].decode()
+        if address is None:
+            if self.family == socket.AF_UNIX:
+                self._direct_dir = tempfile.mkdtemp(prefix="miniros-")
+                address = "unix:" + os.path.join(self._direct_dir, f"{self.name}.sock")
+            else:
+                address = "0.0.0.0:0"
 
-                        if node_name in self.udp_servers:
-                            continue
+        family, host, port = parse_address(address)
 
-                        ip = data[1+node_name_len:-2].decode()
-                        port = struct.unpack(">H", data[-2:])[0]
+        if family == socket.AF_UNIX:
+            self.direct_server = await loop.create_unix_server(lambda: _PeerServerProtocol(self), host)
+            self.direct_addr = f"unix:{host}"
+            return
 
+        self.direct_server = await loop.create_server(lambda: _PeerServerProtocol(self), host, port or 0, family=socket.AF_INET)
+        host, port = self.direct_server.sockets[0].getsockname()[:2]
 
-                        self.udp_servers[node_name] = UDPConnection(
-                            ip,
-                            port,
-                            node_name,
-                        )
-                        self.udp_buffers[(ip, port)] = b""
+        # subscribers connect to the interface which reaches server
+        if host == "0.0.0.0":
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                probe.connect((self.ip, self.port))
+                host = probe.getsockname()[0]
 
-                    case Datatypes.SEND_GET:
-                        logging.debug("GOT SEND_GET")
-                        
-                        name_length = data[0]
-                        field_length = data[1]
+        self.direct_addr = f"{host}:{port}"
 
-                        data_start = 2+name_length+field_length
+    def _on_rosstat(self, data: bytes) -> None:
+        logging.debug("GOT ROSSTAT")
 
-                        node_name = data[2:2+name_length].decode()
-                        field_name = data[2+name_length:2+name_length+field_length].decode()
+        stats = decode_stats(data)
+        self.on_rosstat(stats)
 
-                        if node_name not in self.received:
-                            self.received[node_name] = {}
+        if len(self._rosstat_waiters) > 0:
+            future = self._rosstat_waiters.popleft()
+            if not future.done():
+                future.set_result(stats)
 
-                        self.received[node_name][field_name] = data[data_start:]
-                        if node_name in self.handlers and field_name in self.handlers[node_name]:
-                            await self.handlers[node_name][field_name](data[data_start:])
+    def _received(self, node_name: str, field_name: str, data: memoryview) -> None:
+        handlers = self.handlers.get(node_name)
+        handler = None if handlers is None else handlers.get(field_name)
 
-                    case Datatypes.SEND_POST:
-                        logging.debug("GOT SEND_POST")
+        if handler is None and self.pattern_handlers:
+            handler = self._pattern_handler(node_name, field_name)
 
-                    case Datatypes.ERROR:
-                        logging.debug("GOT ERROR")
-                        logging.debug(data)
+        # the only copy of payload, bytes data starts aligned, so arrays decode without copying (see ARRAY_ALIGNMENT)
+        data = bytes(data)
 
-                        match Errortypes(data[0]):
-                            case Errortypes.NODE_EXISTS:
-                                logging.error("Node name already exists")
-                                break
+        if node_name not in self.received:
+            self.received[node_name] = {}
 
-                            case Errortypes.INVALID_CREDENTIALS:
-                                logging.error("Sended invalid credentials")
-                                break
+        self.received[node_name][field_name] = data
 
-                            case Errortypes.METHOD_NOT_FOUND:
-                                logging.error("Requested method not found")
+        if handler is not None:
+            if self._trace is not None:
+                self._dispatch(self._call_traced, handler, node_name, field_name, data, self._trace)
+            else:
+                self._dispatch(handler, data)
 
-                            case Errortypes.INVALID_SUBSCRIBE:
-                                logging.error("Sended invalid subscribe credentials")
+        elif self._trace is not None and self.tracer is not None:
+            self.tracer.add(node_name, field_name, self._trace)
 
-                            case Errortypes.INVALID_ANON_CREDENTIALS:
-                                logging.error("Sended invalid ANON credentials")
+    def _on_trace(self, data: bytes) -> None:
+        seq, published, broker_received, broker_forwarded = TRACE_SEND.unpack_from(data)
+        opcode = data[TRACE_SEND.size]
 
-                            case Errortypes.INVALID_GET_UDP_CREDENTIALS:
-                                logging.error("Sended invalid GET_UDP credentials")
-                                
-                                name = data[2:].decode()
-                                
-                                if name in self.udp_servers:
-                                    self.udp_servers[name].has_connection = False
-                                    self.udp_servers[name].has_tried_to_connect = True
+        if opcode != Datatypes.SEND_GET.value and opcode != Datatypes.SEND_GET_ID.value:
+            raise ConnectionError(f"TRACE can`t wrap message {opcode}")
 
-                                else:
-                                    self.udp_servers[name] = UDPConnection(
-                                        "", -1, name
-                                    )
-                                    self.udp_servers[name].has_connection = False
-                                    self.udp_servers[name].has_tried_to_connect = True
+        # wrapped message is handled as usual, _received picks trace up
+        self._trace = Trace(seq, published, broker_received, broker_forwarded, time.time())
 
-                            case _:
-                                logging.error("Got unknown error")
+        try:
+            self._handlers[opcode](data[TRACE_SEND.size+1:])
+        finally:
+            self._trace = None
 
-                    case Datatypes.SEND_ANON:
-                        logging.debug("GOT SEND_ANON")
+    async def _call_traced(self, handler: Callable, node_name: str, field_name: str, data: bytes, trace: Trace) -> None:
+        accepts_trace = self._trace_kwarg.get(handler)
 
-                        name_length = data[0]
-                        field_length = data[1]
+        if accepts_trace is None:
+            try:
+                accepts_trace = "trace" in inspect.signature(handler).parameters
+            except (TypeError, ValueError):
+                accepts_trace = False
 
-                        data_start = 2+name_length+field_length
+            self._trace_kwarg[handler] = accepts_trace
 
-                        node_name = data[2:2+name_length].decode()
-                        field_name = data[2+name_length:2+name_length+field_length].decode()
+        trace.handled = time.time()
 
-                        await self.anon_handlers[field_name](data[data_start:], node_name)
+        try:
+            await (handler(data, trace=trace) if accepts_trace else handler(data))
+        finally:
+            trace.done = time.time()
 
-                    case Datatypes.ROSSTAT:
-                        self.on_rosstat(json.loads(data.decode()))
+            if self.tracer is not None:
+                self.tracer.add(node_name, field_name, trace)
 
-                    case _:
-                        raise Exception
+    def _datagram_received(self, data: bytes, addr: AddrLike) -> None:
+        """
+        Handles one datagram right when it arrives, every datagram is a complete frame
+        """
 
-            except Exception as e:
-                await self.send(bytearray([Datatypes.ERROR.value, Errortypes.METHOD_NOT_FOUND.value]))
+        if len(data) < 5 or _FRAME_LENGTH.unpack_from(data)[0] != len(data) - 4:
+            logging.debug(f"broken datagram from {addr}")
+            return
 
-    async def _udp_mainloop(self):
-        while True:
-            tasks = []
-            addrs = []
-            for buf in self.udp_buffers.keys():
-                if len(self.udp_buffers[buf]) > 0:
-                    addrs.append(buf)
-                    tasks.append(
-                        self._udp_mainloop_handler(self.udp_buffers[buf], buf)
-                    )
+        if data[4] == DistributedDatatypes.FRAGMENT.value:
+            message = self._reassemble(data, addr)
+            if message is None:
+                return
 
-            results = await asyncio.gather(*tasks)
+            self._udp_message_received(memoryview(message), addr)
+            return
 
-            for res, addr in zip(results, addrs):
-                self.udp_buffers[addr] = self.udp_buffers[addr][res:]
+        self._udp_message_received(memoryview(data)[4:], addr)
 
-            await asyncio.sleep(0.01)
+    def _udp_message_received(self, message: memoryview, addr: AddrLike) -> None:
+        match message[0]:
+            case DistributedDatatypes.ANON.value:
+                name_length = message[1]
+                field_length = message[2]
 
-    async def _udp_mainloop_handler(self, data: bytes, addr: AddrLike) -> int:
-        length = struct.unpack(">I", data[:4])[0]
+                data_start = 3+name_length+field_length
 
-        data = data[4:4+length]
+                handler = self.anon_handlers.get(bytes(message[3+name_length:data_start]).decode())
+                if handler is None:
+                    return
 
-        datatype, data = data[0], data[1:]
+                queue = self.udp_queues.get(addr)
+                if queue is None:
+                    queue = self.udp_queues[addr] = _UDPQueue()
+                    queue.task = asyncio.ensure_future(self._udp_dispatch_mainloop(queue))
 
-        match DistributedDatatypes(datatype):
-            case DistributedDatatypes.PING:
-                await self.send_udp(
-                    bytes([
-                        DistributedDatatypes.PONG.value,
-                    ]),
-                    addr
-                )
+                if len(queue.calls) == UDP_QUEUE_SIZE:
+                    queue.dropped += 1
 
-            case DistributedDatatypes.PONG:
+                queue.calls.append((handler, (bytes(message[data_start:]), bytes(message[3:3+name_length]).decode())))
+                queue.wakeup.set()
+
+            case DistributedDatatypes.PING.value:
+                self.transport.sendto(_UDP_PONG, addr)
+
+            case DistributedDatatypes.PONG.value:
                 for server in self.udp_servers.values():
                     if server.ip == addr[0] and server.port == addr[1]:
                         server.has_connection = True
                         server.has_tried_to_connect = True
                         break
 
-            case DistributedDatatypes.ANON:
-                name_length = data[0]
-                field_length = data[1]
+    def _reassemble(self, data: bytes, addr: AddrLike) -> bytes | None:
+        """
+        Stores FRAGMENT datagram
+
+        :return: complete message when its last fragment arrives, None otherwise
+        """
+
+        if len(data) < 4 + _UDP_FRAGMENT.size:
+            return None
+
+        _, message_id, index, count = _UDP_FRAGMENT.unpack_from(data, 4)
+        if count > UDP_MAX_FRAGMENTS or index >= count:
+            return None
+
+        key = (addr, message_id)
+        message = self.udp_fragments.get(key)
+
+        if message is None:
+            now = time.monotonic()
+
+            # messages are stored in order of their first fragment, so expired ones are at the start
+            for old_key, old in tuple(self.udp_fragments.items()):
+                if now - old.started < UDP_REASSEMBLY_TIMEOUT:
+                    break
+
+                self._drop_fragments(old_key)
+
+            message = self.udp_fragments[key] = _Reassembly(count, now)
+
+        elif len(message.chunks) != count or message.chunks[index] is not None:
+            return None
 
-                data_start = 2+name_length+field_length
+        chunk = data[4+_UDP_FRAGMENT.size:]
 
-                node_name = data[2:2+name_length].decode()
-                field_name = data[2+name_length:2+name_length+field_length].decode()
+        message.chunks[index] = chunk
+        message.received += 1
+        message.size += len(chunk)
+        self.udp_fragments_bytes += len(chunk)
 
-                if field_name in self.anon_handlers:
-                    await self.anon_handlers[field_name](data[data_start:], node_name)
+        if message.received == count:
+            del self.udp_fragments[key]
+            self.udp_fragments_bytes -= message.size
 
-        return 4 + length
+            return b"".join(message.chunks)
+
+        while self.udp_fragments_bytes > UDP_REASSEMBLY_MAX_BYTES:
+            self._drop_fragments(next(iter(self.udp_fragments)))
+
+        return None
+
+    def _drop_fragments(self, key: tuple[AddrLike, int]) -> None:
+        message = self.udp_fragments.pop(key)
+
+        self.udp_fragments_bytes -= message.size
+        self.udp_fragments_dropped += 1
+
+        logging.debug(f"dropped incomplete UDP message from {key[0]}: {message.received} of {len(message.chunks)} fragments")
+
+    async def _udp_dispatch_mainloop(self, queue: _UDPQueue) -> None:
+        calls = queue.calls
+
+        while True:
+            if len(calls) == 0:
+                queue.wakeup.clear()
+                await queue.wakeup.wait()
+                continue
+
+            handler, args = calls.popleft()
+
+            try:
+                await handler(*args)
+            except Exception as e:
+                logging.error(e)
 
 
     async def mainloop(self):
-        r, w = await asyncio.open_connection(self.ip, self.port, family=socket.AF_INET)
+        loop = asyncio.get_running_loop()
 
-        self.r = r
-        self.w = w
+        self._dispatch_queue.clear()
+        self._dispatch_wakeup = asyncio.Event()
 
-        transport, protocol = await asyncio.get_event_loop().create_datagram_endpoint(
+        # UDP address is sent in reply to REQUEST_AUTH, so endpoint is created first
+        transport, protocol = await loop.create_datagram_endpoint(
             lambda: _ClientRecvProtocol(self),
             local_addr=("localhost", random.randint(12000, 65535)),
 
@@ -1256,9 +4032,72 @@ class AsyncDistrubutedClient(SockClient):
 
         self.transport = transport
 
+        # fragmented messages arrive in bursts
+        udp_sock = transport.get_extra_info("socket")
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 32)
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024 * 32)
+
+        # direct listener address is announced in reply to REQUEST_AUTH too
+        if self.direct:
+            await self._start_direct_server()
+
+        if self.family == socket.AF_UNIX:
+            self.w, self.protocol = await loop.create_unix_connection(lambda: _ClientProtocol(self), self.ip)
+        else:
+            self.w, self.protocol = await loop.create_connection(lambda: _ClientProtocol(self), self.ip, self.port, family=socket.AF_INET)
+
         self._is_running = True
 
-        await asyncio.gather(
-            self._tcp_mainloop(),
-            self._udp_mainloop(),
-        )
+        try:
+            await self._dispatch_mainloop()
+        finally:
+            for queue in self.udp_queues.values():
+                queue.task.cancel()
+
+            self.udp_queues.clear()
+            self.udp_fragments.clear()
+            self.udp_fragments_bytes = 0
+
+            for link in tuple(self.links.values()):
+                if link.transport is not None:
+                    link.transport.close()
+
+            if self.direct_server is not None:
+                for peers in self.peer_subscribers.values():
+                    for peer in peers:
+                        peer.transport.close()
+
+                self.direct_server.close()
+
+                if self.direct_addr.startswith("unix:") and os.path.exists(self.direct_addr[5:]):
+                    os.unlink(self.direct_addr[5:])
+
+                if self._direct_dir is not None:
+                    os.rmdir(self._direct_dir)
+                    self._direct_dir = None
+
+                self.direct_server = None
+
+            for worker in self.workers:
+                if worker.transport is not None:
+                    worker.transport.close()
+
+            self.workers = []
+            self.ring = None
+
+            for task in tuple(self._serving):
+                task.cancel()
+
+            for future in (*self._calls.values(), *self._gets.values(), *self._rosstat_waiters):
+                if not future.done():
+                    future.set_exception(ConnectionError("connection to server is closed"))
+
+            self._rosstat_waiters.clear()
+
+            self.links.clear()
+            self.peer_subscribers.clear()
+            self._failed_links.clear()
+            self._unbrokered.clear()
+            self._refresh.clear()
+            self.w.close()
+            self.transport.close()
@@ -0,0 +1,180 @@
+import struct
+
+# trace headers after TRACE opcode, wrapped message follows them
+TRACE_POST = struct.Struct(">Id")  # sequence number, published
+TRACE_SEND = struct.Struct(">Iddd") # sequence number, published, broker received, broker forwarded
+
+HOPS = (
+    "publisher->broker",  # publish call to broker`s receive (publisher`s socket, network)
+    "broker",             # broker`s receive to forward (broker`s processing, publisher`s messages before this one)
+    "broker->subscriber", # broker`s forward to subscriber`s receive (broker`s outbound queue, network)
+    "publisher->subscriber", # publish call to subscriber`s receive, for direct links without broker
+    "dispatch",           # subscriber`s receive to handler call (handlers queued before this one)
+    "handler",            # handler run time
+)
+
+HISTOGRAM_BUCKETS = 32 # bucket i counts latencies in [2^(i-1), 2^i) microseconds, the last one everything above
+
+
+class Trace:
+    """
+    Timing metadata of message from traced topic.
+    All times are unix times in seconds (see time.time), hops between hosts include their clock offset
+
+    :param seq: per-topic sequence number, gaps are lost messages
+    :param broker_received: 0.0 if message came directly from publisher
+    """
+
+    __slots__ = ("seq", "published", "broker_received", "broker_forwarded", "received", "handled", "done")
+
+    def __init__(self, seq: int, published: float, broker_received: float, broker_forwarded: float, received: float):
+        self.seq = seq
+        self.published = published
+        self.broker_received = broker_received
+        self.broker_forwarded = broker_forwarded
+        self.received = received # by subscriber
+        self.handled = 0.0       # handler was called
+        self.done = 0.0          # handler returned
+
+    def hops(self) -> dict[str, float]:
+        """
+        :return: hop -> seconds (see HOPS), only hops which message has passed
+        """
+
+        hops = {}
+
+        if self.broker_received:
+            hops["publisher->broker"] = self.broker_received - self.published
+            hops["broker"] = self.broker_forwarded - self.broker_received
+            hops["broker->subscriber"] = self.received - self.broker_forwarded
+        else:
+            hops["publisher->subscriber"] = self.received - self.published
+
+        if self.handled:
+            hops["dispatch"] = self.handled - self.received
+
+        if self.done:
+            hops["handler"] = self.done - self.handled
+
+        return hops
+
+    def __repr__(self) -> str:
+        return f"Trace(seq={self.seq}, " + ", ".join(f"{hop}={seconds * 1e3:.3f}ms" for hop, seconds in self.hops().items()) + ")"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        # clock offset between hosts can make hops negative
+        seconds = max(seconds, 0.0)
+
+        self.buckets[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """
+        :return: upper bound of bucket with q-th latency, in seconds
+        """
+
+        rank = q * self.count
+        seen = 0
+
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count > 0:
+                return min((1 << i) / 1e6, self.max)
+
+        return self.max
+
+
+class _TopicTraces:
+    __slots__ = ("count", "lost", "last_seq", "hops")
+
+    def __init__(self):
+        self.count = 0
+        self.lost = 0
+        self.last_seq: int | None = None
+        self.hops: dict[str, _Histogram] = {}
+
+
+class TraceAggregator:
+    """
+    Collects traces of received messages into per-topic latency histograms of every hop (see HOPS).
+    Pass it to AsyncROSClient as tracer, traces of all subscribed traced topics are added automatically
+    """
+
+    def __init__(self):
+        self.topics: dict[tuple[str, str], _TopicTraces] = {}
+
+    def add(self, node: str, field: str, trace: Trace) -> None:
+        topic = self.topics.get((node, field))
+
+        if topic is None:
+            topic = self.topics[(node, field)] = _TopicTraces()
+
+        # publisher`s restart starts sequence from the beginning
+        if topic.last_seq is not None and trace.seq > topic.last_seq:
+            topic.lost += trace.seq - topic.last_seq - 1
+
+        topic.last_seq = trace.seq
+        topic.count += 1
+
+        for hop, seconds in trace.hops().items():
+            histogram = topic.hops.get(hop)
+
+            if histogram is None:
+                histogram = topic.hops[hop] = _Histogram()
+
+            histogram.add(seconds)
+
+    def reset(self) -> None:
+        self.topics.clear()
+
+    def report(self) -> dict[str, dict]:
+        """
+        :return: {"node/field": {"count": ..., "lost": ..., "hops": {hop: {"count", "mean", "p50", "p90", "p99", "max"}}}}, times in milliseconds.
+            Percentiles are upper bounds of histogram buckets, so they are accurate within 2x
+        """
+
+        return {
+            f"{node}/{field}": {
+                "count": topic.count,
+                "lost": topic.lost,
+                "hops": {
+                    hop: {
+                        "count": histogram.count,
+                        "mean": histogram.total / histogram.count * 1e3,
+                        "p50": histogram.percentile(0.5) * 1e3,
+                        "p90": histogram.percentile(0.9) * 1e3,
+                        "p99": histogram.percentile(0.99) * 1e3,
+                        "max": histogram.max * 1e3,
+                    }
+                    for hop, histogram in sorted(topic.hops.items(), key=lambda item: HOPS.index(item[0]))
+                },
+            }
+            for (node, field), topic in self.topics.items()
+        }
+
+    def format(self) -> str:
+        """
+        :return: report as text table
+        """
+
+        lines = []
+
+        for topic, report in self.report().items():
+            lines.append(f"{topic}: {report['count']} messages, {report['lost']} lost")
+
+            for hop, stats in report["hops"].items():
+                lines.append(f"  {hop:>22}  mean {stats['mean']:>9.3f}  p50 {stats['p50']:>9.3f}  p90 {stats['p90']:>9.3f}  p99 {stats['p99']:>9.3f}  max {stats['max']:>9.3f} ms")
+
+        return "\n".join(lines)